@@ -1,13 +1,14 @@
 import os
 import sys
 import setup_lib
+import command_runner
 
 
 if os.getuid():
     sys.exit('You need root access to install!')
 
 
-os.system('clear')
+setup_lib.clear_screen()
 print()
 print()
 print("###################################")
@@ -28,7 +29,7 @@ print()
 server_port_choice = input("Which port would you like to use for the Configuration Page? [default: 80]: ")
 print()
 ssl_enabled_choice = input("Would you like to enable SSL during configuration mode \n(NOTICE: you will get a certificate ID error \nwhen connecting, but traffic will be encrypted) [y/N]?: ")
-os.system('clear')
+setup_lib.clear_screen()
 print()
 print()
 install_ans = input("Are you ready to commit changes to the system? [y/N]: ")
@@ -51,7 +52,7 @@ else:
 	print()
 	sys.exit()
 
-os.system('clear')
+setup_lib.clear_screen()
 print()
 print()
 print("#####################################")
@@ -63,4 +64,4 @@ print("Initial setup is complete. A reboot is required to start in WiFi configur
 reboot_ans = input("Would you like to do that now? [y/N]: ")
 
 if reboot_ans.lower() == 'y':
-	os.system('reboot')
+	command_runner.run(['reboot'])
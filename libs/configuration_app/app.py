@@ -1,22 +1,66 @@
-from flask import Flask, render_template, request
+from flask import Flask, render_template, request, Response, jsonify, stream_with_context
+import html
 import os
+import shutil
+import sys
 import time
-import subprocess
-from threading import Thread
-import fileinput
+from threading import current_thread, main_thread
 import json
+from wifi_scanner import WifiScanner
+import startup
+
+# reset_lib lives alongside this app in /usr/lib/raspiwifi/reset_device
+sys.path.append(os.path.join(os.path.dirname(os.path.realpath(__file__)), '..', 'reset_device'))
+import reset_lib
+import raspiwifi_config
+import boot_timeline
+import service_control
+import hostapd_config
+import known_networks
+import capabilities
+import command_runner
+import metrics
+import server
+import captive_portal
+from event_bus import EventBus
+from job_queue import JobQueue, FINISHED_STATES
+from status_log import StatusLog, LEVELS, format_record
+
+# Only needed once credentials are saved (or a debug page is opened), not to serve the first page
+glob = startup.lazy_import('glob')
+scan_parser = startup.lazy_import('scan_parser')
+client_transition = startup.lazy_import('client_transition')
+boot_orchestrator = startup.lazy_import('boot_orchestrator')
 
 app = Flask(__name__)
-app.debug = True
+# Debugger and reloader only in development mode (server_mode in raspiwifi.conf)
+app.debug = raspiwifi_config.get('server_mode') == 'development'
+
+# Answer OS connectivity probes from memory before any view (or scan) runs;
+# without the wildcard DNS entry no foreign host can reach the portal anyway
+if raspiwifi_config.get('captive_portal_dns'):
+    captive_portal.CaptivePortal(captive_portal.portal_url(raspiwifi_config.get('server_port'),
+                                                           raspiwifi_config.get('ssl_enabled'))).install(app)
+
+# Upper bound on networks offered in the index page drop-down
+MAX_LISTED_NETWORKS = 30
+
+SCAN_SECONDS = metrics.histogram('raspiwifi_scan_seconds', 'Duration of scan_wifi_networks()')
+SCAN_NETWORKS = metrics.gauge('raspiwifi_scan_networks', 'Networks found by the last scan')
+SCAN_FAILURES = metrics.counter('raspiwifi_scan_failures_total', 'Scans that raised an error')
+TRANSITION_SECONDS = metrics.histogram('raspiwifi_transition_seconds',
+                                       'Duration of switches to client mode, by final state')
+CONNECT_FAILURES = metrics.counter('raspiwifi_connect_failures_total', 'Failed connects, by classified reason')
 
 @app.route('/')
 def index():
-    wifi_ap_array = scan_wifi_networks()
-    config_hash = config_file_hash()
+    wifi_ap_array = wifi_scanner.get_networks()[:MAX_LISTED_NETWORKS]
+    config_hash = raspiwifi_config.load()
     
     return render_template('app.html', 
                          wifi_ap_array=wifi_ap_array, 
-                         config_hash=config_hash)
+                         config_hash=config_hash,
+                         connection_failure=last_connection_failure)
 
 @app.route('/manual_ssid_entry')
 def manual_ssid_entry():
@@ -24,7 +68,7 @@ def manual_ssid_entry():
 
 @app.route('/wpa_settings')
 def wpa_settings():
-    config_hash = config_file_hash()
+    config_hash = raspiwifi_config.load()
     return render_template('wpa_settings.html', wpa_enabled = config_hash['wpa_enabled'], wpa_key = config_hash['wpa_key'])
 
 
@@ -33,34 +77,113 @@ def save_credentials():
     ssid = request.form['ssid']
     wifi_key = request.form['wifi_key']
     
-    # Store credentials globally for transition function
-    current_wifi_credentials['ssid'] = ssid
-    current_wifi_credentials['key'] = wifi_key
+    last_connection_failure.clear()
     
     # Log SSID for debugging (helpful for special character issues)
     print(f"Connecting to SSID: '{ssid}' (length: {len(ssid)})")
     print(f"SSID bytes: {ssid.encode('utf-8')}")
     print(f"SSID repr: {repr(ssid)}")
+
+    # Progress events published after this point are streamed to the page
+    events_cursor = event_bus.last_id
+    update_connection_status({
+        'state': 'configuring',
+        'ssid': ssid,
+        'message': 'Credentials saved, switching to client mode...'
+    })
     
-    # Create wpa_supplicant.conf
-    create_wpa_supplicant(ssid, wifi_key)
-    
-    # Create NetworkManager connection
-    create_networkmanager_connection(ssid, wifi_key)
-    
-    # Call transition to client mode in a thread
-    def sleep_and_transition():
-        time.sleep(3)
-        transition_to_client_mode_with_status(ssid)
-    t = Thread(target=sleep_and_transition)
-    t.start()
+    # Newer credentials make queued connects pointless and cancel a running transition
+    job = network_jobs.submit('connect', lambda job: connect_to_network(job, ssid, wifi_key),
+                              description=ssid, supersede=True)
+
+    return render_template('save_credentials.html', ssid = ssid, events_cursor = events_cursor, job_id = job.id)
+
+
+@app.route('/jobs')
+def jobs():
+    """Recent network jobs with their state, queue wait and run time"""
+    return jsonify([job.as_dict() for job in network_jobs.jobs()])
+
+
+@app.route('/jobs/<int:job_id>')
+def job_status(job_id):
+    job = network_jobs.get(job_id)
+    if job is None:
+        return jsonify({'error': 'unknown job'}), 404
+    return jsonify(job.as_dict())
 
-    return render_template('save_credentials.html', ssid = ssid)
+
+@app.route('/events')
+def events():
+    """
+    Server-Sent Events stream of transition progress (log, status and phase
+    events). With ?job= it ends once that network job has finished.
+    """
+    cursor = request.headers.get('Last-Event-ID') or request.args.get('cursor', 0)
+    try:
+        cursor = int(cursor)
+    except ValueError:
+        cursor = 0
+
+    done = None
+    job_id = request.args.get('job', type=int)
+    if job_id is not None:
+        def done():
+            job = network_jobs.get(job_id)
+            return job is None or job.state in FINISHED_STATES
+
+    response = Response(stream_with_context(event_bus.stream(cursor, done=done)), mimetype='text/event-stream')
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['X-Accel-Buffering'] = 'no'
+    return response
+
+
+@app.route('/events/poll')
+def events_poll():
+    """Long-poll fallback: returns events after ?cursor=, waiting up to ?timeout= seconds"""
+    cursor = request.args.get('cursor', 0, type=int)
+    timeout = min(request.args.get('timeout', 25, type=float), 60)
+    new_events = event_bus.wait(cursor, timeout=timeout)
+    return jsonify({
+        'cursor': new_events[-1]['id'] if new_events else cursor,
+        'events': new_events
+    })
+
+
+@app.route('/logs')
+def logs():
+    """Buffered status log records after ?since=, filtered by ?level= (minimum) and ?phase="""
+    level = request.args.get('level')
+    if level is not None and level not in LEVELS:
+        return jsonify({'error': f'level must be one of {", ".join(LEVELS)}'}), 400
+    records = status_log.query(since=request.args.get('since', 0, type=int),
+                               level=level,
+                               phase=request.args.get('phase'),
+                               limit=request.args.get('limit', type=int))
+    return jsonify({
+        'cursor': records[-1]['seq'] if records else status_log.last_seq,
+        'records': records
+    })
+
+
+@app.route('/metrics')
+def metrics_endpoint():
+    """Prometheus text format metrics of the portal and the other RaspiWiFi processes"""
+    return Response(metrics.exposition(metrics.exporter_job() or 'portal'), content_type=metrics.CONTENT_TYPE)
+
+
+@app.route('/commands')
+def commands():
+    """Run counts, outcomes and run times of the external commands this portal ran, by program"""
+    return jsonify({
+        'max_concurrent': command_runner.MAX_CONCURRENT,
+        'programs': command_runner.stats()
+    })
 
 
 @app.route('/save_wpa_credentials', methods = ['GET', 'POST'])
 def save_wpa_credentials():
-    config_hash = config_file_hash()
+    config_hash = raspiwifi_config.load()
     wpa_enabled = request.form.get('wpa_enabled')
     wpa_key = request.form['wpa_key']
 
@@ -69,18 +192,16 @@ def save_wpa_credentials():
     else:
         update_wpa(0, wpa_key)
 
-    def sleep_and_restart_services():
-        time.sleep(2)
-        # Restart hostapd service to apply WPA changes
-        subprocess.run(['systemctl', 'unmask', 'hostapd'])
-        subprocess.run(['systemctl', 'unmask', 'dnsmasq'])
-        subprocess.run(['systemctl', 'restart', 'hostapd'])
-        subprocess.run(['systemctl', 'restart', 'dnsmasq'])
+    def reload_hostapd(job):
+        # Let the page load before the access point drops its clients
+        if job.sleep(2):
+            return
+        # hostapd re-reads its configuration; clients reconnect with the new key
+        hostapd_config.apply_from_config()
 
-    t = Thread(target=sleep_and_restart_services)
-    t.start()
+    network_jobs.submit('ap_settings', reload_hostapd)
 
-    config_hash = config_file_hash()
+    config_hash = raspiwifi_config.load()
     return render_template('save_wpa_credentials.html', wpa_enabled = config_hash['wpa_enabled'], wpa_key = config_hash['wpa_key'])
 
 
@@ -89,58 +210,37 @@ def save_wpa_credentials():
 ######## FUNCTIONS ##########
 
 def scan_wifi_networks():
-    iwlist_raw = subprocess.Popen(['iwlist', 'scan'], stdout=subprocess.PIPE)
-    ap_list, err = iwlist_raw.communicate()
-    ap_array = []
-
-    for line in ap_list.decode('utf-8', errors='replace').rsplit('\n'):
-        if 'ESSID' in line and 'ESSID:' in line:
-            # Extract everything after 'ESSID:' and remove quotes
-            essid_part = line.split('ESSID:', 1)[1].strip()
-            if essid_part and essid_part != '""':
-                # Remove surrounding quotes if present
-                ap_ssid = essid_part.strip('"')
-                if ap_ssid:
-                    ap_array.append(ap_ssid)
-
-    return ap_array
+    """Scan for nearby networks, one entry per SSID ranked strongest first"""
+    profile = capabilities.profile()
+    if profile['scanner'] is None:
+        raise RuntimeError('iwlist is not installed')
+    try:
+        with SCAN_SECONDS.time():
+            networks = scan_parser.rank_networks(scan_parser.scan(profile['interface']))
+    except Exception:
+        SCAN_FAILURES.inc()
+        raise
+    SCAN_NETWORKS.set(len(networks))
+    return networks
 
 def create_wpa_supplicant(ssid, wifi_key):
     # Use /tmp directory for temporary file to ensure write permissions
     temp_file_path = '/tmp/wpa_supplicant.conf.tmp'
     
     try:
-        # Stop NetworkManager temporarily to prevent interference during configuration
-        subprocess.run(['systemctl', 'stop', 'NetworkManager'], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        # Stop NetworkManager temporarily to prevent interference during
+        # configuration, and wpa_supplicant before its config is replaced
+        service_control.apply({
+            'NetworkManager': service_control.want(active=False),
+            'wpa_supplicant': service_control.want(active=False),
+        })
         
         # Create the temporary file with explicit UTF-8 encoding
         temp_conf_file = open(temp_file_path, 'w', encoding='utf-8')
 
-        # Write wpa_supplicant configuration with proper driver settings
-        temp_conf_file.write('ctrl_interface=DIR=/var/run/wpa_supplicant GROUP=netdev\n')
-        temp_conf_file.write('update_config=1\n')
-        temp_conf_file.write('country=US\n')
-        temp_conf_file.write('ap_scan=1\n')  # Enable AP scanning
-        temp_conf_file.write('\n')
-        temp_conf_file.write('network={\n')
-        # Properly escape SSID and password for wpa_supplicant config
-        escaped_ssid = ssid.replace('\\', '\\\\').replace('"', '\\"')
-        temp_conf_file.write(f'    ssid="{escaped_ssid}"\n')
-
-        if wifi_key == '':
-            temp_conf_file.write('    key_mgmt=NONE\n')
-        else:
-            # Use plain text password for better compatibility and simplicity
-            escaped_key = wifi_key.replace('\\', '\\\\').replace('"', '\\"')
-            temp_conf_file.write(f'    psk="{escaped_key}"\n')
-            temp_conf_file.write('    key_mgmt=WPA-PSK\n')
-            temp_conf_file.write('    proto=RSN WPA\n')  # Support both WPA and WPA2
-            temp_conf_file.write('    pairwise=CCMP TKIP\n')  # Support both encryption types
-            temp_conf_file.write('    group=CCMP TKIP\n')
-            temp_conf_file.write('    scan_ssid=1\n')  # Allow hidden networks
-
-        temp_conf_file.write('    priority=1\n')  # Give this network highest priority
-        temp_conf_file.write('    }\n')
+        # Every known network, the one just submitted at the highest priority, so
+        # wpa_supplicant can fall back to another known network on its own
+        temp_conf_file.write(known_networks.render_wpa_supplicant(ranked_known_networks(ssid)))
 
         # Ensure data is written to disk
         temp_conf_file.flush()
@@ -152,27 +252,26 @@ def create_wpa_supplicant(ssid, wifi_key):
             raise Exception("Temporary file was not created")
 
         # Stop wpa_supplicant completely before replacing config
-        subprocess.run(['systemctl', 'stop', 'wpa_supplicant'])
-        subprocess.run(['killall', 'wpa_supplicant'], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        command_runner.run(['killall', 'wpa_supplicant'])
 
-        # Move the file and set proper permissions using subprocess for safety
-        move_result = subprocess.run(['mv', temp_file_path, '/etc/wpa_supplicant/wpa_supplicant.conf'], capture_output=True)
-        if move_result.returncode != 0:
-            raise Exception(f"Failed to move wpa_supplicant.conf to /etc/wpa_supplicant/: {move_result.stderr.decode()}")
+        # Move the file into place (/tmp may be another filesystem)
+        try:
+            shutil.move(temp_file_path, '/etc/wpa_supplicant/wpa_supplicant.conf')
+        except OSError as e:
+            raise Exception(f"Failed to move wpa_supplicant.conf to /etc/wpa_supplicant/: {e}")
             
         # Verify the final file was created
         if not os.path.exists('/etc/wpa_supplicant/wpa_supplicant.conf'):
             raise Exception("wpa_supplicant.conf was not created in /etc/wpa_supplicant/")
 
         # Set proper permissions (readable/writable by root only)
-        subprocess.run(['chmod', '600', '/etc/wpa_supplicant/wpa_supplicant.conf'])
+        os.chmod('/etc/wpa_supplicant/wpa_supplicant.conf', 0o600)
         
         # Unmask and enable wpa_supplicant service
-        subprocess.run(['systemctl', 'unmask', 'wpa_supplicant'])
-        subprocess.run(['systemctl', 'enable', 'wpa_supplicant'])
+        service_control.apply({'wpa_supplicant': service_control.want(enabled=True)})
         
         # Force filesystem sync to ensure all writes are completed
-        subprocess.run(['sync'])
+        os.sync()
         
         # Validate the file contents to ensure it's properly formatted
         try:
@@ -194,311 +293,151 @@ def create_wpa_supplicant(ssid, wifi_key):
         raise e
 
 def set_ap_client_mode():
-    subprocess.run(['rm', '-f', '/etc/raspiwifi/host_mode'])
-    subprocess.run(['rm', '/etc/cron.raspiwifi/aphost_bootstrapper'])
-    subprocess.run(['cp', '/usr/lib/raspiwifi/reset_device/static_files/apclient_bootstrapper', '/etc/cron.raspiwifi/'])
-    subprocess.run(['chmod', '+x', '/etc/cron.raspiwifi/apclient_bootstrapper'])
-    subprocess.run(['mv', '/etc/dnsmasq.conf.original', '/etc/dnsmasq.conf'])
-    subprocess.run(['mv', '/etc/dhcpcd.conf.original', '/etc/dhcpcd.conf'])
-    
-    # Stop AP mode services
-    subprocess.run(['systemctl', 'stop', 'hostapd'])
-    subprocess.run(['systemctl', 'stop', 'dnsmasq'])
-    subprocess.run(['systemctl', 'disable', 'hostapd'])
-    subprocess.run(['systemctl', 'disable', 'dnsmasq'])
-    
-    # Restart network services for client mode
-    subprocess.run(['systemctl', 'restart', 'dhcpcd'])
+    interface = capabilities.interface()
+    reset_lib.remove_files('/etc/raspiwifi/host_mode', '/etc/cron.raspiwifi/aphost_bootstrapper')
+    reset_lib.install_bootstrapper('apclient_bootstrapper')
+    reset_lib.move_file('/etc/dnsmasq.conf.original', '/etc/dnsmasq.conf')
+    reset_lib.move_file('/etc/dhcpcd.conf.original', '/etc/dhcpcd.conf')
+    
+    # Stop AP mode services and restart network services for client mode
+    service_control.apply({
+        'hostapd': service_control.want(enabled=False, active=False),
+        'dnsmasq': service_control.want(enabled=False, active=False),
+        'dhcpcd': service_control.want(restart=True),
+    })
     
     # Restart network interface to apply new configuration
     restart_network_interface()
     
     # Start and enable wpa_supplicant for WiFi client mode
-    subprocess.run(['systemctl', 'start', 'wpa_supplicant'])
-    subprocess.run(['systemctl', 'enable', 'wpa_supplicant'])
+    service_control.apply({'wpa_supplicant': service_control.want(enabled=True, active=True)})
     
     # Wait for connection to establish
     time.sleep(5)
     
     # Try to connect to the WiFi network
-    subprocess.run(['wpa_cli', '-i', 'wlan0', 'reconfigure'])
-    subprocess.run(['dhclient', 'wlan0'])
+    command_runner.run(['wpa_cli', '-i', interface, 'reconfigure'])
+    # dhclient forks into the background and keeps its output open; do not capture it
+    command_runner.run(['dhclient', interface], capture=False)
     
     # Optionally enable NetworkManager for GUI compatibility
     # This allows the WiFi icon in the desktop to work properly
-    subprocess.run(['systemctl', 'enable', 'NetworkManager'])
-    subprocess.run(['systemctl', 'start', 'NetworkManager'])
+    service_control.apply({'NetworkManager': service_control.want(enabled=True, active=True)})
 
 def update_wpa(wpa_enabled, wpa_key):
-    with fileinput.FileInput('/etc/raspiwifi/raspiwifi.conf', inplace=True) as raspiwifi_conf:
-        for line in raspiwifi_conf:
-            if 'wpa_enabled=' in line:
-                line_array = line.split('=')
-                line_array[1] = wpa_enabled
-                print(line_array[0] + '=' + str(line_array[1]))
-
-            if 'wpa_key=' in line:
-                line_array = line.split('=')
-                line_array[1] = wpa_key
-                print(line_array[0] + '=' + line_array[1])
-
-            if 'wpa_enabled=' not in line and 'wpa_key=' not in line:
-                print(line, end='')
-
-
-def config_file_hash():
-    config_hash = {}
-    try:
-        with open('/etc/raspiwifi/raspiwifi.conf', 'r') as config_file:
-            for line in config_file:
-                if '=' in line:
-                    line_key = line.split("=")[0]
-                    line_value = line.split("=")[1].rstrip()
-                    config_hash[line_key] = line_value
-    except (FileNotFoundError, IOError) as e:
-        print(f"Warning: Could not read config file: {e}")
-        # Return default values if config file is missing
-        config_hash = {
-            'ssl_enabled': '0',
-            'server_port': '80',
-            'wpa_enabled': '0',
-            'wpa_key': ''
-        }
-    return config_hash
+    raspiwifi_config.update(wpa_enabled=wpa_enabled, wpa_key=wpa_key)
 
 def restart_network_interface():
-    """Restart wlan0 interface to apply new network configuration"""
-    subprocess.run(['ip', 'link', 'set', 'wlan0', 'down'])
+    """Restart the wireless interface to apply new network configuration"""
+    interface = capabilities.interface()
+    command_runner.run(['ip', 'link', 'set', interface, 'down'])
     time.sleep(1)
-    subprocess.run(['ip', 'link', 'set', 'wlan0', 'up'])
+    command_runner.run(['ip', 'link', 'set', interface, 'up'])
     time.sleep(2)
     
     # Restart networking to ensure configuration is applied
-    subprocess.run(['systemctl', 'restart', 'networking'])
+    service_control.apply({'networking': service_control.want(restart=True)})
 
 def ensure_ap_mode_ip():
-    """Ensure wlan0 has static IP 10.0.0.1 when in AP mode"""
+    """Ensure the wireless interface has static IP 10.0.0.1 when in AP mode"""
+    interface = capabilities.interface()
     # Check if we're in host mode (AP mode)
     if os.path.exists('/etc/raspiwifi/host_mode'):
         # Stop NetworkManager if it's running to avoid conflicts
-        subprocess.run(['systemctl', 'stop', 'NetworkManager'], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        service_control.apply({'NetworkManager': service_control.want(active=False)})
         
         # Bring interface down and up to reset it
-        subprocess.run(['ip', 'link', 'set', 'wlan0', 'down'], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        command_runner.run(['ip', 'link', 'set', interface, 'down'])
         time.sleep(1)
-        subprocess.run(['ip', 'link', 'set', 'wlan0', 'up'])
+        command_runner.run(['ip', 'link', 'set', interface, 'up'])
         time.sleep(1)
         
         # Set static IP immediately for AP mode
-        subprocess.run(['ifconfig', 'wlan0', '10.0.0.1', 'netmask', '255.255.255.0', 'up'])
+        command_runner.run(['ifconfig', interface, '10.0.0.1', 'netmask', '255.255.255.0', 'up'])
         
         # Verify it worked
-        result = subprocess.run('ifconfig wlan0 | grep "inet 10.0.0.1"', shell=True, capture_output=True)
-        if result.returncode != 0:
+        if reset_lib.interface_ipv4_address(interface) != '10.0.0.1':
             # Try alternative method if first attempt failed
-            subprocess.run(['ip', 'addr', 'add', '10.0.0.1/24', 'dev', 'wlan0'], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
-            subprocess.run(['ip', 'link', 'set', 'wlan0', 'up'])
+            command_runner.run(['ip', 'addr', 'add', '10.0.0.1/24', 'dev', interface])
+            command_runner.run(['ip', 'link', 'set', interface, 'up'])
         
         # Ensure dhcpcd is managing the interface properly
-        subprocess.run(['systemctl', 'restart', 'dhcpcd'], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        service_control.apply({'dhcpcd': service_control.want(restart=True)})
+
+def connect_to_network(job, ssid, wifi_key):
+    """Network job: write the client configuration and switch to client mode"""
+    # Derives the PSK (4096 PBKDF2 rounds), so it runs here and not in the request
+    known_networks.remember(ssid, wifi_key)
+
+    # Give the page time to load before the access point goes down
+    if job.sleep(3):
+        return
+
+    # Create wpa_supplicant.conf
+    create_wpa_supplicant(ssid, wifi_key)
 
-def transition_to_client_mode_with_status(ssid):
+    # Create NetworkManager connections
+    create_networkmanager_connections(ssid)
+
+    if not job.cancelled():
+        transition_to_client_mode_with_status(ssid, wifi_key, cancelled=job.cancelled)
+
+def transition_to_client_mode_with_status(ssid, wifi_key, cancelled=None):
     """Transition to client mode"""
-    
-    # Stop AP mode services
-    subprocess.run(['systemctl', 'stop', 'hostapd'])
-    subprocess.run(['systemctl', 'stop', 'dnsmasq']) 
-    subprocess.run(['systemctl', 'disable', 'hostapd'])
-    subprocess.run(['systemctl', 'disable', 'dnsmasq'])
-    
-    # Reset network interface
-    subprocess.run(['ip', 'addr', 'flush', 'dev', 'wlan0'])
-    subprocess.run(['ip', 'link', 'set', 'wlan0', 'down'])
-    subprocess.run(['ip', 'link', 'set', 'wlan0', 'up'])
-    
-    # Stop any existing wpa_supplicant processes
-    subprocess.run(['killall', 'wpa_supplicant'], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
-    subprocess.run(['systemctl', 'stop', 'wpa_supplicant'], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
-    
-    # Configure dhcpcd for client mode
-    log_status("Configuring dhcpcd for client mode...")
-    subprocess.run('cp /etc/dhcpcd.conf.original /etc/dhcpcd.conf 2>/dev/null || echo "# dhcpcd config for client mode" > /etc/dhcpcd.conf', shell=True)
-    subprocess.run(['systemctl', 'restart', 'dhcpcd'])
-    
-    # Start NetworkManager first and let it handle the connection
-    log_status("Starting NetworkManager to handle WiFi connection...")
-    subprocess.run(['systemctl', 'unmask', 'NetworkManager'])
-    subprocess.run(['systemctl', 'enable', 'NetworkManager']) 
-    subprocess.run(['systemctl', 'restart', 'NetworkManager'])
-    
-    # Wait for NetworkManager to start
-    time.sleep(5)
-    
-    nm_running = subprocess.run(['systemctl', 'is-active', 'NetworkManager'], capture_output=True).returncode == 0
-    log_status(f"NetworkManager status: {'running' if nm_running else 'failed'}")
-    
-    if nm_running:
-        # Try NetworkManager connection first
-        update_connection_status({
-            'state': 'connecting',
-            'ssid': ssid,
-            'message': 'Attempting WiFi connection via NetworkManager...'
-        })
-        
-        log_status(f"Attempting NetworkManager connection to '{ssid}'...")
-        log_status(f"SSID contains: spaces={' ' in ssid}, apostrophe={chr(39) in ssid}")
-        
-        # Get WiFi key from stored credentials
-        wifi_key = current_wifi_credentials.get('key', '')
-        
-        # Use subprocess for better shell escaping instead of os.system
-        quoted_ssid = f'"{ssid}"'
-        try:
-            # Try with password if available
-            if wifi_key and wifi_key.strip():
-                cmd = ['nmcli', 'device', 'wifi', 'connect', quoted_ssid, 'password', wifi_key]
-                log_status("Connecting with password...")
-            else:
-                cmd = ['nmcli', 'device', 'wifi', 'connect', quoted_ssid]
-                log_status("Connecting without password (open network)...")
-                
-            log_status(f"Running command: {' '.join(['nmcli', 'device', 'wifi', 'connect', repr(ssid), '...'])}")
-            result = subprocess.run(cmd, capture_output=True, text=True, timeout=30)
-            nm_result = result.returncode
-            
-            if nm_result != 0:
-                log_status(f"NetworkManager error: {result.stderr.strip()}")
-                log_status(f"NetworkManager stdout: {result.stdout.strip()}")
-            else:
-                log_status("NetworkManager command completed successfully")
-                
-        except subprocess.TimeoutExpired:
-            log_status("NetworkManager connection timed out")
-            nm_result = 1
-        except Exception as e:
-            log_status(f"NetworkManager connection error: {str(e)}")
-            nm_result = 1
-            
-        if nm_result == 0:
-            log_status("NetworkManager connection successful!")
-            time.sleep(3)
-            # Check if we got IP
-            ip_result = subprocess.run('ip addr show wlan0 | grep "inet " | grep -v "127.0.0.1"', shell=True, capture_output=True).returncode
-            if ip_result == 0:
-                log_status("IP address obtained via NetworkManager!")
-                update_connection_status({
-                    'state': 'connected',
-                    'ssid': ssid,
-                    'message': 'Connected via NetworkManager'
-                })
-                final_check()
-                return
-        else:
-            # Try fallback method with connection profile
-            log_status("Direct connection failed, trying connection profile method...")
-            try:
-                result = subprocess.run(['nmcli', 'connection', 'up', ssid], 
-                                      capture_output=True, text=True, timeout=30)
-                if result.returncode == 0:
-                    log_status("Connection profile method successful!")
-                    time.sleep(3)
-                    ip_result = subprocess.run('ip addr show wlan0 | grep "inet " | grep -v "127.0.0.1"', shell=True, capture_output=True).returncode
-                    if ip_result == 0:
-                        log_status("IP address obtained via connection profile!")
-                        update_connection_status({
-                            'state': 'connected',
-                            'ssid': ssid,
-                            'message': 'Connected via NetworkManager profile'
-                        })
-                        final_check()
-                        return
-                else:
-                    log_status(f"Connection profile error: {result.stderr.strip()}")
-            except Exception as e:
-                log_status(f"Connection profile method error: {str(e)}")
-    
-    # If NetworkManager failed completely, try wpa_supplicant as fallback
-    log_status("NetworkManager connection failed, trying wpa_supplicant fallback...")
-    
-    # Stop NetworkManager to avoid conflicts
-    subprocess.run(['systemctl', 'stop', 'NetworkManager'])
-    
-    # Start wpa_supplicant manually with specific config
-    log_status("Starting wpa_supplicant manually...")
-    wpa_cmd = 'wpa_supplicant -B -i wlan0 -D nl80211,wext -c /etc/wpa_supplicant/wpa_supplicant.conf'
-    wpa_result = subprocess.run(wpa_cmd, shell=True).returncode
-    
-    if wpa_result == 0:
-        time.sleep(3)
-        wpa_running = subprocess.run(['pgrep', 'wpa_supplicant'], capture_output=True).returncode == 0
-        
-        if wpa_running:
-            log_status("wpa_supplicant started successfully, triggering connection...")
-            subprocess.run(['wpa_cli', '-i', 'wlan0', 'reconfigure'])
-            subprocess.run(['wpa_cli', '-i', 'wlan0', 'reassociate'])
-            
-            update_connection_status({
-                'state': 'connecting',
-                'ssid': ssid,
-                'message': 'Attempting WiFi connection via wpa_supplicant...'
-            })
-            
-            # Wait for connection and check for IP
-            max_attempts = 8
-            connected = False
-            
-            for attempt in range(max_attempts):
-                time.sleep(3)
-                
-                # Check if we have an IP address
-                ip_result = subprocess.run('ip addr show wlan0 | grep "inet " | grep -v "127.0.0.1"', shell=True, capture_output=True).returncode
-                if ip_result == 0:
-                    log_status("Connection successful - IP address obtained!")
-                    connected = True
-                    break
-                
-                # Check wpa_supplicant status
-                wpa_status = subprocess.run('wpa_cli -i wlan0 status | grep "wpa_state=COMPLETED"', shell=True, capture_output=True).returncode
-                if wpa_status == 0:
-                    log_status("wpa_supplicant connected, requesting IP...")
-                    subprocess.run(['dhclient', 'wlan0'], stderr=subprocess.DEVNULL)
-                    time.sleep(2)
-                    continue
-                
-                log_status(f"Connection attempt {attempt + 1}/{max_attempts}...")
-                subprocess.run(['wpa_cli', '-i', 'wlan0', 'reassociate'])
-            
-            if connected:
-                update_connection_status({
-                    'state': 'connected',
-                    'ssid': ssid,
-                    'message': 'Connected via wpa_supplicant'
-                })
-            else:
-                log_status("wpa_supplicant connection failed", is_error=True)
-                update_connection_status({
-                    'state': 'connection_failed',
-                    'ssid': ssid,
-                    'message': f'Failed to connect to WiFi network {ssid}'
-                })
-        else:
-            log_status("Failed to start wpa_supplicant", is_error=True)
+    transition = client_transition.ClientTransition(
+        ssid,
+        wifi_key,
+        log=log_status,
+        update_status=update_connection_status,
+        publish=event_bus.publish,
+        cancelled=cancelled)
+    started = time.monotonic()
+    connected = transition.run()
+    TRANSITION_SECONDS.observe(time.monotonic() - started, result=transition.state)
+    signal = reset_lib.wifi_link_status(transition.interface).signal
+    if connected:
+        known_networks.record_success(transition.connected_ssid, time.monotonic() - started, signal)
+    elif transition.cancelled():
+        # Superseded by newer credentials; that job takes over from here
+        return
     else:
-        log_status("wpa_supplicant command failed", is_error=True)
-    
+        known_networks.record_failure(ssid)
+        if transition.connected_ssid is not None:
+            # Another known network was joined instead; credit that one
+            known_networks.record_success(transition.connected_ssid, time.monotonic() - started, signal)
+        CONNECT_FAILURES.inc(reason=transition.failure.reason if transition.failure else 'unknown')
+        if transition.failure is not None and transition.failure.hard:
+            # Retrying will not help; bring the portal back so the user can correct it
+            rollback_to_ap_mode(ssid, transition.failure)
+            return
+
     # Final status check
     final_check()
 
+def rollback_to_ap_mode(ssid, failure):
+    """Restore AP mode after a hard connect failure and keep the reason for the index page"""
+    log_status(f"Returning to AP mode: {failure.message}", is_error=True)
+    last_connection_failure.update(failure.as_dict(), ssid=ssid)
+    restored = boot_orchestrator.restore_ap_mode(log=log_status)
+    update_connection_status({
+        'state': 'ap_restored' if restored else 'connection_failed',
+        'ssid': ssid,
+        'reason': failure.reason,
+        'message': f'{failure.message}: {ssid}. '
+                   + ('The setup network is back, reconnect to it to try again.' if restored
+                      else 'The setup network could not be restored.')
+    })
+
 def final_check():
     """Perform final connectivity check and update status"""
+    interface = capabilities.interface()
     log_status("Performing final connectivity check...")
     
     # Check if we have an IP address
-    ip_result = subprocess.run('ip addr show wlan0 | grep "inet " | grep -v "127.0.0.1"', shell=True, capture_output=True).returncode
-    if ip_result == 0:
+    address = reset_lib.interface_ipv4_address(interface)
+    if address is not None and not address.startswith('127.'):
         # Check internet connectivity
-        ping_result = subprocess.run(['ping', '-c', '1', '-W', '5', '8.8.8.8'], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL).returncode
-        if ping_result == 0:
+        if command_runner.ok(['ping', '-c', '1', '-W', '5', '8.8.8.8']):
             log_status("Final check: Full internet connectivity confirmed")
         else:
             log_status("Final check: Local network connected but no internet")
@@ -507,6 +446,7 @@ def final_check():
 
 def debug_wifi_configs():
     """Debug function to check all WiFi configuration sources"""
+    interface = capabilities.interface()
     debug_info = []
     
     # Check wpa_supplicant.conf
@@ -518,7 +458,6 @@ def debug_wifi_configs():
         debug_info.append("wpa_supplicant.conf not found or not readable")
     
     # Check NetworkManager connections
-    import glob
     nm_connections = glob.glob('/etc/NetworkManager/system-connections/*')
     if nm_connections:
         debug_info.append(f"NetworkManager connections found: {nm_connections}")
@@ -533,8 +472,8 @@ def debug_wifi_configs():
     
     # Check current WiFi connection
     try:
-        result = subprocess.run(['iwconfig', 'wlan0'], capture_output=True, text=True)
-        debug_info.append(f"Current wlan0 status:\n{result.stdout}")
+        result = command_runner.run(['iwconfig', interface])
+        debug_info.append(f"Current {interface} status:\n{result.stdout}")
     except:
         debug_info.append("Could not get iwconfig status")
     
@@ -548,10 +487,14 @@ def debug_wifi_configs():
     
     return debug_info
 
+def debug_routes_enabled():
+    """Debug routes are switched on with debug_routes=1, independently of server_mode"""
+    return raspiwifi_config.get('debug_routes')
+
 @app.route('/debug_wifi')
 def debug_wifi():
     """Debug route to show all WiFi configurations"""
-    if app.debug:  # Only available in debug mode
+    if debug_routes_enabled():
         debug_info = debug_wifi_configs()
         debug_html = "<h1>WiFi Debug Information</h1>"
         for info in debug_info:
@@ -563,39 +506,50 @@ def debug_wifi():
 @app.route('/connection_status')
 def connection_status():
     """Check the current WiFi connection status"""
-    if app.debug:
+    if debug_routes_enabled():
         status_info = []
+        interface = capabilities.interface()
+
+        # Kernel link snapshot (no process fork)
+        link = reset_lib.wifi_link_status(interface)
+        status_info.append(f"Link Status:\nassociated={link.associated} signal={link.signal} dBm "
+                           f"link_quality={link.link_quality} operstate={link.operstate} "
+                           f"carrier={link.carrier} source={link.source}")
         
         # Check wpa_supplicant status
         try:
-            result = subprocess.run(['wpa_cli', '-i', 'wlan0', 'status'], capture_output=True, text=True)
+            result = command_runner.run(['wpa_cli', '-i', interface, 'status'])
             status_info.append(f"WPA Supplicant Status:\n{result.stdout}")
         except:
             status_info.append("Could not get wpa_supplicant status")
         
         # Check network interface status
         try:
-            result = subprocess.run(['ifconfig', 'wlan0'], capture_output=True, text=True)
-            status_info.append(f"wlan0 Interface Status:\n{result.stdout}")
+            result = command_runner.run(['ifconfig', interface])
+            status_info.append(f"{interface} Interface Status:\n{result.stdout}")
         except:
-            status_info.append("Could not get wlan0 interface status")
+            status_info.append(f"Could not get {interface} interface status")
         
         # Check routing table
         try:
-            result = subprocess.run(['route', '-n'], capture_output=True, text=True)
+            result = command_runner.run(['route', '-n'])
             status_info.append(f"Routing Table:\n{result.stdout}")
         except:
             status_info.append("Could not get routing table")
         
         # Check if we can ping gateway
         try:
-            result = subprocess.run(['ping', '-c', '1', '8.8.8.8'], capture_output=True, text=True)
+            result = command_runner.run(['ping', '-c', '1', '8.8.8.8'])
             if result.returncode == 0:
                 status_info.append("Internet connectivity: SUCCESS")
             else:
                 status_info.append("Internet connectivity: FAILED")
         except:
             status_info.append("Could not test internet connectivity")
+
+        # Last transition attempts from the in-memory status log (SSIDs are user input)
+        recent = '\n'.join(format_record(record) for record in status_log.query(limit=50))
+        status_info.append(f"Recent Status Log:\n{html.escape(recent)}")
         
         status_html = "<h1>WiFi Connection Status</h1>"
         for info in status_info:
@@ -604,84 +558,21 @@ def connection_status():
     else:
         return "Debug mode not enabled", 403
 
-def create_networkmanager_connection(ssid, wifi_key):
+def ranked_known_networks(ssid):
+    """Known networks in connect order: ssid first, then by score against the scan cache"""
+    return known_networks.ranked(wifi_scanner.get_networks(max_age=float('inf')), prefer=ssid)
+
+def create_networkmanager_connections(ssid):
     """
-    Create a NetworkManager connection profile for the WiFi network.
+    Create a NetworkManager connection profile for every known WiFi network.
     This provides redundancy and compatibility with NetworkManager-based systems.
     """
-    import uuid
-    import secrets
-    
     try:
-        # Create system-connections directory if it doesn't exist
-        os.makedirs('/etc/NetworkManager/system-connections', exist_ok=True)
-        
-        # Generate a unique UUID for this connection
-        connection_uuid = str(uuid.uuid4())
-        
-        # Use UUID for filename to avoid filesystem issues with special characters
-        connection_file = f'/etc/NetworkManager/system-connections/{connection_uuid}.nmconnection'
-        
-        # Create temporary file first
-        temp_file = f'/tmp/{connection_uuid}.nmconnection.tmp'
-        
-        with open(temp_file, 'w', encoding='utf-8') as f:
-            f.write('[connection]\n')
-            # Properly escape SSID for NetworkManager config
-            escaped_ssid = ssid.replace('\\', '\\\\').replace('\n', '\\n').replace('\r', '\\r')
-            f.write(f'id="{escaped_ssid}"\n')
-            f.write(f'uuid={connection_uuid}\n')
-            f.write('type=wifi\n')
-            f.write('autoconnect=true\n')
-            f.write('autoconnect-priority=1\n')
-            f.write('\n')
-            
-            f.write('[wifi]\n')
-            f.write(f'ssid="{escaped_ssid}"\n')
-            f.write('mode=infrastructure\n')
-            f.write('\n')
-            
-            if wifi_key == '':
-                # Open network (no security)
-                f.write('[wifi-security]\n')
-                f.write('key-mgmt=none\n')
-            else:
-                # WPA/WPA2 network - properly escape password
-                escaped_key = wifi_key.replace('\\', '\\\\').replace('\n', '\\n').replace('\r', '\\r')
-                f.write('[wifi-security]\n')
-                f.write('key-mgmt=wpa-psk\n')
-                f.write(f'psk="{escaped_key}"\n')
-            
-            f.write('\n')
-            f.write('[ipv4]\n')
-            f.write('method=auto\n')
-            f.write('\n')
-            
-            f.write('[ipv6]\n')
-            f.write('method=auto\n')
-            
-        # Move temp file to final location and set permissions using subprocess for safety
-        move_result = subprocess.run(['mv', temp_file, connection_file], capture_output=True)
-        if move_result.returncode != 0:
-            raise Exception(f"Failed to create NetworkManager connection file: {connection_file}, error: {move_result.stderr.decode()}")
-            
-        # Set strict permissions (only root can read/write)
-        subprocess.run(['chmod', '600', connection_file])
-        subprocess.run(['chown', 'root:root', connection_file])
-        
-        # Verify file was created
-        if not os.path.exists(connection_file):
-            raise Exception(f"NetworkManager connection file was not created: {connection_file}")
-        
-        print(f"NetworkManager connection created: {connection_file}")
+        for connection_file in known_networks.write_nm_profiles(ranked_known_networks(ssid)):
+            print(f"NetworkManager connection created: {connection_file}")
         return True
-        
-    except Exception as e:
-        # Clean up temp file if it exists
-        temp_file = f'/tmp/{connection_uuid}.nmconnection.tmp'
-        if os.path.exists(temp_file):
-            os.remove(temp_file)
-        print(f"Failed to create NetworkManager connection: {str(e)}")
+    except OSError as e:
+        print(f"Failed to create NetworkManager connections: {str(e)}")
         return False
 
 def cleanup_old_network_connections():
@@ -690,7 +581,7 @@ def cleanup_old_network_connections():
     """
     try:
         # Get list of NetworkManager connections
-        result = subprocess.run(['nmcli', '-t', '-f', 'NAME', 'connection', 'show'], capture_output=True, text=True, stderr=subprocess.DEVNULL).stdout
+        result = command_runner.output(['nmcli', '-t', '-f', 'NAME', 'connection', 'show'])
         connections = [line.strip() for line in result.split('\n') if line.strip()]
         
         # Remove old WiFi connections but keep the one we just created
@@ -719,29 +610,62 @@ def cleanup_old_network_connections():
         log_status(f"Error cleaning up old connections: {str(e)}")
         return False
 
-def log_status(message, is_error=False):
-    """Log status messages to a file for debugging"""
-    log_file = '/tmp/raspiwifi_status.log'
-    timestamp = time.strftime('%Y-%m-%d %H:%M:%S')
-    log_entry = f'[{timestamp}] {"ERROR: " if is_error else ""} {message}\n'
-    
-    with open(log_file, 'a') as f:
-        f.write(log_entry)
-    print(log_entry)
+def log_status(message, is_error=False, phase=None):
+    """Record a status message (buffered, see status_log.py) and stream it to the progress page"""
+    record = status_log.record(message, 'error' if is_error else 'info', phase)
+    event_bus.publish('log', {'message': message, 'is_error': is_error, 'phase': phase, 'seq': record['seq']})
 
 def update_connection_status(status):
     """Update the connection status in a JSON file"""
     status_file = '/tmp/connection_status.json'
     with open(status_file, 'w') as f:
         json.dump(status, f)
+    event_bus.publish('status', status)
 
-# Store wifi credentials globally for transition function
-current_wifi_credentials = {'ssid': None, 'key': None}
+# Bounded, batch-flushed status log; queried through /logs
+status_log = StatusLog()
 
-if __name__ == '__main__':
-    config_hash = config_file_hash()
+# Progress events for the /events stream; each open stream holds a server
+# worker thread, so a quarter of them at most
+event_bus = EventBus(max_streams=max(1, raspiwifi_config.get('server_threads') // 4))
 
-    if config_hash['ssl_enabled'] == "1":
-        app.run(host = '0.0.0.0', port = int(config_hash['server_port']), ssl_context='adhoc')
-    else:
-        app.run(host = '0.0.0.0', port = int(config_hash['server_port']))
+# Reason the last connect attempt failed hard, shown on the index page until the next attempt
+last_connection_failure = {}
+
+# Single worker for everything that reconfigures the network
+network_jobs = JobQueue(publish=event_bus.publish, log=log_status)
+
+# Shared scanner so concurrent page loads never start parallel radio scans
+wifi_scanner = WifiScanner(scan_wifi_networks)
+
+def serve(host='0.0.0.0', port=None, sock=None, template_cache=startup.TEMPLATE_CACHE_DIR):
+    """
+    Start the background scanner and serve the app until the server stops.
+    sock is an already listening socket (see fast_start.py) to serve on
+    instead of binding port.
+    """
+    startup.precompile_templates(app, template_cache)
+    metrics.start_exporter('portal')
+    wifi_scanner.ttl = raspiwifi_config.get('scan_cache_ttl')
+    wifi_scanner.refresh_interval = raspiwifi_config.get('scan_interval')
+    # With the debug reloader the module also runs in the watcher process;
+    # only scan from the process that actually serves requests. The reloader
+    # is not used when the app is served from a worker thread.
+    reloader = app.debug and current_thread() is main_thread()
+    if not reloader or os.environ.get('WERKZEUG_RUN_MAIN') == 'true':
+        wifi_scanner.start()
+
+    server.run(app,
+               host = host,
+               port = port or raspiwifi_config.get('server_port'),
+               sock = sock,
+               ssl_enabled = raspiwifi_config.get('ssl_enabled'),
+               mode = raspiwifi_config.get('server_mode'),
+               threads = raspiwifi_config.get('server_threads'),
+               timeout = raspiwifi_config.get('server_timeout'),
+               cert_rotate_days = raspiwifi_config.get('ssl_cert_rotate_days'),
+               on_listening = lambda: boot_timeline.mark('portal_serving' if sock else 'portal_listening'))
+
+
+if __name__ == '__main__':
+    serve()
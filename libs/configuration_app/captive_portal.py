@@ -0,0 +1,107 @@
+import socket
+import threading
+import time
+
+from flask import Response, request
+
+import reset_lib
+
+# Connectivity checks fired by client operating systems as soon as they join
+# the access point. Anything other than the "online" answer makes the OS open
+# its captive portal sheet.
+PROBE_PATHS = (
+    '/generate_204',                # Android / Chrome OS
+    '/gen_204',
+    '/hotspot-detect.html',         # Apple
+    '/library/test/success.html',
+    '/connecttest.txt',             # Windows 10+
+    '/ncsi.txt',                    # Windows 7/8
+    '/redirect',
+    '/success.txt',                 # Firefox
+    '/canonical.html',
+    '/check_network_status.txt',    # GNOME / NetworkManager
+    '/nm',
+)
+
+# Names the portal itself is served under; requests for any other host only
+# reach us through the wildcard DNS entry and are redirected to the portal.
+PORTAL_HOSTS = {
+    '10.0.0.1',
+    'raspiwifisetup.com',
+    'idliketoconfigurethewifionthisdevicenowplease.com',
+    'localhost',
+    '127.0.0.1',
+}
+
+# How long the device's own names and addresses are cached, in seconds
+LOCAL_HOSTS_TTL = 10
+
+
+def local_hosts():
+    """This device's host names and interface IPv4 addresses (Ethernet, mDNS name, ...)"""
+    hostname = socket.gethostname().lower()
+    hosts = {hostname, hostname + '.local'}
+    for _, interface in socket.if_nameindex():
+        address = reset_lib.interface_ipv4_address(interface)
+        if address is not None:
+            hosts.add(address)
+    return hosts
+
+
+def portal_url(port=80, ssl_enabled=False):
+    scheme = 'https' if ssl_enabled else 'http'
+    default_port = 443 if ssl_enabled else 80
+    suffix = '' if port == default_port else f':{port}'
+    return f'{scheme}://10.0.0.1{suffix}/'
+
+
+class CaptivePortal:
+    """
+    Answer OS connectivity probes and foreign-host requests straight from
+    precomputed bytes in a before_request hook, so they never reach a view
+    that renders templates or touches the Wi-Fi scanner. Only installed
+    with captive_portal_dns, as only the wildcard DNS entry sends foreign
+    hosts here; the device's own names and addresses are always served.
+    """
+
+    def __init__(self, url):
+        self.url = url
+        body = (f'<html><head><meta http-equiv="refresh" content="0; url={url}"></head>'
+                f'<body><a href="{url}">RaspiWiFi Setup</a></body></html>').encode('utf-8')
+        self.redirect_body = body
+        self.redirect_headers = {
+            'Location': url,
+            'Cache-Control': 'no-cache, no-store, must-revalidate',
+            'Content-Type': 'text/html; charset=utf-8',
+        }
+        self.probe_paths = frozenset(PROBE_PATHS)
+        self.probe_hits = 0
+        self._lock = threading.Lock()
+        self._local_hosts = frozenset()
+        self._local_hosts_at = None
+
+    def install(self, app):
+        app.before_request(self.handle)
+
+    def is_portal_host(self, host):
+        if host in PORTAL_HOSTS:
+            return True
+        now = time.monotonic()
+        with self._lock:
+            if self._local_hosts_at is None or now - self._local_hosts_at > LOCAL_HOSTS_TTL:
+                self._local_hosts = frozenset(local_hosts())
+                self._local_hosts_at = now
+            return host in self._local_hosts
+
+    def handle(self):
+        host = request.host.lower()
+        # Drop the port; an IPv6 literal ([::1]:80) is always this device
+        if host.startswith('['):
+            host = None
+        else:
+            host = host.rsplit(':', 1)[0]
+        if request.path in self.probe_paths or (host is not None and not self.is_portal_host(host)):
+            with self._lock:
+                self.probe_hits += 1
+            return Response(self.redirect_body, status=302, headers=self.redirect_headers)
+        return None
@@ -0,0 +1,185 @@
+import datetime
+import ipaddress
+import os
+import socket
+import ssl
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.append(os.path.join(os.path.dirname(os.path.realpath(__file__)), '..', 'reset_device'))
+import raspiwifi_config
+
+CERT_DIR = '/etc/raspiwifi/ssl'
+CERT_FILE = 'portal.crt'
+KEY_FILE = 'portal.key'
+
+PORTAL_NAMES = ['raspiwifisetup.com', 'idliketoconfigurethewifionthisdevicenowplease.com']
+PORTAL_IP = '10.0.0.1'
+
+CERT_VALID_DAYS = 825
+# Regenerate this long before the certificate actually expires
+EXPIRY_MARGIN_DAYS = 30
+
+
+def ensure_certificate(cert_dir=CERT_DIR, rotate_days=365):
+    """
+    Return (certificate_path, key_path) for the portal, generating an ECDSA
+    P-256 key and self-signed certificate only if there is none yet, it is
+    older than rotate_days, or it is about to expire. Every other start
+    reuses the stored pair, so clients see the same certificate across
+    reboots and no key generation cost is paid.
+    """
+    cert_path = os.path.join(cert_dir, CERT_FILE)
+    key_path = os.path.join(cert_dir, KEY_FILE)
+
+    if not needs_rotation(cert_path, key_path, rotate_days):
+        return cert_path, key_path
+
+    print("RaspiWiFi: generating portal TLS certificate...")
+    cert_pem, key_pem = generate_certificate()
+    os.makedirs(cert_dir, mode=0o700, exist_ok=True)
+    raspiwifi_config.write_atomic(key_path, key_pem.decode('ascii'), mode=0o600)
+    raspiwifi_config.write_atomic(cert_path, cert_pem.decode('ascii'), mode=0o644)
+    return cert_path, key_path
+
+
+def needs_rotation(cert_path, key_path, rotate_days=365):
+    if not (os.path.exists(cert_path) and os.path.exists(key_path)):
+        return True
+
+    try:
+        from cryptography import x509
+        with open(cert_path, 'rb') as cert_file:
+            certificate = x509.load_pem_x509_certificate(cert_file.read())
+    except (OSError, ValueError):
+        return True
+
+    now = datetime.datetime.now(datetime.timezone.utc)
+    not_before = _utc(certificate, 'not_valid_before')
+    not_after = _utc(certificate, 'not_valid_after')
+
+    if now - not_before > datetime.timedelta(days=rotate_days):
+        return True
+    return not_after - now < datetime.timedelta(days=EXPIRY_MARGIN_DAYS)
+
+
+def _utc(certificate, attribute):
+    # cryptography >= 42 has timezone-aware *_utc variants
+    value = getattr(certificate, attribute + '_utc', None)
+    if value is None:
+        value = getattr(certificate, attribute).replace(tzinfo=datetime.timezone.utc)
+    return value
+
+
+def generate_certificate(valid_days=CERT_VALID_DAYS):
+    """Return (certificate_pem, key_pem) for a new self-signed ECDSA P-256 certificate"""
+    from cryptography import x509
+    from cryptography.hazmat.primitives import hashes, serialization
+    from cryptography.hazmat.primitives.asymmetric import ec
+    from cryptography.x509.oid import NameOID
+
+    key = ec.generate_private_key(ec.SECP256R1())
+    name = x509.Name([x509.NameAttribute(NameOID.COMMON_NAME, PORTAL_NAMES[0])])
+    now = datetime.datetime.now(datetime.timezone.utc)
+    alt_names = [x509.DNSName(host) for host in PORTAL_NAMES]
+    alt_names.append(x509.IPAddress(ipaddress.ip_address(PORTAL_IP)))
+
+    certificate = (
+        x509.CertificateBuilder()
+        .subject_name(name)
+        .issuer_name(name)
+        .public_key(key.public_key())
+        .serial_number(x509.random_serial_number())
+        .not_valid_before(now - datetime.timedelta(minutes=5))
+        .not_valid_after(now + datetime.timedelta(days=valid_days))
+        .add_extension(x509.SubjectAlternativeName(alt_names), critical=False)
+        .add_extension(x509.BasicConstraints(ca=False, path_length=None), critical=True)
+        .sign(key, hashes.SHA256())
+    )
+
+    cert_pem = certificate.public_bytes(serialization.Encoding.PEM)
+    key_pem = key.private_bytes(serialization.Encoding.PEM,
+                                serialization.PrivateFormat.PKCS8,
+                                serialization.NoEncryption())
+    return cert_pem, key_pem
+
+
+def make_ssl_context(cert_path, key_path):
+    """Server-side TLS context with session resumption (tickets and session cache) enabled"""
+    context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+    context.minimum_version = ssl.TLSVersion.TLSv1_2
+    context.load_cert_chain(cert_path, key_path)
+    context.options &= ~ssl.OP_NO_TICKET
+    context.set_ecdh_curve('prime256v1')
+    return context
+
+
+######## BENCHMARK ##########
+
+def _handshake_times(context, count, resume):
+    listener = socket.socket()
+    listener.bind(('127.0.0.1', 0))
+    listener.listen(16)
+    port = listener.getsockname()[1]
+
+    def serve():
+        for _ in range(count):
+            connection, _ = listener.accept()
+            try:
+                with context.wrap_socket(connection, server_side=True) as tls:
+                    tls.recv(1)
+                    tls.sendall(b'x')
+            except (OSError, ssl.SSLError):
+                pass
+
+    threading.Thread(target=serve, daemon=True).start()
+
+    client_context = ssl.create_default_context()
+    client_context.check_hostname = False
+    client_context.verify_mode = ssl.CERT_NONE
+    # TLS 1.2 keeps resumption visible in a single round trip
+    client_context.maximum_version = ssl.TLSVersion.TLSv1_2
+
+    times = []
+    session = None
+    resumed = 0
+    for _ in range(count):
+        started = time.perf_counter()
+        sock = socket.create_connection(('127.0.0.1', port))
+        with client_context.wrap_socket(sock, session=session if resume else None) as tls:
+            tls.sendall(b'x')
+            tls.recv(1)
+            times.append(time.perf_counter() - started)
+            resumed += tls.session_reused
+            session = tls.session
+    listener.close()
+    times.sort()
+    return times[len(times) // 2], resumed
+
+
+if __name__ == '__main__':
+    # python3 certificates.py -- compare startup and handshake cost against ssl_context='adhoc'
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 50
+
+    from werkzeug.serving import generate_adhoc_ssl_context
+    started = time.perf_counter()
+    adhoc_context = generate_adhoc_ssl_context()
+    print(f"adhoc (RSA 2048, every start): {(time.perf_counter() - started) * 1000:.1f} ms")
+
+    with tempfile.TemporaryDirectory() as cert_dir:
+        started = time.perf_counter()
+        paths = ensure_certificate(cert_dir)
+        print(f"ECDSA P-256, first start:      {(time.perf_counter() - started) * 1000:.1f} ms")
+
+        started = time.perf_counter()
+        paths = ensure_certificate(cert_dir)
+        context = make_ssl_context(*paths)
+        print(f"ECDSA P-256, later starts:     {(time.perf_counter() - started) * 1000:.1f} ms")
+
+        for name, server_context, resume in (('adhoc', adhoc_context, False),
+                                             ('ECDSA', context, False),
+                                             ('ECDSA + resumption', context, True)):
+            median, resumed = _handshake_times(server_context, count, resume)
+            print(f"{name} handshake: median {median * 1000:.2f} ms ({resumed}/{count} resumed)")
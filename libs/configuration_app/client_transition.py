@@ -0,0 +1,462 @@
+import json
+import os
+import shutil
+import time
+
+import capabilities
+import command_runner
+import connect_failures
+import reset_lib
+import service_control
+
+INTERFACE = 'wlan0'
+TIMELINE_FILE = '/tmp/raspiwifi_transition.json'
+WPA_CTRL_DIR = '/var/run/wpa_supplicant'
+
+# Longest each state may wait for its readiness condition (seconds)
+STATE_DEADLINES = {
+    'stop_ap': 30,
+    'configure_dhcpcd': 15,
+    'start_networkmanager': 15,
+    'nm_connect': 35,
+    'nm_profile_connect': 35,
+    'nm_wait_address': 15,
+    'start_wpa_supplicant': 10,
+    'wpa_associate': 25,
+    'wpa_wait_address': 20,
+}
+
+TERMINAL_STATES = ('connected', 'failed', 'cancelled')
+
+# wpa_supplicant -D argument for the driver interface the capability probe found
+WPA_DRIVERS = {'nl80211': 'nl80211,wext', 'wext': 'wext'}
+
+
+def has_client_address(interface=INTERFACE):
+    address = reset_lib.interface_ipv4_address(interface)
+    return address is not None and not address.startswith('127.')
+
+
+def service_active(name):
+    return command_runner.ok(['systemctl', 'is-active', '--quiet', name])
+
+
+def nm_device_ready(interface=INTERFACE):
+    """True once NetworkManager manages the interface and can use it"""
+    for line in command_runner.output(['nmcli', '-t', '-f', 'DEVICE,STATE', 'device', 'status']).splitlines():
+        device, _, state = line.partition(':')
+        if device == interface:
+            return state not in ('unavailable', 'unmanaged', '')
+    return False
+
+
+def nm_device_state(interface=INTERFACE):
+    """NetworkManager's state name for the interface, e.g. 'need-auth', or None"""
+    output = command_runner.output(['nmcli', '-t', '-f', 'GENERAL.STATE', 'device', 'show', interface])
+    # GENERAL.STATE:60 (need-auth)
+    _, _, state = output.strip().partition('(')
+    return state.rstrip(')') or None
+
+
+def wpa_network_id(ssid, interface=INTERFACE):
+    """wpa_supplicant's id for the network with this SSID, or None"""
+    # network id / ssid / bssid / flags, tab separated after the header
+    target = connect_failures.ssid_text(ssid)
+    for line in command_runner.output(['wpa_cli', '-i', interface, 'list_networks']).splitlines()[1:]:
+        fields = line.split('\t')
+        if len(fields) >= 2 and fields[0].isdigit() and fields[1] == target:
+            return int(fields[0])
+    return None
+
+
+def wait_for(condition, deadline, interval=0.25, cancelled=None):
+    """
+    Poll a cheap readiness condition until it holds or the deadline passes
+    (or cancelled() returns True)
+    """
+    while True:
+        if condition():
+            return True
+        if cancelled is not None and cancelled():
+            return False
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            return False
+        time.sleep(min(interval, remaining))
+
+
+class ClientTransition:
+    """
+    Switch from AP mode to client mode as an explicit state machine.
+
+    Each state performs its step and then waits on a concrete readiness
+    condition (service active, association complete, address assigned) up
+    to its deadline in STATE_DEADLINES, instead of sleeping for a fixed time.
+    Failures that retrying can not fix (wrong key, SSID not found) are
+    classified from nmcli and wpa_supplicant events as they happen and end
+    the transition at once, with the reason in self.failure.
+    Every state is recorded with wall-clock and monotonic timings in
+    self.timeline, which is written to TIMELINE_FILE so end-to-end switch
+    times can be measured.
+    """
+
+    def __init__(self, ssid, wifi_key, log, update_status, publish=None, profile=None, cancelled=None):
+        self.ssid = ssid
+        self.wifi_key = wifi_key or ''
+        # log(message, is_error=False, phase=None); see self.log
+        self._log = log
+        self.update_status = update_status
+        # Optional publish(event_type, data) hook for phase change events
+        self.publish = publish
+        # Optional cancelled() callable; checked between states and while waiting
+        self.cancelled = cancelled or (lambda: False)
+        self.timeline = []
+        self.state = None
+        self.service_steps = []
+        self.method = None
+        # connect_failures.ConnectFailure once a hard failure has been seen
+        self.failure = None
+        self.wpa_events = None
+        # SSID the interface actually associated with, once it has an address
+        self.connected_ssid = None
+        # Backend, interface and driver from the boot-time capability probe
+        self.profile = profile or capabilities.profile()
+        self.interface = self.profile['interface']
+
+    def run(self):
+        """Run the transition to completion. Returns True if connected."""
+        self.started_at = time.monotonic()
+        self.started_wall = time.time()
+        state = 'stop_ap'
+
+        try:
+            while state not in TERMINAL_STATES:
+                self.state = state
+                entered_at = time.monotonic()
+                deadline = entered_at + STATE_DEADLINES[state]
+                try:
+                    next_state = getattr(self, 'state_' + state)(deadline)
+                except Exception as e:
+                    self.log(f"Transition state {state} failed: {e}", is_error=True)
+                    next_state = 'failed'
+                if next_state != 'connected' and self.cancelled():
+                    self.log("Transition cancelled by a newer request")
+                    next_state = 'cancelled'
+                self._record(state, entered_at, next_state)
+                state = next_state
+        finally:
+            if self.wpa_events is not None:
+                self.wpa_events.close()
+
+        self.state = state
+        self._record(state, time.monotonic(), None)
+        total = time.monotonic() - self.started_at
+        self.log(f"Transition finished in state '{state}' after {total:.1f}s")
+        self._save_timeline(state, total)
+        return state == 'connected'
+
+    def _record(self, state, entered_at, next_state):
+        now = time.monotonic()
+        self.timeline.append({
+            'state': state,
+            'started': self.started_wall + (entered_at - self.started_at),
+            'offset': round(entered_at - self.started_at, 3),
+            'duration': round(now - entered_at, 3),
+            'next': next_state,
+        })
+        if next_state is not None:
+            self.log(f"State {state} -> {next_state} ({now - entered_at:.2f}s)")
+        if self.publish is not None:
+            self.publish('phase', {
+                'state': state,
+                'next': next_state,
+                'duration': round(now - entered_at, 3),
+                'elapsed': round(now - self.started_at, 3),
+            })
+
+    def log(self, message, is_error=False):
+        """Log message tagged with the current state as its phase"""
+        self._log(message, is_error, phase=self.state)
+
+    def wait_for(self, condition, deadline, interval=0.25):
+        return wait_for(condition, deadline, interval, self.cancelled)
+
+    def control_services(self, desired):
+        self.service_steps.extend(service_control.apply(desired, log=self.log))
+
+    def _save_timeline(self, final_state, total):
+        try:
+            with open(TIMELINE_FILE, 'w') as timeline_file:
+                json.dump({
+                    'ssid': self.ssid,
+                    'result': final_state,
+                    'method': self.method,
+                    'failure': self.failure.as_dict() if self.failure else None,
+                    'total': round(total, 3),
+                    'states': self.timeline,
+                    'service_steps': self.service_steps,
+                }, timeline_file)
+        except OSError as e:
+            self.log(f"Could not save transition timeline: {e}")
+
+    ######## STATES ##########
+
+    def state_stop_ap(self, deadline):
+        # Stop AP mode services and any existing wpa_supplicant
+        self.control_services({
+            'hostapd': service_control.want(enabled=False, active=False),
+            'dnsmasq': service_control.want(enabled=False, active=False),
+            'wpa_supplicant': service_control.want(active=False),
+        })
+        command_runner.run(['killall', 'wpa_supplicant'])
+
+        # Reset network interface
+        command_runner.run(['ip', 'addr', 'flush', 'dev', self.interface])
+        command_runner.run(['ip', 'link', 'set', self.interface, 'down'])
+        command_runner.run(['ip', 'link', 'set', self.interface, 'up'])
+        return 'configure_dhcpcd'
+
+    def state_configure_dhcpcd(self, deadline):
+        self.log("Configuring dhcpcd for client mode...")
+        try:
+            shutil.copy('/etc/dhcpcd.conf.original', '/etc/dhcpcd.conf')
+        except OSError:
+            with open('/etc/dhcpcd.conf', 'w') as dhcpcd_file:
+                dhcpcd_file.write('# dhcpcd config for client mode\n')
+        self.control_services({'dhcpcd': service_control.want(restart=True)})
+        # Go straight to the backend this device has instead of trying NetworkManager first
+        if self.profile['backend'] == 'wpa_supplicant':
+            self.log("NetworkManager is not available, using wpa_supplicant")
+            return 'start_wpa_supplicant'
+        return 'start_networkmanager'
+
+    def state_start_networkmanager(self, deadline):
+        self.log("Starting NetworkManager to handle WiFi connection...")
+        self.control_services({'NetworkManager': service_control.want(enabled=True, active=True, restart=True)})
+
+        nm_running = self.wait_for(lambda: service_active('NetworkManager'), deadline)
+        log_state = 'running' if nm_running else 'failed'
+        if nm_running:
+            # The service is up before it has taken over the interface
+            nm_running = self.wait_for(lambda: nm_device_ready(self.interface), deadline, interval=0.5)
+            log_state = 'running' if nm_running else f'running but {self.interface} not ready'
+        self.log(f"NetworkManager status: {log_state}")
+
+        return 'nm_connect' if nm_running else 'start_wpa_supplicant'
+
+    def state_nm_connect(self, deadline):
+        self.update_status({
+            'state': 'connecting',
+            'ssid': self.ssid,
+            'message': 'Attempting WiFi connection via NetworkManager...'
+        })
+
+        self.log(f"Attempting NetworkManager connection to '{self.ssid}'...")
+        self.log(f"SSID contains: spaces={' ' in self.ssid}, apostrophe={chr(39) in self.ssid}")
+
+        # nmcli blocks until the activation completes or --wait expires
+        wait_seconds = str(max(1, int(deadline - time.monotonic()) - 1))
+        if self.wifi_key.strip():
+            cmd = ['nmcli', '--wait', wait_seconds, 'device', 'wifi', 'connect', self.ssid, 'password', self.wifi_key]
+            self.log("Connecting with password...")
+        else:
+            cmd = ['nmcli', '--wait', wait_seconds, 'device', 'wifi', 'connect', self.ssid]
+            self.log("Connecting without password (open network)...")
+
+        self.log(f"Running command: {' '.join(['nmcli', 'device', 'wifi', 'connect', repr(self.ssid), '...'])}")
+        nmcli = command_runner.Command(cmd, timeout=max(1, deadline - time.monotonic())).start()
+        # NetworkManager asks for new secrets (need-auth) as soon as the
+        # 4-way handshake fails; nmcli itself would only give up at --wait
+        need_auth = False
+
+        def finished():
+            nonlocal need_auth
+            if nmcli.poll() is not None:
+                return True
+            need_auth = self.wifi_key.strip() != '' and nm_device_state(self.interface) == 'need-auth'
+            return need_auth
+
+        done = self.wait_for(finished, deadline, interval=0.5)
+        nmcli.kill()
+        result = nmcli.wait()
+
+        if need_auth:
+            return self._hard_failure(connect_failures.ConnectFailure('wrong_key', True, 'NetworkManager: need-auth'))
+        if not done or result.timed_out:
+            self.log("NetworkManager connection timed out")
+            return 'nm_profile_connect'
+
+        if result.returncode != 0:
+            self.log(f"NetworkManager error: {result.stderr.strip()}")
+            self.log(f"NetworkManager stdout: {result.stdout.strip()}")
+            failure = connect_failures.classify_nmcli_error(result.stderr + result.stdout)
+            if failure is not None:
+                return self._hard_failure(failure)
+            return 'nm_profile_connect'
+
+        self.log("NetworkManager connection successful!")
+        self.method = 'NetworkManager'
+        return 'nm_wait_address'
+
+    def state_nm_profile_connect(self, deadline):
+        self.log("Direct connection failed, trying connection profile method...")
+        result = command_runner.run(['nmcli', 'connection', 'up', self.ssid],
+                                    timeout=max(1, deadline - time.monotonic()))
+        if result.timed_out:
+            self.log("Connection profile method timed out")
+            return 'start_wpa_supplicant'
+
+        if result.returncode != 0:
+            self.log(f"Connection profile error: {result.stderr.strip()}")
+            return 'start_wpa_supplicant'
+
+        self.log("Connection profile method successful!")
+        self.method = 'NetworkManager profile'
+        return 'nm_wait_address'
+
+    def state_nm_wait_address(self, deadline):
+        if not self.wait_for(lambda: has_client_address(self.interface), deadline):
+            self.log("No IP address assigned by NetworkManager")
+            return 'start_wpa_supplicant'
+        if not self.joined_target():
+            return 'start_wpa_supplicant'
+
+        self.log(f"IP address obtained via {self.method}!")
+        self.update_status({
+            'state': 'connected',
+            'ssid': self.ssid,
+            'message': f'Connected via {self.method}'
+        })
+        return 'connected'
+
+    def state_start_wpa_supplicant(self, deadline):
+        self.method = 'wpa_supplicant'
+        # NetworkManager is stopped below, so a network it joined no longer counts
+        self.connected_ssid = None
+        if self.profile['backend'] != 'wpa_supplicant':
+            self.log("NetworkManager connection failed, trying wpa_supplicant fallback...")
+            # Stop NetworkManager to avoid conflicts
+            self.control_services({'NetworkManager': service_control.want(active=False)})
+
+        self.log("Starting wpa_supplicant manually...")
+        wpa_cmd = ['wpa_supplicant', '-B', '-i', self.interface, '-D', WPA_DRIVERS[self.profile['wpa_driver']], '-c', '/etc/wpa_supplicant/wpa_supplicant.conf']
+        # -B forks a daemon that keeps its output open; do not capture it
+        if command_runner.run(wpa_cmd, capture=False).returncode != 0:
+            self.log("wpa_supplicant command failed", is_error=True)
+            return 'failed'
+
+        # The control socket appears once the daemon is ready for wpa_cli
+        control_socket = os.path.join(WPA_CTRL_DIR, self.interface)
+        if not self.wait_for(lambda: os.path.exists(control_socket), deadline, interval=0.1):
+            if self.cancelled():
+                return 'cancelled'
+            self.log("Failed to start wpa_supplicant", is_error=True)
+            return 'failed'
+
+        try:
+            self.wpa_events = connect_failures.WpaEvents(self.interface, WPA_CTRL_DIR, ssid=self.ssid)
+        except OSError as e:
+            # Still works, only without early failure detection
+            self.log(f"Could not attach to wpa_supplicant events: {e}")
+
+        self.log("wpa_supplicant started successfully, triggering connection...")
+        command_runner.run(['wpa_cli', '-i', self.interface, 'reconfigure'])
+        # Try only the submitted network, so the device can not join another
+        # known one and failure events without an id= concern this network
+        network_id = wpa_network_id(self.ssid, self.interface)
+        if network_id is not None:
+            if self.wpa_events is not None:
+                self.wpa_events.network_id = network_id
+            command_runner.run(['wpa_cli', '-i', self.interface, 'select_network', network_id])
+        else:
+            self.log(f"Network {self.ssid} not found in wpa_supplicant.conf, reassociating with any known network")
+            command_runner.run(['wpa_cli', '-i', self.interface, 'reassociate'])
+        return 'wpa_associate'
+
+    def state_wpa_associate(self, deadline):
+        self.update_status({
+            'state': 'connecting',
+            'ssid': self.ssid,
+            'message': 'Attempting WiFi connection via wpa_supplicant...'
+        })
+
+        def associated_or_failed():
+            if self.wpa_events is not None:
+                self.failure = self.wpa_events.poll()
+                if self.failure is not None:
+                    return True
+            return reset_lib.wifi_link_status(self.interface).associated
+
+        if not self.wait_for(associated_or_failed, deadline):
+            # A newer submission took over; its page must not see this attempt fail
+            if self.cancelled():
+                return 'cancelled'
+            if self.wpa_events is not None:
+                # Not hard, but the most likely cause is still worth showing
+                self.failure = self.wpa_events.tracker.most_likely()
+            return self._wpa_failed("wpa_supplicant did not associate")
+        if self.failure is not None:
+            return self._hard_failure(self.failure)
+
+        self.log("wpa_supplicant connected, requesting IP...")
+        if not has_client_address(self.interface):
+            command_runner.spawn(['dhclient', self.interface], quiet=True)
+        return 'wpa_wait_address'
+
+    def state_wpa_wait_address(self, deadline):
+        if not self.wait_for(lambda: has_client_address(self.interface), deadline):
+            if self.cancelled():
+                return 'cancelled'
+            return self._wpa_failed("wpa_supplicant associated but no IP address was assigned")
+        if not self.joined_target():
+            self.failure = connect_failures.ConnectFailure('other_network', False, self.connected_ssid or '')
+            return self._wpa_failed(f"Associated with {self.connected_ssid!r} instead of {self.ssid!r}")
+
+        self.log("Connection successful - IP address obtained!")
+        self.update_status({
+            'state': 'connected',
+            'ssid': self.ssid,
+            'message': 'Connected via wpa_supplicant'
+        })
+        return 'connected'
+
+    def joined_target(self):
+        """
+        True if the interface is associated with the submitted network. With
+        several known networks configured it may have joined another one.
+        """
+        self.connected_ssid = reset_lib.associated_ssid(self.interface)
+        if self.connected_ssid is None:
+            # Nothing reports the SSID (no iw, no control socket); trust the backend
+            self.log("Could not read the associated SSID, assuming the submitted network")
+            self.connected_ssid = self.ssid
+        elif self.connected_ssid != self.ssid:
+            self.log(f"Joined {self.connected_ssid!r} instead of {self.ssid!r}", is_error=True)
+            return False
+        return True
+
+    def _wpa_failed(self, reason):
+        self.log(reason, is_error=True)
+        self.log("wpa_supplicant connection failed", is_error=True)
+        message = f'Failed to connect to WiFi network {self.ssid}'
+        if self.failure is not None:
+            message += f': {self.failure.message}'
+        self.update_status({
+            'state': 'connection_failed',
+            'ssid': self.ssid,
+            'reason': self.failure.reason if self.failure else None,
+            'message': message
+        })
+        return 'failed'
+
+    def _hard_failure(self, failure):
+        """End the transition now: retrying another method would fail the same way"""
+        self.failure = failure
+        self.log(f"{failure.message} ({failure.detail})", is_error=True)
+        self.update_status({
+            'state': 'connection_failed',
+            'ssid': self.ssid,
+            'reason': failure.reason,
+            'message': f'{failure.message}: {self.ssid}'
+        })
+        return 'failed'
@@ -0,0 +1,184 @@
+import os
+import re
+import socket
+import tempfile
+
+WPA_CTRL_DIR = '/var/run/wpa_supplicant'
+
+# How often a soft failure has to repeat before it counts as hard
+REPEAT_THRESHOLDS = {
+    'ssid_not_found': 3,
+    'auth_rejected': 2,
+    'assoc_rejected': 3,
+}
+
+MESSAGES = {
+    'wrong_key': 'The WiFi password is wrong',
+    'auth_rejected': 'The access point rejected the authentication',
+    'assoc_rejected': 'The access point refused the connection',
+    'ssid_not_found': 'The WiFi network could not be found',
+    'other_network': 'The Pi joined a different known network',
+}
+
+
+class ConnectFailure:
+    """A classified connect failure. hard means retrying will not help."""
+
+    def __init__(self, reason, hard, detail=''):
+        self.reason = reason
+        self.hard = hard
+        self.detail = detail
+
+    @property
+    def message(self):
+        return MESSAGES.get(self.reason, self.reason)
+
+    def as_dict(self):
+        return {'reason': self.reason, 'hard': self.hard, 'message': self.message, 'detail': self.detail}
+
+    def __repr__(self):
+        return f'ConnectFailure({self.reason!r}, hard={self.hard})'
+
+
+_WPA_EVENTS = (
+    (re.compile(r'CTRL-EVENT-SSID-TEMP-DISABLED .*reason=WRONG_KEY'), 'wrong_key'),
+    (re.compile(r'4-Way Handshake failed - pre-shared key may be incorrect'), 'wrong_key'),
+    (re.compile(r'CTRL-EVENT-AUTH-REJECT'), 'auth_rejected'),
+    (re.compile(r'CTRL-EVENT-SSID-TEMP-DISABLED .*reason=AUTH_FAILED'), 'auth_rejected'),
+    (re.compile(r'CTRL-EVENT-ASSOC-REJECT'), 'assoc_rejected'),
+    (re.compile(r'CTRL-EVENT-NETWORK-NOT-FOUND'), 'ssid_not_found'),
+)
+
+_NMCLI_ERRORS = (
+    (re.compile(r'Secrets were required, but not provided|802-11-wireless-security\.psk: property is invalid'
+                r'|reason: .*(no-secrets|supplicant-disconnect)', re.IGNORECASE), 'wrong_key'),
+    (re.compile(r'No network with SSID .* found', re.IGNORECASE), 'ssid_not_found'),
+)
+
+
+_EVENT_ID = re.compile(r'\bid=(\d+)')
+_EVENT_SSID = re.compile(r'\bssid="((?:[^"\\]|\\.)*)"')
+
+
+def ssid_text(ssid):
+    """An SSID escaped the way wpa_supplicant prints it in events and wpa_cli output"""
+    escapes = {ord('"'): '\\"', ord('\\'): '\\\\', 0x1b: '\\e', ord('\n'): '\\n', ord('\r'): '\\r', ord('\t'): '\\t'}
+    text = []
+    for byte in ssid.encode('utf-8'):
+        if byte in escapes:
+            text.append(escapes[byte])
+        elif 32 <= byte < 127:
+            text.append(chr(byte))
+        else:
+            text.append(f'\\x{byte:02x}')
+    return ''.join(text)
+
+
+def event_network(line):
+    """(network id, escaped ssid) an event line names; either is None if it names none"""
+    network_id = _EVENT_ID.search(line)
+    ssid = _EVENT_SSID.search(line)
+    return (int(network_id.group(1)) if network_id else None,
+            ssid.group(1) if ssid else None)
+
+
+def classify_wpa_event(line):
+    """Return the failure reason a wpa_supplicant event line reports, or None"""
+    for pattern, reason in _WPA_EVENTS:
+        if pattern.search(line):
+            return reason
+    return None
+
+
+def classify_nmcli_error(output):
+    """Return a hard ConnectFailure for nmcli error output that retrying will not fix, or None"""
+    for pattern, reason in _NMCLI_ERRORS:
+        if pattern.search(output):
+            return ConnectFailure(reason, True, output.strip())
+    return None
+
+
+class FailureTracker:
+    """Turns a stream of failure reasons into a ConnectFailure once one is hard"""
+
+    def __init__(self):
+        self.counts = {}
+        self.last_detail = ''
+
+    def add(self, reason, detail=''):
+        self.counts[reason] = self.counts.get(reason, 0) + 1
+        self.last_detail = detail
+        if self.counts[reason] >= REPEAT_THRESHOLDS.get(reason, 1):
+            return ConnectFailure(reason, True, detail)
+        return None
+
+    def most_likely(self):
+        """The most frequent soft failure seen so far, if any"""
+        if not self.counts:
+            return None
+        reason = max(self.counts, key=self.counts.get)
+        return ConnectFailure(reason, False, self.last_detail)
+
+
+class WpaEvents:
+    """
+    Attached client of wpa_supplicant's control socket. Events arrive as
+    datagrams the moment the supplicant logs them, so a wrong key is known
+    after the first failed 4-way handshake instead of after a timeout.
+
+    wpa_supplicant.conf lists every known network, so events naming another
+    network (by id= or ssid=) are ignored; only failures of the network
+    being joined count. Set network_id once it is known.
+    """
+
+    def __init__(self, interface, ctrl_dir=WPA_CTRL_DIR, ssid=None, network_id=None):
+        self.ssid = ssid
+        self.network_id = network_id
+        self.local_path = os.path.join(tempfile.gettempdir(), f'raspiwifi_wpa_ctrl_{os.getpid()}_{id(self)}')
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        try:
+            if os.path.exists(self.local_path):
+                os.remove(self.local_path)
+            self.sock.bind(self.local_path)
+            self.sock.connect(os.path.join(ctrl_dir, interface))
+            self.sock.settimeout(2)
+            self.sock.send(b'ATTACH')
+            if self.sock.recv(4096).strip() != b'OK':
+                raise OSError('wpa_supplicant refused ATTACH')
+            self.sock.setblocking(False)
+        except BaseException:
+            self.close()
+            raise
+        self.tracker = FailureTracker()
+
+    def poll(self):
+        """Drain pending events; return a hard ConnectFailure if one was seen, else None"""
+        while True:
+            try:
+                data = self.sock.recv(4096)
+            except (BlockingIOError, InterruptedError):
+                return None
+            # Unsolicited events are prefixed with their log level, e.g. "<3>"
+            line = data.decode('utf-8', errors='replace').split('>', 1)[-1]
+            reason = classify_wpa_event(line)
+            if reason is not None and self.concerns_target(line):
+                failure = self.tracker.add(reason, line.strip())
+                if failure is not None:
+                    return failure
+
+    def concerns_target(self, line):
+        network_id, ssid = event_network(line)
+        if network_id is not None and self.network_id is not None:
+            return network_id == self.network_id
+        if ssid is not None and self.ssid is not None:
+            return ssid == ssid_text(self.ssid)
+        return True
+
+    def close(self):
+        try:
+            self.sock.send(b'DETACH')
+        except OSError:
+            pass
+        self.sock.close()
+        if os.path.exists(self.local_path):
+            os.remove(self.local_path)
@@ -0,0 +1,109 @@
+import collections
+import json
+import threading
+import time
+
+
+class EventBus:
+    """
+    In-memory publish/subscribe bus for progress events.
+
+    Events get increasing integer ids and are kept in a bounded buffer, so a
+    client can resume from the last id it saw (SSE Last-Event-ID or a
+    long-poll cursor). Subscribers block on a condition variable and are
+    woken as soon as something is published.
+
+    Every open SSE stream holds a server worker thread, so at most
+    max_streams run at once.
+    """
+
+    def __init__(self, capacity=500, max_streams=2):
+        self._events = collections.deque(maxlen=capacity)
+        self._condition = threading.Condition()
+        self._next_id = 1
+        self.max_streams = max_streams
+        self._streams = 0
+
+    def publish(self, event_type, data):
+        with self._condition:
+            event = {
+                'id': self._next_id,
+                'time': time.time(),
+                'type': event_type,
+                'data': data,
+            }
+            self._next_id += 1
+            self._events.append(event)
+            self._condition.notify_all()
+        return event
+
+    @property
+    def last_id(self):
+        with self._condition:
+            return self._next_id - 1
+
+    def since(self, cursor=0, event_types=None):
+        """Return buffered events with an id greater than cursor"""
+        with self._condition:
+            return self._select(cursor, event_types)
+
+    def wait(self, cursor=0, timeout=None, event_types=None):
+        """Block until there are events after cursor or timeout seconds pass"""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._condition:
+            while True:
+                events = self._select(cursor, event_types)
+                if events:
+                    return events
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    return []
+                self._condition.wait(remaining)
+
+    def stream(self, cursor=0, keepalive=15, event_types=None, done=None, max_seconds=300):
+        """
+        Yield Server-Sent Events text frames, starting after cursor. The
+        stream ends with an 'end' event once done() returns True and the
+        events published before that are sent, or after max_seconds. If
+        max_streams are already open it only sends a 'busy' event, and the
+        page falls back to long-polling.
+        """
+        with self._condition:
+            busy = self._streams >= self.max_streams
+            if not busy:
+                self._streams += 1
+        if busy:
+            yield 'event: busy\ndata: {}\n\n'
+            return
+
+        try:
+            # Ask the browser to reconnect quickly if the connection drops
+            yield 'retry: 1000\n\n'
+            deadline = time.monotonic() + max_seconds
+            while True:
+                finished = done is not None and done()
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                # Once finished, only collect what is already buffered
+                timeout = 0 if finished else min(keepalive, remaining)
+                events = self.wait(cursor, timeout=timeout, event_types=event_types)
+                for event in events:
+                    cursor = event['id']
+                    yield format_sse(event)
+                if finished:
+                    break
+                if not events:
+                    yield ': keepalive\n\n'
+            yield 'event: end\ndata: {}\n\n'
+        finally:
+            with self._condition:
+                self._streams -= 1
+
+    def _select(self, cursor, event_types):
+        return [event for event in self._events
+                if event['id'] > cursor and (event_types is None or event['type'] in event_types)]
+
+
+def format_sse(event):
+    return f"id: {event['id']}\nevent: {event['type']}\ndata: {json.dumps(event)}\n\n"
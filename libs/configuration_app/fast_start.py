@@ -0,0 +1,38 @@
+import argparse
+import os
+import sys
+
+import startup
+
+# raspiwifi_config and boot_timeline live alongside this app in /usr/lib/raspiwifi/reset_device
+sys.path.append(os.path.join(os.path.dirname(os.path.realpath(__file__)), '..', 'reset_device'))
+import boot_timeline
+import raspiwifi_config
+
+
+def main(argv=None):
+    """
+    Start the configuration app with the portal port open before Flask is
+    imported. Only the standard library and the config store are loaded
+    before the socket is listening; the app, its templates and the server
+    follow while the first connections wait in the backlog.
+    """
+    parser = argparse.ArgumentParser(description='Start the RaspiWiFi configuration app')
+    parser.add_argument('--host', default='0.0.0.0')
+    parser.add_argument('--port', type=int, default=raspiwifi_config.get('server_port'))
+    parser.add_argument('--template-cache', default=startup.TEMPLATE_CACHE_DIR)
+    parser.add_argument('--no-early-listen', dest='early_listen', action='store_false')
+    args = parser.parse_args(argv)
+
+    # The development server's reloader re-executes the script, so it binds itself
+    sock = None
+    if args.early_listen and raspiwifi_config.get('server_mode') == 'production':
+        sock = startup.early_listen(args.host, args.port)
+        boot_timeline.mark('portal_listening')
+
+    import app
+    app.serve(host=args.host, port=args.port, sock=sock, template_cache=args.template_cache)
+
+
+if __name__ == '__main__':
+    main()
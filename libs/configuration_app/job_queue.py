@@ -0,0 +1,167 @@
+import collections
+import itertools
+import threading
+import time
+
+FINISHED_STATES = ('done', 'failed', 'superseded')
+
+
+class Job:
+    """
+    One unit of network-mutating work. The function is called as
+    function(job) and is expected to check job.cancelled() (or use
+    job.sleep()) between steps, so a newer submission can stop it.
+    """
+
+    def __init__(self, job_id, kind, function, description=None):
+        self.id = job_id
+        self.kind = kind
+        self.function = function
+        self.description = description
+        self.state = 'queued'
+        self.error = None
+        self.submitted_at = time.time()
+        self._submitted = time.monotonic()
+        self._started = None
+        self._finished = None
+        self._cancel = threading.Event()
+
+    def cancel(self):
+        self._cancel.set()
+
+    def cancelled(self):
+        return self._cancel.is_set()
+
+    def sleep(self, seconds):
+        """Sleep, returning early (True) if the job is cancelled"""
+        return self._cancel.wait(seconds)
+
+    @property
+    def queue_wait(self):
+        end = self._started if self._started is not None else (self._finished or time.monotonic())
+        return end - self._submitted
+
+    @property
+    def run_time(self):
+        if self._started is None:
+            return None
+        return (self._finished or time.monotonic()) - self._started
+
+    def as_dict(self):
+        run_time = self.run_time
+        return {
+            'id': self.id,
+            'kind': self.kind,
+            'description': self.description,
+            'state': self.state,
+            'error': self.error,
+            'submitted_at': self.submitted_at,
+            'queue_wait': round(self.queue_wait, 3),
+            'run_time': round(run_time, 3) if run_time is not None else None,
+        }
+
+
+class JobQueue:
+    """
+    Runs network-mutating jobs (connecting, applying AP settings) one at a
+    time on a single worker thread, so two submissions never race over
+    wpa_supplicant.conf, NetworkManager or the interface.
+
+    submit(..., supersede=True) drops the queued jobs of the same kind and
+    cancels the running one if it is of that kind, for work that makes
+    earlier submissions of it pointless (a newer set of credentials). Jobs
+    of other kinds, such as pending AP settings, still run. Finished jobs
+    are kept for status queries.
+    """
+
+    def __init__(self, publish=None, history=20, log=None):
+        # Optional publish(event_type, data) hook for job state changes
+        self.publish = publish
+        # Optional log(message) hook; reports jobs dropped by a newer one
+        self.log = log
+        self._condition = threading.Condition()
+        self._queue = collections.deque()
+        self._jobs = collections.OrderedDict()
+        self._history = history
+        self._ids = itertools.count(1)
+        self._running = None
+        self._thread = None
+
+    def submit(self, kind, function, description=None, supersede=False):
+        superseded = []
+        with self._condition:
+            job = Job(next(self._ids), kind, function, description)
+            if supersede:
+                superseded = [queued for queued in self._queue if queued.kind == kind]
+                for queued in superseded:
+                    self._queue.remove(queued)
+                    self._finish(queued, 'superseded')
+                if self._running is not None and self._running.kind == kind:
+                    self._running.cancel()
+                    cancelled = self._running
+                else:
+                    cancelled = None
+            self._queue.append(job)
+            self._jobs[job.id] = job
+            self._trim()
+            self._ensure_worker()
+            self._condition.notify_all()
+        for finished in superseded + [job]:
+            self._announce(finished)
+        if supersede and self.log is not None:
+            for dropped in superseded:
+                self.log(f"Dropped queued {dropped.kind} job {dropped.id}: superseded by job {job.id}")
+            if cancelled is not None:
+                self.log(f"Cancelling running {cancelled.kind} job {cancelled.id}: superseded by job {job.id}")
+        return job
+
+    def get(self, job_id):
+        with self._condition:
+            return self._jobs.get(job_id)
+
+    def jobs(self):
+        with self._condition:
+            return list(self._jobs.values())
+
+    def _ensure_worker(self):
+        if self._thread is None or not self._thread.is_alive():
+            self._thread = threading.Thread(target=self._work, name='job-queue', daemon=True)
+            self._thread.start()
+
+    def _work(self):
+        while True:
+            with self._condition:
+                while not self._queue:
+                    self._condition.wait()
+                job = self._queue.popleft()
+                self._running = job
+                job.state = 'running'
+                job._started = time.monotonic()
+            self._announce(job)
+
+            try:
+                job.function(job)
+            except Exception as e:
+                print(f"RaspiWiFi: job {job.id} ({job.kind}) failed: {e}")
+                state, job.error = 'failed', str(e)
+            else:
+                state = 'superseded' if job.cancelled() else 'done'
+
+            with self._condition:
+                self._running = None
+                self._finish(job, state)
+            self._announce(job)
+
+    def _finish(self, job, state):
+        # Called with the condition held
+        job.state = state
+        job._finished = time.monotonic()
+
+    def _announce(self, job):
+        if self.publish is not None:
+            self.publish('job', job.as_dict())
+
+    def _trim(self):
+        finished = [job_id for job_id, job in self._jobs.items() if job.state in FINISHED_STATES]
+        for job_id in finished[:max(0, len(self._jobs) - self._history)]:
+            del self._jobs[job_id]
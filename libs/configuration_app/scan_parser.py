@@ -0,0 +1,249 @@
+import os
+import re
+import sys
+import time
+
+# command_runner lives alongside this app in /usr/lib/raspiwifi/reset_device
+sys.path.append(os.path.join(os.path.dirname(os.path.realpath(__file__)), '..', 'reset_device'))
+import command_runner
+
+
+class WifiNetwork:
+    """A single BSS (cell) reported by `iwlist scan`"""
+
+    __slots__ = ('bssid', 'ssid', 'signal', 'channel', 'frequency', 'encryption')
+
+    def __init__(self, bssid, ssid='', signal=None, channel=None, frequency=None, encryption='open'):
+        self.bssid = bssid
+        self.ssid = ssid
+        self.signal = signal
+        self.channel = channel
+        self.frequency = frequency
+        self.encryption = encryption
+
+    @property
+    def is_hidden(self):
+        return self.ssid == '' or self.ssid.strip('\x00') == ''
+
+    @property
+    def is_secured(self):
+        return self.encryption != 'open'
+
+    def as_dict(self):
+        return {slot: getattr(self, slot) for slot in self.__slots__}
+
+    def __repr__(self):
+        return f'WifiNetwork({self.bssid!r}, {self.ssid!r}, signal={self.signal}, channel={self.channel}, encryption={self.encryption!r})'
+
+
+_CELL_RE = re.compile(r'Cell \d+ - Address: ([0-9A-Fa-f:]{17})')
+_SIGNAL_DBM_RE = re.compile(r'Signal level[=:]\s*(-?\d+)\s*dBm')
+_SIGNAL_RATIO_RE = re.compile(r'Signal level[=:]\s*(\d+)/(\d+)')
+_QUALITY_RE = re.compile(r'Quality[=:]\s*(\d+)/(\d+)')
+_FREQUENCY_RE = re.compile(r'Frequency:\s*([\d.]+)\s*GHz(?:\s*\(Channel (\d+)\))?')
+_CHANNEL_RE = re.compile(r'^Channel:\s*(\d+)')
+
+_HEX_ESCAPE_RE = re.compile(r'\\x([0-9A-Fa-f]{2})')
+
+
+def _decode_essid(raw):
+    # iwlist wraps the ESSID in quotes and prints non-printable bytes as \xNN
+    if len(raw) >= 2 and raw[0] == '"' and raw[-1] == '"':
+        raw = raw[1:-1]
+    if '\\x' not in raw:
+        return raw
+    data = _HEX_ESCAPE_RE.sub(lambda m: chr(int(m.group(1), 16)), raw)
+    try:
+        return data.encode('latin-1').decode('utf-8')
+    except (UnicodeEncodeError, UnicodeDecodeError):
+        return data
+
+
+def _signal_from_ratio(value, maximum):
+    # Some drivers only report a relative level; map it onto a -100..-50 dBm scale
+    if maximum <= 0:
+        return None
+    return int(min(value, maximum) * 50 / maximum) - 100
+
+
+def parse_iwlist(lines):
+    """
+    Incrementally parse `iwlist scan` output.
+
+    Accepts any iterable of text lines (a file, a pipe, a list) and yields a
+    WifiNetwork as soon as each cell is complete, so nothing beyond the
+    current cell is held in memory.
+    """
+    current = None
+    has_wpa = has_wpa2 = False
+    quality_signal = None
+
+    for line in lines:
+        line = line.strip()
+        if not line:
+            continue
+
+        match = _CELL_RE.search(line)
+        if match:
+            if current is not None:
+                yield _finish_cell(current, has_wpa, has_wpa2, quality_signal)
+            current = WifiNetwork(match.group(1).upper())
+            has_wpa = has_wpa2 = False
+            quality_signal = None
+            continue
+
+        if current is None:
+            continue
+
+        if line.startswith('ESSID:'):
+            current.ssid = _decode_essid(line[6:].strip())
+        elif 'Signal level' in line or line.startswith('Quality'):
+            match = _SIGNAL_DBM_RE.search(line)
+            if match:
+                current.signal = int(match.group(1))
+            else:
+                match = _SIGNAL_RATIO_RE.search(line) or _QUALITY_RE.search(line)
+                if match:
+                    quality_signal = _signal_from_ratio(int(match.group(1)), int(match.group(2)))
+        elif line.startswith('Frequency:'):
+            match = _FREQUENCY_RE.search(line)
+            if match:
+                current.frequency = int(round(float(match.group(1)) * 1000))
+                if match.group(2):
+                    current.channel = int(match.group(2))
+        elif line.startswith('Channel:'):
+            match = _CHANNEL_RE.search(line)
+            if match:
+                current.channel = int(match.group(1))
+        elif line.startswith('Encryption key:'):
+            current.encryption = 'open' if line.endswith('off') else 'WEP'
+        elif line.startswith('IE:'):
+            if 'WPA2' in line or '802.11i' in line:
+                has_wpa2 = True
+            elif 'WPA Version' in line:
+                has_wpa = True
+
+    if current is not None:
+        yield _finish_cell(current, has_wpa, has_wpa2, quality_signal)
+
+
+def _channel_from_frequency(frequency):
+    if frequency == 2484:
+        return 14
+    if 2412 <= frequency < 2484:
+        return (frequency - 2407) // 5
+    if 5000 <= frequency < 5900:
+        return (frequency - 5000) // 5
+    return None
+
+
+def _finish_cell(network, has_wpa, has_wpa2, quality_signal):
+    if network.signal is None:
+        network.signal = quality_signal
+    if network.channel is None and network.frequency is not None:
+        network.channel = _channel_from_frequency(network.frequency)
+    if network.encryption != 'open':
+        if has_wpa and has_wpa2:
+            network.encryption = 'WPA/WPA2'
+        elif has_wpa2:
+            network.encryption = 'WPA2'
+        elif has_wpa:
+            network.encryption = 'WPA'
+    return network
+
+
+def _signal_key(network):
+    return network.signal if network.signal is not None else -1000
+
+
+def dedupe_networks(networks, include_hidden=False):
+    """Collapse every BSSID/band of an SSID into its strongest cell"""
+    strongest = {}
+    for network in networks:
+        if network.is_hidden and not include_hidden:
+            continue
+        key = network.ssid if not network.is_hidden else network.bssid
+        best = strongest.get(key)
+        if best is None or _signal_key(network) > _signal_key(best):
+            strongest[key] = network
+    return list(strongest.values())
+
+
+def rank_networks(networks, limit=None, min_signal=None, secured=None, include_hidden=False):
+    """
+    Deduplicate by SSID and return networks ordered strongest first.
+
+    limit       -- only return the top N networks
+    min_signal  -- drop networks weaker than this many dBm
+    secured     -- True/False to keep only secured/open networks
+    """
+    ranked = dedupe_networks(networks, include_hidden=include_hidden)
+
+    if min_signal is not None:
+        ranked = [n for n in ranked if n.signal is not None and n.signal >= min_signal]
+    if secured is not None:
+        ranked = [n for n in ranked if n.is_secured == secured]
+
+    ranked.sort(key=_signal_key, reverse=True)
+
+    if limit is not None:
+        ranked = ranked[:limit]
+    return ranked
+
+
+def scan(interface='wlan0'):
+    """Run `iwlist <interface> scan` and parse its output as it streams in"""
+    # A hung iwlist is killed at its timeout, which ends the stream
+    command = command_runner.Command(['iwlist', interface, 'scan']).start()
+    try:
+        networks = list(parse_iwlist(command.process.stdout))
+    except BaseException:
+        command.kill()
+        command.wait()
+        raise
+    if command.wait().timed_out:
+        raise RuntimeError(f'iwlist scan did not finish within {command.timeout}s')
+    return networks
+
+
+def _synthetic_dump(cells):
+    lines = ['wlan0     Scan completed :']
+    for i in range(cells):
+        lines.append(f'          Cell {i + 1:02d} - Address: 02:00:00:00:{i // 256:02X}:{i % 256:02X}')
+        lines.append(f'                    Channel:{(i % 11) + 1}')
+        lines.append(f'                    Frequency:2.4{12 + (i % 11) * 5:02d} GHz (Channel {(i % 11) + 1})')
+        lines.append(f'                    Quality={30 + i % 40}/70  Signal level={-90 + i % 60} dBm  ')
+        lines.append('                    Encryption key:on')
+        lines.append(f'                    ESSID:"network-{i % (cells // 3 or 1)}"')
+        lines.append('                    Bit Rates:1 Mb/s; 2 Mb/s; 5.5 Mb/s; 11 Mb/s; 9 Mb/s')
+        lines.append('                    IE: IEEE 802.11i/WPA2 Version 1')
+        lines.append('                        Group Cipher : CCMP')
+        lines.append('                        Pairwise Ciphers (1) : CCMP')
+        lines.append('                        Authentication Suites (1) : PSK')
+    return [line + '\n' for line in lines]
+
+
+def benchmark(dump_lines, iterations=200):
+    """Time parse + rank over a recorded scan dump"""
+    start = time.perf_counter()
+    for _ in range(iterations):
+        cells = list(parse_iwlist(dump_lines))
+        ranked = rank_networks(cells)
+    elapsed = time.perf_counter() - start
+    return len(cells), len(ranked), elapsed / iterations
+
+
+if __name__ == '__main__':
+    # python3 scan_parser.py [recorded_iwlist_dump.txt ...]
+    dumps = sys.argv[1:]
+    if dumps:
+        sources = []
+        for path in dumps:
+            with open(path, encoding='utf-8', errors='replace') as dump_file:
+                sources.append((path, dump_file.readlines()))
+    else:
+        sources = [(f'synthetic {n} cells', _synthetic_dump(n)) for n in (20, 150, 500)]
+
+    for name, lines in sources:
+        cells, unique, per_run = benchmark(lines)
+        print(f'{name}: {cells} cells -> {unique} networks, {per_run * 1000:.3f} ms per parse')
@@ -0,0 +1,214 @@
+import http.client
+import os
+import socket
+import sys
+import threading
+import time
+
+import certificates
+
+
+def run(app, host='0.0.0.0', port=80, ssl_enabled=False, mode='production', threads=8, timeout=30, cert_rotate_days=365,
+        on_listening=None, sock=None):
+    """
+    Serve the configuration app.
+
+    production  -- cheroot's threaded WSGI server: a bounded worker pool,
+                   HTTP/1.1 keep-alive, per-connection socket timeouts and
+                   no debugger or reloader. Falls back to the development
+                   server if cheroot is not installed.
+    development -- Flask's built-in server with the debugger and reloader.
+
+    on_listening is called once the listening socket is bound (for the
+    development server: just before it starts).
+
+    sock is an already bound and listening socket to serve on instead of
+    binding host:port (see startup.early_listen). It is served without the
+    reloader.
+    """
+    cert_files = None
+    if ssl_enabled:
+        cert_files = certificates.ensure_certificate(rotate_days=cert_rotate_days)
+
+    if mode == 'production':
+        server = make_production_server(app, host, port, cert_files, threads, timeout, sock)
+        if server is not None:
+            print(f"RaspiWiFi: serving on {host}:{port} ({threads} worker threads)")
+            try:
+                server.prepare()
+                if on_listening:
+                    on_listening()
+                server.serve()
+            except KeyboardInterrupt:
+                server.stop()
+            return
+        print("RaspiWiFi: cheroot is not installed, falling back to the development server")
+
+    ssl_context = certificates.make_ssl_context(*cert_files) if cert_files else None
+    if on_listening:
+        on_listening()
+    if sock is not None:
+        from werkzeug.serving import make_server
+        make_server(host, port, app, threaded=True, ssl_context=ssl_context, fd=sock.fileno()).serve_forever()
+        return
+    # The reloader installs signal handlers, which only works on the main thread
+    # (not when the unified daemon hosts the portal on a worker thread)
+    use_reloader = app.debug and threading.current_thread() is threading.main_thread()
+    app.run(host=host, port=port, ssl_context=ssl_context, threaded=True, use_reloader=use_reloader)
+
+
+def make_production_server(app, host, port, cert_files=None, threads=8, timeout=30, sock=None):
+    """
+    Return a configured (not yet started) cheroot server, or None if cheroot
+    is unavailable. With sock, prepare() adopts that listening socket instead
+    of binding a new one.
+    """
+    try:
+        from cheroot import wsgi
+    except ImportError:
+        return None
+
+    # Every open /events stream occupies one worker, so allow the pool to
+    # grow a little beyond its base size before requests have to queue
+    server = wsgi.Server(
+        (host, port),
+        app,
+        numthreads=threads,
+        max=threads * 2,
+        request_queue_size=32,
+        timeout=timeout,
+        shutdown_timeout=2,
+        server_name='RaspiWiFi',
+    )
+
+    if cert_files:
+        from cheroot.ssl.builtin import BuiltinSSLAdapter
+        adapter = BuiltinSSLAdapter(*cert_files)
+        # Replace cheroot's default context so session resumption stays enabled
+        adapter.context = certificates.make_ssl_context(*cert_files)
+        server.ssl_adapter = adapter
+
+    if sock is not None:
+        adopt_socket(server, sock)
+
+    return server
+
+
+def adopt_socket(server, sock):
+    """Make a cheroot server use sock instead of binding its own socket in prepare()"""
+    def bind(family, type, proto=0):
+        if server.ssl_adapter is not None:
+            server.socket = server.ssl_adapter.bind(sock)
+        else:
+            server.socket = sock
+        server.bind_addr = sock.getsockname()
+        return server.socket
+
+    server.bind = bind
+
+
+######## BENCHMARK ##########
+
+def _free_port():
+    sock = socket.socket()
+    sock.bind(('127.0.0.1', 0))
+    port = sock.getsockname()[1]
+    sock.close()
+    return port
+
+
+def _wait_listening(port, timeout=30):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            socket.create_connection(('127.0.0.1', port), timeout=0.5).close()
+            return True
+        except OSError:
+            time.sleep(0.005)
+    return False
+
+
+def _measure_requests(port, path, count):
+    latencies = []
+    connection = http.client.HTTPConnection('127.0.0.1', port, timeout=10)
+    for _ in range(count):
+        started = time.perf_counter()
+        connection.request('GET', path)
+        response = connection.getresponse()
+        response.read()
+        latencies.append(time.perf_counter() - started)
+    connection.close()
+    latencies.sort()
+    return latencies
+
+
+def _measure_concurrent(port, path, clients, count):
+    results = []
+    lock = threading.Lock()
+
+    def client():
+        latencies = _measure_requests(port, path, count)
+        with lock:
+            results.extend(latencies)
+
+    started = time.perf_counter()
+    workers = [threading.Thread(target=client) for _ in range(clients)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    return len(results) / (time.perf_counter() - started)
+
+
+def benchmark(app, path='/manual_ssid_entry', requests=200, clients=8):
+    """Compare startup and per-request latency of the production and development servers"""
+    from werkzeug.serving import make_server
+
+    report = {}
+
+    port = _free_port()
+    started = time.perf_counter()
+    dev_server = make_server('127.0.0.1', port, app, threaded=True)
+    threading.Thread(target=dev_server.serve_forever, daemon=True).start()
+    _wait_listening(port)
+    report['development'] = _benchmark_server(port, path, requests, clients, time.perf_counter() - started)
+    dev_server.shutdown()
+
+    port = _free_port()
+    started = time.perf_counter()
+    production_server = make_production_server(app, '127.0.0.1', port)
+    if production_server is None:
+        report['production'] = None
+    else:
+        production_server.prepare()
+        threading.Thread(target=production_server.serve, daemon=True).start()
+        _wait_listening(port)
+        report['production'] = _benchmark_server(port, path, requests, clients, time.perf_counter() - started)
+        production_server.stop()
+
+    return report
+
+
+def _benchmark_server(port, path, requests, clients, startup):
+    latencies = _measure_requests(port, path, requests)
+    return {
+        'startup_ms': startup * 1000,
+        'p50_ms': latencies[len(latencies) // 2] * 1000,
+        'p95_ms': latencies[int(len(latencies) * 0.95)] * 1000,
+        'concurrent_rps': _measure_concurrent(port, path, clients, requests // clients),
+    }
+
+
+if __name__ == '__main__':
+    # python3 server.py [path] -- benchmark the production server against the dev server
+    sys.path.insert(0, os.path.dirname(os.path.realpath(__file__)))
+    from app import app as configuration_app
+
+    configuration_app.debug = False
+    path = sys.argv[1] if len(sys.argv) > 1 else '/manual_ssid_entry'
+    for name, result in benchmark(configuration_app, path).items():
+        if result is None:
+            print(f"{name}: cheroot not installed")
+            continue
+        print(f"{name}: startup {result['startup_ms']:.1f} ms, p50 {result['p50_ms']:.2f} ms, "
+              f"p95 {result['p95_ms']:.2f} ms, {result['concurrent_rps']:.0f} req/s with 8 clients")
@@ -0,0 +1,139 @@
+import importlib.util
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+TEMPLATE_CACHE_DIR = '/var/cache/raspiwifi/templates'
+
+APP_DIR = os.path.dirname(os.path.realpath(__file__))
+
+
+def lazy_import(name):
+    """
+    Return a module object that is only actually imported on first
+    attribute access, for modules that are needed on rare paths (saving
+    credentials, debug pages) but not to serve the first page.
+    """
+    if name in sys.modules:
+        return sys.modules[name]
+
+    spec = importlib.util.find_spec(name)
+    if spec is None:
+        raise ImportError(f"No module named {name!r}")
+    spec.loader = importlib.util.LazyLoader(spec.loader)
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[name] = module
+    spec.loader.exec_module(module)
+    return module
+
+
+def early_listen(host='0.0.0.0', port=80, backlog=64):
+    """
+    Bind and listen on the portal port straight away. Connections that
+    arrive while Flask is still being imported wait in the kernel backlog
+    instead of being refused, and are answered once the server takes over
+    the socket.
+    """
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((host, port))
+    sock.listen(backlog)
+    return sock
+
+
+def precompile_templates(app, cache_dir=TEMPLATE_CACHE_DIR):
+    """
+    Compile every template up front and keep the compiled bytecode on disk,
+    so neither the first request nor the next boot pays for parsing them.
+    Returns the number of templates loaded.
+    """
+    from jinja2 import FileSystemBytecodeCache
+
+    try:
+        os.makedirs(cache_dir, exist_ok=True)
+        app.jinja_env.bytecode_cache = FileSystemBytecodeCache(cache_dir)
+    except OSError as e:
+        print(f"RaspiWiFi: template cache unavailable ({e}), compiling in memory only")
+
+    names = app.jinja_env.list_templates()
+    for name in names:
+        app.jinja_env.get_template(name)
+    return len(names)
+
+
+######## BENCHMARK ##########
+
+def _free_port():
+    sock = socket.socket()
+    sock.bind(('127.0.0.1', 0))
+    port = sock.getsockname()[1]
+    sock.close()
+    return port
+
+
+def _drop_page_cache():
+    # Only possible as root; otherwise "cold" still means a fresh interpreter
+    try:
+        os.sync()
+        with open('/proc/sys/vm/drop_caches', 'w') as drop_caches:
+            drop_caches.write('3\n')
+        return True
+    except OSError:
+        return False
+
+
+def time_to_first_response(early, cache_dir, path='/manual_ssid_entry', timeout=60):
+    """
+    Start the portal in a fresh interpreter and return (seconds until the
+    port accepts connections, seconds until the first full response).
+    """
+    import http.client
+
+    port = _free_port()
+    command = [sys.executable, os.path.join(APP_DIR, 'fast_start.py'),
+               '--host', '127.0.0.1', '--port', str(port), '--template-cache', cache_dir]
+    if not early:
+        command.append('--no-early-listen')
+
+    started = time.perf_counter()
+    process = subprocess.Popen(command, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    listening = None
+    try:
+        while time.perf_counter() - started < timeout:
+            try:
+                connection = http.client.HTTPConnection('127.0.0.1', port, timeout=timeout)
+                connection.connect()
+            except OSError:
+                time.sleep(0.005)
+                continue
+            if listening is None:
+                listening = time.perf_counter() - started
+            connection.request('GET', path)
+            connection.getresponse().read()
+            connection.close()
+            return listening, time.perf_counter() - started
+        raise RuntimeError('portal did not answer in time')
+    finally:
+        process.terminate()
+        process.wait()
+
+
+if __name__ == '__main__':
+    # python3 startup.py [runs] -- cold and warm time-to-first-response, with and without early listen
+    runs = int(sys.argv[1]) if len(sys.argv) > 1 else 3
+    with tempfile.TemporaryDirectory() as cache_dir:
+        for early in (False, True):
+            label = 'early listen' if early else 'listen after imports'
+            for run in range(runs):
+                cold = run == 0
+                if cold:
+                    for name in os.listdir(cache_dir):
+                        os.remove(os.path.join(cache_dir, name))
+                    dropped = _drop_page_cache()
+                listening, response = time_to_first_response(early, cache_dir)
+                kind = ('cold' + ('' if dropped else ' (page cache kept)')) if cold else 'warm'
+                print(f"{label:<22} {kind:<24} listening {listening * 1000:7.1f} ms, "
+                      f"first response {response * 1000:7.1f} ms")
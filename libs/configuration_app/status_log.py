@@ -0,0 +1,125 @@
+import atexit
+import collections
+import itertools
+import os
+import threading
+import time
+
+STATUS_LOG_FILE = '/tmp/raspiwifi_status.log'
+
+LEVELS = ('debug', 'info', 'warning', 'error')
+
+
+class StatusLog:
+    """
+    Bounded log of structured records (seq, time, level, phase, message).
+
+    The newest `capacity` records are kept in memory for queries. Records
+    are written to `path` in batches by a background thread every
+    flush_interval seconds (errors are flushed at once), and the file is
+    rotated to path.1 .. path.<backups> when it would grow beyond
+    max_bytes, so a device stuck in a retry loop can not fill tmpfs.
+    Records at echo_level or above are also printed.
+    """
+
+    def __init__(self, path=STATUS_LOG_FILE, capacity=1000, max_bytes=256 * 1024, backups=2,
+                 flush_interval=2.0, flush_records=50, echo_level='warning'):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.backups = backups
+        self.flush_interval = flush_interval
+        self.flush_records = flush_records
+        self.echo_level = echo_level
+        self._records = collections.deque(maxlen=capacity)
+        self._pending = []
+        self._seq = itertools.count(1)
+        self._lock = threading.Lock()
+        # Serialises writers so batches reach the file in order
+        self._write_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._thread = None
+        self._size = None
+        atexit.register(self.flush)
+
+    def record(self, message, level='info', phase=None):
+        with self._lock:
+            record = {
+                'seq': next(self._seq),
+                'time': time.time(),
+                'level': level,
+                'phase': phase,
+                'message': message,
+            }
+            self._records.append(record)
+            self._pending.append(record)
+            urgent = level == 'error' or len(self._pending) >= self.flush_records
+            self._ensure_flusher()
+
+        if LEVELS.index(level) >= LEVELS.index(self.echo_level):
+            print(format_record(record))
+        if urgent:
+            self._wake.set()
+        return record
+
+    def query(self, since=0, level=None, phase=None, limit=None):
+        """Records after seq `since`, at `level` or above and in `phase`, oldest first"""
+        minimum = LEVELS.index(level) if level else 0
+        with self._lock:
+            records = [record for record in self._records
+                       if record['seq'] > since
+                       and LEVELS.index(record['level']) >= minimum
+                       and (phase is None or record['phase'] == phase)]
+        return records[-limit:] if limit else records
+
+    @property
+    def last_seq(self):
+        with self._lock:
+            return self._records[-1]['seq'] if self._records else 0
+
+    def flush(self):
+        with self._write_lock:
+            with self._lock:
+                pending, self._pending = self._pending, []
+            if not pending:
+                return
+            data = ''.join(format_record(record) + '\n' for record in pending).encode('utf-8')
+            try:
+                if self._size is None:
+                    self._size = os.path.getsize(self.path) if os.path.exists(self.path) else 0
+                if self._size and self._size + len(data) > self.max_bytes:
+                    self._rotate()
+                with open(self.path, 'ab') as log_file:
+                    log_file.write(data)
+                self._size += len(data)
+            except OSError as e:
+                print(f"RaspiWiFi: Could not write {self.path}: {e}")
+
+    def _rotate(self):
+        for index in range(self.backups - 1, 0, -1):
+            older = f'{self.path}.{index}'
+            if os.path.exists(older):
+                os.replace(older, f'{self.path}.{index + 1}')
+        if self.backups:
+            os.replace(self.path, self.path + '.1')
+        else:
+            os.remove(self.path)
+        self._size = 0
+
+    def _ensure_flusher(self):
+        # Called with the lock held
+        if self._thread is None or not self._thread.is_alive():
+            self._thread = threading.Thread(target=self._flush_loop, name='status-log', daemon=True)
+            self._thread.start()
+
+    def _flush_loop(self):
+        while True:
+            self._wake.wait(self.flush_interval)
+            self._wake.clear()
+            self.flush()
+
+
+def format_record(record):
+    timestamp = time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(record['time']))
+    phase = f" [{record['phase']}]" if record['phase'] else ''
+    return f"[{timestamp}] {record['level'].upper()}{phase} {record['message']}"
+
@@ -0,0 +1,118 @@
+import threading
+import time
+
+
+class WifiScanner:
+    """
+    Background Wi-Fi scanner with a TTL cache.
+
+    Results from the last scan are served straight from memory. Once they are
+    older than the TTL a refresh is started in the background while the stale
+    results keep being served. Only one scan ever runs at a time: callers that
+    need fresh results while a scan is in flight wait for that scan instead of
+    starting their own (parallel `iwlist scan` calls fail with "Device or
+    resource busy").
+    """
+
+    def __init__(self, scan_function, ttl=30, refresh_interval=60, wait_timeout=15):
+        self.scan_function = scan_function
+        self.ttl = ttl
+        self.refresh_interval = refresh_interval
+        self.wait_timeout = wait_timeout
+
+        self._lock = threading.Lock()
+        self._scan_done = threading.Event()
+        self._scan_done.set()
+        self._scan_in_progress = False
+        self._results = None
+        self._last_scan_time = None
+        self._last_error = None
+        self._thread = None
+        self._stop_event = threading.Event()
+
+    def start(self):
+        """Start the periodic background refresh thread"""
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive():
+                return
+            self._stop_event.clear()
+            self._thread = threading.Thread(target=self._refresh_loop, name='wifi-scanner', daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stop_event.set()
+
+    def get_networks(self, max_age=None):
+        """
+        Return the cached scan results.
+
+        Stale results are returned immediately and a background refresh is
+        kicked off. If nothing has been scanned yet, wait (up to wait_timeout)
+        for the in-flight scan to finish.
+        """
+        if max_age is None:
+            max_age = self.ttl
+
+        with self._lock:
+            results = self._results
+            age = self._age()
+
+        if results is not None:
+            if age > max_age:
+                self.refresh(wait=False)
+            return list(results)
+
+        self.refresh(wait=True)
+
+        with self._lock:
+            return list(self._results or [])
+
+    def refresh(self, wait=True):
+        """Trigger a scan, joining the in-flight one if there is one"""
+        with self._lock:
+            if not self._scan_in_progress:
+                self._scan_in_progress = True
+                self._scan_done.clear()
+                threading.Thread(target=self._run_scan, name='wifi-scan', daemon=True).start()
+
+        if wait:
+            self._scan_done.wait(self.wait_timeout)
+
+    def status(self):
+        with self._lock:
+            return {
+                'cached_networks': len(self._results) if self._results is not None else None,
+                'age': self._age() if self._last_scan_time is not None else None,
+                'scan_in_progress': self._scan_in_progress,
+                'last_error': self._last_error,
+            }
+
+    def _age(self):
+        if self._last_scan_time is None:
+            return float('inf')
+        return time.monotonic() - self._last_scan_time
+
+    def _run_scan(self):
+        try:
+            results = self.scan_function()
+        except Exception as e:
+            print(f"Wi-Fi scan failed: {e}")
+            with self._lock:
+                self._last_error = str(e)
+        else:
+            with self._lock:
+                self._results = results
+                self._last_scan_time = time.monotonic()
+                self._last_error = None
+        finally:
+            with self._lock:
+                self._scan_in_progress = False
+                self._scan_done.set()
+
+    def _refresh_loop(self):
+        while not self._stop_event.is_set():
+            self.refresh(wait=True)
+            # Wait out the rest of a scan that outlived wait_timeout so the
+            # loop never stacks refreshes on a slow radio
+            self._scan_done.wait()
+            self._stop_event.wait(self.refresh_interval)
@@ -0,0 +1,354 @@
+import os
+import shutil
+import socket
+import sys
+import threading
+import time
+
+import boot_timeline
+import capabilities
+import command_runner
+import hostapd_config
+import raspiwifi_config
+import reset_lib
+import service_control
+
+AP_ADDRESS = '10.0.0.1'
+HOSTAPD_CONF = '/etc/hostapd/hostapd.conf'
+
+RESET_DEVICE_DIR = os.path.dirname(os.path.realpath(__file__))
+CONFIGURATION_APP = os.path.join(RESET_DEVICE_DIR, '..', 'configuration_app', 'app.py')
+FAST_START_APP = os.path.join(RESET_DEVICE_DIR, '..', 'configuration_app', 'fast_start.py')
+UNIFIED_DAEMON = os.path.join(RESET_DEVICE_DIR, 'unified_daemon.py')
+
+READY_POLL_INTERVAL = 0.1
+
+
+class Node:
+    """
+    One step of the startup graph.
+
+    start -- callable that kicks the step off (may be None for a pure wait)
+    ready -- cheap callable polled until it returns True (None: ready once
+             start returns)
+    after -- names of the nodes that have to finish first
+    phase -- boot timeline phase recorded when the node is ready
+    """
+
+    def __init__(self, name, start=None, ready=None, after=(), timeout=30, phase=None):
+        self.name = name
+        self.start = start
+        self.ready = ready
+        self.after = tuple(after)
+        self.timeout = timeout
+        self.phase = phase
+
+
+class BootOrchestrator:
+    """
+    Start a graph of nodes with one thread per node. A node starts as soon
+    as everything it depends on has finished, so independent branches run
+    concurrently, and it finishes when its readiness check holds instead of
+    after a fixed sleep.
+
+    Startup is best effort, like the bash bootstrappers it replaces: a node
+    whose readiness check times out or whose start fails is reported, and
+    the nodes after it are still started.
+    """
+
+    def __init__(self, nodes, log=print):
+        self.nodes = {node.name: node for node in nodes}
+        for node in nodes:
+            for dependency in node.after:
+                if dependency not in self.nodes:
+                    raise ValueError(f"{node.name} depends on unknown node {dependency}")
+        self.log = log
+        self.results = {}
+        self._done = {name: threading.Event() for name in self.nodes}
+        self._started = None
+
+    def run(self):
+        """Start every node and wait for all of them; returns {name: result}"""
+        self._started = time.monotonic()
+        threads = [threading.Thread(target=self._run_node, args=(node,), name=node.name, daemon=True)
+                   for node in self.nodes.values()]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return self.results
+
+    @property
+    def total_seconds(self):
+        return max((result['finished'] for result in self.results.values()), default=0.0)
+
+    def _run_node(self, node):
+        try:
+            for dependency in node.after:
+                self._done[dependency].wait()
+
+            waited = time.monotonic() - self._started
+            status = 'ready'
+            error = None
+            try:
+                if node.start is not None:
+                    node.start()
+                if node.ready is not None and not self._wait_ready(node):
+                    status = 'timeout'
+            except Exception as e:
+                status = 'failed'
+                error = str(e)
+
+            finished = time.monotonic() - self._started
+            self.results[node.name] = {
+                'status': status,
+                'started': round(waited, 3),
+                'finished': round(finished, 3),
+                'error': error,
+            }
+
+            if status == 'ready':
+                if node.phase:
+                    boot_timeline.mark(node.phase, 'boot_orchestrator')
+                self.log(f"RaspiWiFi: {node.name} ready after {finished - waited:.2f}s")
+            else:
+                self.log(f"RaspiWiFi: {node.name} {status}{': ' + error if error else ''}, continuing")
+        finally:
+            self._done[node.name].set()
+
+    def _wait_ready(self, node):
+        deadline = time.monotonic() + node.timeout
+        while True:
+            try:
+                if node.ready():
+                    return True
+            except Exception:
+                pass
+            if time.monotonic() >= deadline:
+                return False
+            time.sleep(READY_POLL_INTERVAL)
+
+
+######## READINESS CHECKS ##########
+
+def has_address(address, interface=None):
+    return reset_lib.interface_ipv4_address(interface or capabilities.interface()) == address
+
+
+def has_client_address(interface=None):
+    address = reset_lib.interface_ipv4_address(interface or capabilities.interface())
+    return address is not None and address != AP_ADDRESS and not address.startswith('127.')
+
+
+def processes_gone(*names):
+    return not command_runner.ok(['pgrep', '-x', '|'.join(names)])
+
+
+def udp_port_bound(port):
+    """True if something has UDP port bound, read from /proc/net/udp (no fork)"""
+    suffix = f':{port:04X}'
+    try:
+        with open('/proc/net/udp') as udp_file:
+            next(udp_file)
+            return any(line.split()[1].endswith(suffix) for line in udp_file)
+    except (OSError, StopIteration, IndexError):
+        return False
+
+
+def ap_mode_active(interface=None):
+    """True once hostapd has switched the interface to AP mode, i.e. the SSID is being broadcast"""
+    return 'type AP' in command_runner.output(['iw', 'dev', interface or capabilities.interface(), 'info'])
+
+
+def tcp_listening(port, host='127.0.0.1'):
+    try:
+        socket.create_connection((host, port), timeout=0.5).close()
+        return True
+    except OSError:
+        return False
+
+
+######## START ACTIONS ##########
+
+def launch(*command):
+    """Start a long running daemon detached from the orchestrator"""
+    command_runner.spawn(command, detach=True)
+
+
+def start_service(name, *fallback_command):
+    """Start a systemd service, or run fallback_command if the unit is missing or does not start"""
+    if service_control.query_states([name])[name]['load'] != 'not-found':
+        report = service_control.apply({name: service_control.want(active=True)})
+        if not any(step['returncode'] for step in report):
+            return
+    launch(*fallback_command)
+
+
+def run_commands(*commands):
+    for command in commands:
+        command_runner.run(command)
+
+
+def probe_capabilities():
+    # Once per boot (the first caller probes, here or in a node that needs
+    # the interface), so the portal, transition and monitor read the profile
+    profile = capabilities.profile()
+    print(f"RaspiWiFi: {profile['interface']} driver={profile['driver']} backend={profile['backend']}")
+
+
+def start_hostapd():
+    # Bring hostapd.conf up to date first so hostapd starts with the right SSID and key
+    hostapd_config.apply_from_config(HOSTAPD_CONF, reload=False)
+    start_service('hostapd', 'hostapd', '-B', HOSTAPD_CONF)
+
+
+def prepare_network():
+    # NetworkManager would fight over the interface; dhcpcd applies the static AP address
+    service_control.apply({
+        'NetworkManager': service_control.want(active=False),
+        'dhcpcd': service_control.want(enabled=True, active=True),
+    })
+
+
+def stop_ap_services():
+    service_control.apply({
+        'hostapd': service_control.want(enabled=True, active=False),
+        'dnsmasq': service_control.want(enabled=True, active=False),
+    })
+    run_commands(['pkill', '-x', 'hostapd'], ['pkill', '-x', 'dnsmasq'])
+
+
+def assign_ap_address(interface=None):
+    interface = interface or capabilities.interface()
+    run_commands(
+        ['ip', 'link', 'set', interface, 'down'],
+        ['ip', 'addr', 'flush', 'dev', interface],
+        ['ip', 'addr', 'add', AP_ADDRESS + '/24', 'dev', interface],
+        ['ip', 'link', 'set', interface, 'up'],
+    )
+
+
+######## GRAPHS ##########
+
+def ap_network_nodes():
+    """
+    The access point itself, without the portal:
+
+        prepare_network --> interface_address --+--> dnsmasq
+        stop_ap_services -----------------------+--> hostapd
+    """
+    return [
+        Node('prepare_network', prepare_network, phase='networkmanager_stopped'),
+        Node('stop_ap_services', stop_ap_services, lambda: processes_gone('hostapd', 'dnsmasq'),
+             timeout=10, phase='services_stopped'),
+        Node('interface_address', assign_ap_address, lambda: has_address(AP_ADDRESS),
+             after=['prepare_network'], timeout=15, phase='static_ip'),
+        Node('dnsmasq', lambda: start_service('dnsmasq', 'dnsmasq'), lambda: udp_port_bound(53),
+             after=['interface_address', 'stop_ap_services'], timeout=15, phase='dnsmasq_up'),
+        Node('hostapd', start_hostapd, ap_mode_active,
+             after=['interface_address', 'stop_ap_services'], timeout=30, phase='hostapd_broadcasting'),
+    ]
+
+
+def ap_mode_nodes():
+    """
+    Configuration (AP host) mode:
+
+        prepare_network --> interface_address --+--> dnsmasq --+--> portal
+        stop_ap_services -----------------------+--> hostapd --+
+        probe_capabilities ------------------------------------+
+        reset_daemon
+
+    With daemon_mode=unified the portal node starts the unified daemon,
+    which also runs the reset daemon.
+    """
+    port = raspiwifi_config.get('server_port')
+    if raspiwifi_config.get('daemon_mode') == 'unified':
+        portal_command = (sys.executable, UNIFIED_DAEMON, 'ap')
+    elif raspiwifi_config.get('fast_start'):
+        portal_command = (sys.executable, FAST_START_APP)
+    else:
+        portal_command = (sys.executable, CONFIGURATION_APP)
+
+    nodes = [Node('probe_capabilities', probe_capabilities)] + ap_network_nodes() + [
+        # app.py (or fast_start.py) records portal_listening itself
+        Node('portal', lambda: launch(*portal_command), lambda: tcp_listening(port),
+             after=['dnsmasq', 'hostapd', 'probe_capabilities'], timeout=60),
+    ]
+    if raspiwifi_config.get('daemon_mode') != 'unified':
+        nodes.append(Node('reset_daemon', lambda: launch(sys.executable, os.path.join(RESET_DEVICE_DIR, 'reset.py'))))
+    return nodes
+
+
+def client_mode_nodes():
+    """
+    Client mode:
+
+        reset_daemon
+        probe_capabilities --> connection_monitor
+        client_address (wait only)
+
+    With daemon_mode=unified one unified daemon replaces the reset daemon
+    and the connection monitor.
+    """
+    nodes = [Node('probe_capabilities', probe_capabilities)]
+    if raspiwifi_config.get('daemon_mode') == 'unified':
+        nodes.append(Node('unified_daemon', lambda: launch(sys.executable, UNIFIED_DAEMON, 'client'),
+                          after=['probe_capabilities']))
+    else:
+        nodes += [
+            Node('reset_daemon', lambda: launch(sys.executable, os.path.join(RESET_DEVICE_DIR, 'reset.py'))),
+            Node('connection_monitor',
+                 lambda: launch(sys.executable, os.path.join(RESET_DEVICE_DIR, 'connection_monitor.py')),
+                 after=['probe_capabilities']),
+        ]
+    nodes.append(Node('client_address', ready=has_client_address, timeout=90, phase='client_address'))
+    return nodes
+
+
+def restore_ap_mode(log=print):
+    """
+    Bring the access point back from a failed switch to client mode,
+    without a reboot: stop the client side (wpa_supplicant, NetworkManager),
+    put the AP dhcpcd.conf back and run the AP network graph again. The
+    portal keeps running throughout. Returns True if hostapd is broadcasting.
+    """
+    # The transition replaced it with the client mode dhcpcd.conf.original
+    shutil.copy(os.path.join(RESET_DEVICE_DIR, 'static_files', 'dhcpcd.conf'), '/etc/dhcpcd.conf')
+    service_control.apply({
+        'wpa_supplicant': service_control.want(active=False),
+        'NetworkManager': service_control.want(active=False),
+        'dhcpcd': service_control.want(restart=True),
+    })
+    run_commands(['pkill', '-x', 'wpa_supplicant'], ['pkill', '-x', 'dhclient'])
+
+    nodes = ap_network_nodes()
+    for node in nodes:
+        # Not part of the boot, so keep it out of the boot timeline
+        node.phase = None
+    orchestrator = BootOrchestrator(nodes, log=log)
+    results = orchestrator.run()
+    log(f"RaspiWiFi: AP mode restored in {orchestrator.total_seconds:.2f}s")
+    return results['hostapd']['status'] == 'ready'
+
+
+def boot(mode):
+    boot_timeline.mark('bootstrap_start', 'boot_orchestrator')
+    nodes = ap_mode_nodes() if mode == 'ap' else client_mode_nodes()
+    orchestrator = BootOrchestrator(nodes)
+    results = orchestrator.run()
+
+    boot_timeline.mark('boot_ready', 'boot_orchestrator')
+    print(f"RaspiWiFi: {mode} mode startup finished in {orchestrator.total_seconds:.2f}s "
+          f"({boot_timeline.now():.2f}s since boot)")
+    for name, result in sorted(results.items(), key=lambda item: item[1]['finished']):
+        print(f"  {name:<20} {result['status']:<8} {result['started']:>6.2f}s -> {result['finished']:>6.2f}s")
+    return results
+
+
+if __name__ == '__main__':
+    # Run by the bootstrappers in /etc/cron.raspiwifi: boot_orchestrator.py ap|client
+    if len(sys.argv) != 2 or sys.argv[1] not in ('ap', 'client'):
+        print("usage: boot_orchestrator.py ap|client")
+        sys.exit(1)
+    boot(sys.argv[1])
@@ -0,0 +1,201 @@
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+TIMELINE_FILE = '/var/log/raspiwifi/boot_timeline.log'
+BOOT_ID_FILE = '/proc/sys/kernel/random/boot_id'
+
+# The log is trimmed back to the newest KEEP_BOOTS boots once it grows past MAX_BYTES
+MAX_BYTES = 64 * 1024
+KEEP_BOOTS = 20
+
+# Phases in the order they normally happen, used to order report rows
+PHASES = (
+    'bootstrap_start',
+    'networkmanager_stopped',
+    'services_stopped',
+    'static_ip',
+    'dnsmasq_up',
+    'hostapd_broadcasting',
+    'portal_listening',
+    'portal_serving',
+    'client_address',
+    'reset_started',
+    'reset_boot_delay_done',
+    'reset_armed',
+    'monitor_armed',
+    'boot_ready',
+)
+
+_boot_id = None
+
+
+def boot_id():
+    global _boot_id
+    if _boot_id is None:
+        try:
+            with open(BOOT_ID_FILE) as boot_id_file:
+                _boot_id = boot_id_file.read().strip()[:8]
+        except OSError:
+            _boot_id = 'unknown'
+    return _boot_id
+
+
+def now():
+    """Seconds since the kernel booted, the same clock as /proc/uptime"""
+    return time.clock_gettime(time.CLOCK_BOOTTIME)
+
+
+def mark(phase, source=None, path=TIMELINE_FILE):
+    """
+    Append one "<boot id> <seconds since boot> <phase> <source>" line to the
+    timeline. Each event is a single O_APPEND write, so several processes
+    can log concurrently.
+    Instrumentation must never break a boot, so errors are ignored.
+    """
+    source = source or os.path.splitext(os.path.basename(sys.argv[0]))[0] or 'python'
+    line = f"{boot_id()} {now():.3f} {phase} {source}\n".encode('utf-8')
+    try:
+        fd = os.open(path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+    except FileNotFoundError:
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            fd = os.open(path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        except OSError:
+            return
+    except OSError:
+        return
+
+    try:
+        os.write(fd, line)
+        size = os.fstat(fd).st_size
+    except OSError:
+        size = 0
+    finally:
+        os.close(fd)
+
+    if size > MAX_BYTES:
+        try:
+            prune(path)
+        except OSError:
+            pass
+
+
+def read_events(path=TIMELINE_FILE):
+    """Return {boot id: [(seconds, phase, source), ...]} in file order"""
+    boots = {}
+    try:
+        with open(path, encoding='utf-8', errors='replace') as timeline_file:
+            for line in timeline_file:
+                fields = line.split()
+                if len(fields) < 3:
+                    continue
+                try:
+                    seconds = float(fields[1])
+                except ValueError:
+                    continue
+                source = fields[3] if len(fields) > 3 else ''
+                boots.setdefault(fields[0], []).append((seconds, fields[2], source))
+    except FileNotFoundError:
+        pass
+
+    for events in boots.values():
+        events.sort()
+    return boots
+
+
+def prune(path=TIMELINE_FILE, keep=KEEP_BOOTS):
+    boots = read_events(path)
+    kept = list(boots.items())[-keep:]
+    fd, temp_path = tempfile.mkstemp(prefix='.boot_timeline.', dir=os.path.dirname(path))
+    try:
+        with os.fdopen(fd, 'w', encoding='utf-8') as temp_file:
+            for boot, events in kept:
+                for seconds, phase, source in events:
+                    temp_file.write(f"{boot} {seconds:.3f} {phase} {source}\n")
+        os.chmod(temp_path, 0o644)
+        os.replace(temp_path, path)
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+
+
+def phase_times(events):
+    """Return {phase: (seconds since boot, seconds since the previous event)} for one boot"""
+    times = {}
+    previous = None
+    for seconds, phase, source in events:
+        if phase in times:
+            continue
+        times[phase] = (seconds, seconds - previous if previous is not None else seconds)
+        previous = seconds
+    return times
+
+
+def _ordered_phases(boots):
+    seen = []
+    for events in boots:
+        for _, phase, _ in events:
+            if phase not in seen:
+                seen.append(phase)
+    known = [phase for phase in PHASES if phase in seen]
+    return known + [phase for phase in seen if phase not in PHASES]
+
+
+def report(path=TIMELINE_FILE, boots=1, out=sys.stdout):
+    """Print per-phase timings for the last `boots` boots, with a median column when comparing"""
+    all_boots = read_events(path)
+    if not all_boots:
+        print(f"No boot timeline recorded in {path}", file=out)
+        return
+
+    selected = list(all_boots.items())[-boots:]
+
+    if len(selected) == 1:
+        boot, events = selected[0]
+        print(f"Boot {boot}:", file=out)
+        print(f"  {'phase':<24} {'at':>9} {'took':>9}  source", file=out)
+        previous = None
+        for seconds, phase, source in events:
+            took = seconds - previous if previous is not None else seconds
+            print(f"  {phase:<24} {seconds:>8.2f}s {took:>8.2f}s  {source}", file=out)
+            previous = seconds
+        return
+
+    # Comparison: seconds since the previous event per phase, one column per boot
+    timings = [phase_times(events) for _, events in selected]
+    header = f"  {'phase':<24}" + ''.join(f" {boot:>9}" for boot, _ in selected) + f" {'median':>9}"
+    print("Seconds spent reaching each phase (since the previous event):", file=out)
+    print(header, file=out)
+    for phase in _ordered_phases([events for _, events in selected]):
+        row = f"  {phase:<24}"
+        values = []
+        for times in timings:
+            if phase in times:
+                values.append(times[phase][1])
+                row += f" {times[phase][1]:>8.2f}s"
+            else:
+                row += f" {'-':>9}"
+        row += f" {statistics.median(values):>8.2f}s"
+        print(row, file=out)
+
+    row = f"  {'total (since boot)':<24}"
+    for _, events in selected:
+        row += f" {events[-1][0]:>8.2f}s"
+    print(row, file=out)
+
+
+if __name__ == '__main__':
+    # python3 boot_timeline.py report [boots]   -- show the last boot, or compare the last N
+    # python3 boot_timeline.py mark <phase> [source]
+    command = sys.argv[1] if len(sys.argv) > 1 else 'report'
+    if command == 'mark' and len(sys.argv) > 2:
+        mark(sys.argv[2], sys.argv[3] if len(sys.argv) > 3 else 'shell')
+    elif command == 'report':
+        report(boots=int(sys.argv[2]) if len(sys.argv) > 2 else 1)
+    else:
+        print("usage: boot_timeline.py report [boots] | mark <phase> [source]")
+        sys.exit(1)
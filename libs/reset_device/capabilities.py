@@ -0,0 +1,166 @@
+import json
+import os
+import re
+import shutil
+import sys
+import threading
+
+import boot_timeline
+import command_runner
+import raspiwifi_config
+
+CAPABILITIES_FILE = '/etc/raspiwifi/capabilities.json'
+SYSFS_NET = '/sys/class/net'
+
+# Tools looked up on PATH; versions are only asked for those in TOOL_VERSIONS
+TOOLS = ('nmcli', 'wpa_supplicant', 'wpa_cli', 'hostapd', 'hostapd_cli', 'dnsmasq', 'dhcpcd', 'dhclient',
+         'iwlist', 'iw', 'iwconfig', 'iwevent')
+TOOL_VERSIONS = {
+    'nmcli': ['nmcli', '--version'],
+    'wpa_supplicant': ['wpa_supplicant', '-v'],
+    'hostapd': ['hostapd', '-v'],
+    'dnsmasq': ['dnsmasq', '--version'],
+}
+VERSION_RE = re.compile(r'v?(\d+(?:\.\d+)+)')
+
+NM_UNIT_PATHS = ('/lib/systemd/system/NetworkManager.service', '/usr/lib/systemd/system/NetworkManager.service',
+                 '/etc/systemd/system/NetworkManager.service')
+
+
+def wireless_interfaces():
+    """Names of wireless interfaces, from /sys/class/net/*/wireless (or phy80211)"""
+    try:
+        names = sorted(os.listdir(SYSFS_NET))
+    except OSError:
+        return []
+    return [name for name in names
+            if os.path.isdir(os.path.join(SYSFS_NET, name, 'wireless'))
+            or os.path.exists(os.path.join(SYSFS_NET, name, 'phy80211'))]
+
+
+def interface_driver(interface):
+    """Kernel driver (module) name of an interface, e.g. brcmfmac, or None"""
+    try:
+        return os.path.basename(os.readlink(os.path.join(SYSFS_NET, interface, 'device', 'driver')))
+    except OSError:
+        return None
+
+
+def tool_version(command):
+    result = command_runner.run(command, timeout=5)
+    if result.timed_out or result.returncode == 127:
+        return None
+    match = VERSION_RE.search(result.stdout + result.stderr)
+    return match.group(1) if match else None
+
+
+def probe(interface='wlan0'):
+    """
+    Work out once what this device has: wireless interfaces and their
+    driver, which network tools are installed (and their versions), and
+    from that the connection backend to use. interface is preferred if it
+    exists, otherwise the first wireless interface is used.
+    """
+    interfaces = wireless_interfaces()
+    if interface not in interfaces and interfaces:
+        interface = interfaces[0]
+
+    tools = {name: shutil.which(name) is not None for name in TOOLS}
+    versions = {}
+    version_lock = threading.Lock()
+
+    def read_version(name):
+        version = tool_version(TOOL_VERSIONS[name])
+        with version_lock:
+            versions[name] = version
+
+    # The version commands are independent; run them side by side
+    threads = [threading.Thread(target=read_version, args=(name,)) for name in TOOL_VERSIONS if tools[name]]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    networkmanager = tools['nmcli'] and any(os.path.exists(path) for path in NM_UNIT_PATHS)
+    # cfg80211 drivers expose phy80211 and speak nl80211; older ones only wireless extensions
+    nl80211 = os.path.exists(os.path.join(SYSFS_NET, interface, 'phy80211'))
+
+    return {
+        'boot_id': boot_timeline.boot_id(),
+        'interface': interface,
+        'interfaces': interfaces,
+        'driver': interface_driver(interface),
+        'wpa_driver': 'nl80211' if nl80211 else 'wext',
+        'tools': tools,
+        'versions': versions,
+        'networkmanager': networkmanager,
+        'backend': choose_backend(networkmanager, tools),
+        'scanner': 'iwlist' if tools['iwlist'] else None,
+    }
+
+
+def choose_backend(networkmanager, tools):
+    """Connection backend: network_backend from raspiwifi.conf, or the best one available"""
+    configured = raspiwifi_config.get('network_backend')
+    if configured in ('networkmanager', 'wpa_supplicant'):
+        return configured
+    if networkmanager:
+        return 'networkmanager'
+    if tools['wpa_supplicant']:
+        return 'wpa_supplicant'
+    return None
+
+
+class Capabilities:
+    """
+    The probed profile, stored in CAPABILITIES_FILE and re-probed only
+    when the boot id changes, so callers (transition, scanner, monitor)
+    read it instead of asking systemctl, pgrep and nmcli each time.
+    """
+
+    def __init__(self, path=CAPABILITIES_FILE):
+        self.path = path
+        self._lock = threading.Lock()
+        self._profile = None
+
+    def profile(self, refresh=False):
+        with self._lock:
+            if self._profile is None and not refresh:
+                self._profile = self._read()
+            if refresh or self._profile is None or self._profile.get('boot_id') != boot_timeline.boot_id():
+                self._profile = probe()
+                self._write(self._profile)
+            return self._profile
+
+    def _read(self):
+        try:
+            with open(self.path, encoding='utf-8') as profile_file:
+                return json.load(profile_file)
+        except (OSError, ValueError):
+            return None
+
+    def _write(self, profile):
+        try:
+            raspiwifi_config.write_atomic(self.path, json.dumps(profile, indent=1, sort_keys=True))
+        except OSError as e:
+            print(f"RaspiWiFi: Could not save capability profile: {e}")
+
+
+default_capabilities = Capabilities()
+
+
+def profile(refresh=False):
+    return default_capabilities.profile(refresh)
+
+
+def interface():
+    return profile()['interface']
+
+
+def backend():
+    return profile()['backend']
+
+
+if __name__ == '__main__':
+    # python3 capabilities.py [--refresh] -- show (or re-probe) this device's profile
+    print(json.dumps(profile(refresh='--refresh' in sys.argv[1:]), indent=2, sort_keys=True))
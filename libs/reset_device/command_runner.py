@@ -0,0 +1,224 @@
+import os
+import subprocess
+import threading
+import time
+
+import metrics
+
+# Seconds a command may run before it is killed, by program name. Programs
+# not listed get DEFAULT_TIMEOUT; None means no limit (package installs).
+DEFAULT_TIMEOUT = 30
+TIMEOUTS = {
+    'ip': 5,
+    'ifconfig': 5,
+    'iw': 5,
+    'iwconfig': 5,
+    'iwlist': 20,
+    'pgrep': 5,
+    'pkill': 5,
+    'killall': 5,
+    'hostapd_cli': 5,
+    'wpa_cli': 10,
+    'nmcli': 45,
+    'systemctl': 60,
+    'ping': 15,
+    'aplay': 15,
+    'apt': None,
+    'pip3': None,
+}
+
+# Forks in flight at once; more callers wait for a slot instead of piling up
+MAX_CONCURRENT = 4
+
+COMMAND_SECONDS = metrics.histogram('raspiwifi_command_seconds', 'Run time of external commands, by program')
+COMMANDS = metrics.counter('raspiwifi_commands_total', 'External commands run, by program and outcome')
+
+_slots = threading.BoundedSemaphore(MAX_CONCURRENT)
+_stats_lock = threading.Lock()
+_stats = {}
+
+# Marker for "use the per-program default"; None already means no limit
+DEFAULT = object()
+
+
+def program(args):
+    return os.path.basename(args[0])
+
+
+def default_timeout(args):
+    return TIMEOUTS.get(program(args), DEFAULT_TIMEOUT)
+
+
+class CommandResult:
+    """Outcome of a finished command. returncode is None if it timed out, 127 if it could not be started."""
+
+    def __init__(self, args, returncode, stdout='', stderr='', duration=0.0, timed_out=False):
+        self.args = args
+        self.returncode = returncode
+        self.stdout = stdout or ''
+        self.stderr = stderr or ''
+        self.duration = duration
+        self.timed_out = timed_out
+
+    @property
+    def ok(self):
+        return self.returncode == 0
+
+    def __repr__(self):
+        return f'CommandResult({program(self.args)!r}, returncode={self.returncode}, {self.duration:.3f}s)'
+
+
+class Command:
+    """
+    One external command, started without a shell. start() waits for one of
+    MAX_CONCURRENT slots and arms a timer that kills the process at its
+    timeout, so even a caller streaming its output can not hang on it.
+    wait() collects the output, frees the slot and records the run.
+    """
+
+    def __init__(self, args, timeout=DEFAULT, input=None, capture=True):
+        self.args = [str(arg) for arg in args]
+        self.timeout = default_timeout(self.args) if timeout is DEFAULT else timeout
+        self.input = input
+        self.capture = capture
+        self.process = None
+        self.timed_out = False
+        self._timer = None
+        self._started = None
+
+    def start(self):
+        _slots.acquire()
+        self._started = time.monotonic()
+        try:
+            self.process = subprocess.Popen(
+                self.args,
+                stdin=subprocess.PIPE if self.input is not None else subprocess.DEVNULL,
+                stdout=subprocess.PIPE if self.capture else None,
+                stderr=subprocess.PIPE if self.capture else None,
+                encoding='utf-8', errors='replace')
+        except OSError:
+            _slots.release()
+            raise
+        if self.timeout is not None:
+            self._timer = threading.Timer(self.timeout, self._expire)
+            self._timer.daemon = True
+            self._timer.start()
+        return self
+
+    def poll(self):
+        return self.process.poll()
+
+    def kill(self):
+        if self.process.poll() is None:
+            self.process.kill()
+
+    def wait(self):
+        try:
+            stdout, stderr = self.process.communicate(self.input)
+        finally:
+            if self._timer is not None:
+                self._timer.cancel()
+            _slots.release()
+        result = CommandResult(self.args, None if self.timed_out else self.process.returncode,
+                               stdout, stderr, time.monotonic() - self._started, self.timed_out)
+        _record(result)
+        return result
+
+    def _expire(self):
+        if self.process.poll() is None:
+            self.timed_out = True
+            self.process.kill()
+
+
+def run(args, timeout=DEFAULT, input=None, capture=True):
+    """Run a command to completion and return its CommandResult; never raises for a missing program"""
+    command = Command(args, timeout, input, capture)
+    try:
+        command.start()
+    except OSError as e:
+        result = CommandResult(command.args, 127, stderr=str(e))
+        _record(result)
+        return result
+    return command.wait()
+
+
+def ok(args, **kwargs):
+    """True if the command exited with status 0"""
+    return run(args, **kwargs).ok
+
+
+def output(args, **kwargs):
+    """The command's stdout, or '' if it failed"""
+    result = run(args, **kwargs)
+    return result.stdout if result.ok else ''
+
+
+def spawn(args, detach=False, quiet=False):
+    """
+    Start a long-running program (daemon, DHCP client) without waiting for
+    it. It takes no slot and has no timeout; only the start is recorded.
+    detach puts it in its own session; quiet discards its output.
+    """
+    args = [str(arg) for arg in args]
+    output = subprocess.DEVNULL if quiet else None
+    try:
+        process = subprocess.Popen(args, stdin=subprocess.DEVNULL, stdout=output, stderr=output,
+                                   start_new_session=detach)
+    except OSError as e:
+        _record(CommandResult(args, 127, stderr=str(e)))
+        return None
+    COMMANDS.inc(command=program(args), outcome='spawned')
+    return process
+
+
+def stream(args):
+    """
+    Start a long-running program whose output is read as it arrives, such
+    as `iw event`, and return its Popen with stdout as a binary pipe. Like
+    spawn() it takes no slot and has no timeout; stderr is discarded.
+    Raises OSError if the program can not be started, so callers can fall
+    back to another source.
+    """
+    args = [str(arg) for arg in args]
+    try:
+        process = subprocess.Popen(args, stdin=subprocess.DEVNULL, stdout=subprocess.PIPE,
+                                   stderr=subprocess.DEVNULL)
+    except OSError as e:
+        _record(CommandResult(args, 127, stderr=str(e)))
+        raise
+    COMMANDS.inc(command=program(args), outcome='spawned')
+    return process
+
+
+def _record(result):
+    name = program(result.args)
+    if result.timed_out:
+        outcome = 'timeout'
+    elif result.returncode == 127:
+        outcome = 'not_found'
+    else:
+        outcome = 'ok' if result.ok else 'failed'
+
+    COMMANDS.inc(command=name, outcome=outcome)
+    COMMAND_SECONDS.observe(result.duration, command=name)
+    with _stats_lock:
+        entry = _stats.setdefault(name, {'runs': 0, 'ok': 0, 'failed': 0, 'timeout': 0, 'not_found': 0,
+                                         'total_seconds': 0.0, 'max_seconds': 0.0, 'last_returncode': None})
+        entry['runs'] += 1
+        entry[outcome] += 1
+        entry['total_seconds'] += result.duration
+        entry['max_seconds'] = max(entry['max_seconds'], result.duration)
+        entry['last_returncode'] = result.returncode
+    if outcome == 'timeout':
+        print(f"RaspiWiFi: {name} killed after {result.duration:.1f}s timeout")
+
+
+def stats():
+    """Per-program run counts by outcome and run times of this process, slowest first"""
+    with _stats_lock:
+        entries = {name: dict(entry) for name, entry in _stats.items()}
+    for entry in entries.values():
+        entry['avg_seconds'] = round(entry['total_seconds'] / entry['runs'], 3)
+        entry['total_seconds'] = round(entry['total_seconds'], 3)
+        entry['max_seconds'] = round(entry['max_seconds'], 3)
+    return dict(sorted(entries.items(), key=lambda item: -item[1]['total_seconds']))
@@ -1,39 +1,38 @@
-import time
 import sys
-import os
 import reset_lib
+import link_monitor
+import raspiwifi_config
+import boot_timeline
+import capabilities
+import metrics
 
-no_conn_counter = 0
-consecutive_active_reports = 0
-config_hash = reset_lib.config_file_hash()
 
-# If auto_config is set to 0 in /etc/raspiwifi/raspiwifi.conf exit this script
-if config_hash['auto_config'] == "0":
-    sys.exit()
-else:
-    # Main connection monitoring loop at 10 second interval
-    while True:
-        time.sleep(10)
+def make_monitor():
+    """Return the LinkMonitor for client mode, or None if auto_config is disabled"""
+    # If auto_config is set to 0 in /etc/raspiwifi/raspiwifi.conf there is nothing to monitor
+    if not raspiwifi_config.get('auto_config'):
+        return None
 
-        # If iwconfig report no association with an AP add 10 to the "No
-        # Connection Couter"
-        if reset_lib.is_wifi_active() == False:
-            no_conn_counter += 10
-            consecutive_active_reports = 0
-        # If iwconfig report association with an AP add 1 to the
-        # consecutive_active_reports counter and 10 to the no_conn_counter
-        else:
-            consecutive_active_reports += 1
-            no_conn_counter += 10
-            # Since wpa_supplicant seems to breifly associate with an AP for
-            # 6-8 seconds to check the network key the below will reset the
-            # no_conn_counter to 0 only if two 10 second checks have come up active.
-            if consecutive_active_reports >= 2:
-                no_conn_counter = 0
-                consecutive_active_reports = 0
+    # If the link has not been stably associated with an AP for
+    # auto_config_delay seconds (as specified in /etc/raspiwifi/raspiwifi.conf)
+    # trigger a reset into AP Host (Configuration) mode.
+    monitor = link_monitor.LinkMonitor(raspiwifi_config.get('auto_config_delay'),
+                                       lambda: reset_lib.reset_to_host_mode('link_lost'),
+                                       interface=capabilities.interface())
+    boot_timeline.mark('monitor_armed')
+    return monitor
 
-        # If the number of seconds not associated with an AP is greater or
-        # equal to the auto_config_delay specified in the /etc/raspiwifi/raspiwifi.conf
-        # trigger a reset into AP Host (Configuration) mode.
-        if no_conn_counter >= int(config_hash['auto_config_delay']):
-            reset_lib.reset_to_host_mode()
+
+if __name__ == '__main__':
+    monitor = make_monitor()
+    if monitor is None:
+        sys.exit()
+    metrics.start_exporter('monitor')
+
+    # "event" sleeps until the kernel reports a link change, "poll" keeps the
+    # original 10 second iwconfig polling loop
+    is_wifi_active = lambda: reset_lib.is_wifi_active(monitor.interface)
+    if raspiwifi_config.get('monitor_mode') == 'poll':
+        monitor.poll(is_wifi_active)
+    else:
+        monitor.run(is_wifi_active)
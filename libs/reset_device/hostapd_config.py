@@ -0,0 +1,187 @@
+import capabilities
+import command_runner
+import raspiwifi_config
+import wpa_psk
+
+HOSTAPD_CONF = '/etc/hostapd/hostapd.conf'
+NOWPA_TEMPLATE = '/usr/lib/raspiwifi/reset_device/static_files/hostapd.conf.nowpa'
+CTRL_INTERFACE = '/var/run/hostapd'
+
+# Settings that make up WPA2-PSK; all of them (and the key) are removed for an open AP
+WPA_SETTINGS = (
+    ('auth_algs', '1'),
+    ('wpa', '2'),
+    ('wpa_key_mgmt', 'WPA-PSK'),
+    ('rsn_pairwise', 'CCMP'),
+)
+WPA_KEY_SETTINGS = ('wpa_passphrase', 'wpa_psk')
+
+
+class HostapdConfig:
+    """
+    hostapd.conf as an ordered list of lines. Comments, blank lines and
+    keys this module does not manage are kept as they are, so rendering an
+    unchanged model gives back the original file.
+    """
+
+    def __init__(self, lines=()):
+        self.lines = list(lines)
+
+    @classmethod
+    def parse(cls, text):
+        return cls(text.splitlines())
+
+    @classmethod
+    def load(cls, path=HOSTAPD_CONF):
+        """Parse path, or return None if it can not be read"""
+        try:
+            with open(path, encoding='utf-8', errors='replace') as conf_file:
+                return cls.parse(conf_file.read())
+        except OSError:
+            return None
+
+    def copy(self):
+        return HostapdConfig(self.lines)
+
+    def settings(self):
+        """Return {key: value} of all settings (the first one wins for repeated keys)"""
+        values = {}
+        for line in self.lines:
+            key, value = _split(line)
+            if key is not None:
+                values.setdefault(key, value)
+        return values
+
+    def get(self, key, default=None):
+        return self.settings().get(key, default)
+
+    def set(self, key, value):
+        """Set key in place of its first occurrence (dropping repeats), or append it"""
+        new_lines = []
+        found = False
+        for line in self.lines:
+            if _split(line)[0] == key:
+                if not found:
+                    new_lines.append(key + '=' + value)
+                found = True
+            else:
+                new_lines.append(line)
+        if not found:
+            new_lines.append(key + '=' + value)
+        self.lines = new_lines
+
+    def remove(self, key):
+        self.lines = [line for line in self.lines if _split(line)[0] != key]
+
+    def render(self):
+        return '\n'.join(self.lines) + '\n'
+
+
+def _split(line):
+    stripped = line.strip()
+    if not stripped or stripped.startswith('#') or '=' not in stripped:
+        return None, None
+    key, value = stripped.split('=', 1)
+    return key.strip(), value
+
+
+def serial_last_four():
+    """
+    The four characters before the final newline of /proc/cpuinfo. That is
+    the end of the Serial line on most kernels, but not on those that list
+    Model last; it is kept as it is so installed devices keep their SSID.
+    """
+    try:
+        with open('/proc/cpuinfo', 'rb') as cpuinfo_file:
+            cpuinfo = cpuinfo_file.read()
+    except OSError:
+        return '0000'
+    return cpuinfo[-5:-1].decode('utf-8', errors='replace')
+
+
+def ap_ssid(ssid_prefix):
+    # Two spaces: older releases appended ' ' to the prefix and then joined
+    # it to the serial with another, and installed devices keep that SSID
+    return ssid_prefix + '  ' + serial_last_four()
+
+
+def desired_config(current, ssid, wpa_enabled, wpa_key):
+    """Return a copy of current with the SSID and WPA settings from raspiwifi.conf applied"""
+    desired = current.copy()
+    desired.set('ssid', ssid)
+    if desired.get('ctrl_interface') is None:
+        desired.set('ctrl_interface', CTRL_INTERFACE)
+
+    if wpa_enabled:
+        for key, value in WPA_SETTINGS:
+            desired.set(key, value)
+        # A precomputed PSK spares hostapd the PBKDF2 derivation on every start
+        psk = wpa_psk.psk(ssid, wpa_key)
+        if psk is not None:
+            desired.remove('wpa_passphrase')
+            desired.set('wpa_psk', psk)
+        else:
+            desired.remove('wpa_psk')
+            desired.set('wpa_passphrase', wpa_key)
+    else:
+        for key, _ in WPA_SETTINGS:
+            desired.remove(key)
+        for key in WPA_KEY_SETTINGS:
+            desired.remove(key)
+
+    return desired
+
+
+def changed_keys(old, new):
+    old_settings = old.settings()
+    new_settings = new.settings()
+    return sorted(key for key in set(old_settings) | set(new_settings)
+                  if old_settings.get(key) != new_settings.get(key))
+
+
+def apply(ssid, wpa_enabled, wpa_key, path=HOSTAPD_CONF, reload=True):
+    """
+    Bring hostapd.conf to the desired state. The file is only rewritten
+    (atomically) when its content differs, and a running hostapd is told to
+    reload it instead of rebooting the Pi. Returns the changed keys.
+    """
+    current = HostapdConfig.load(path)
+    existed = current is not None
+    if current is None:
+        current = HostapdConfig.load(NOWPA_TEMPLATE) or HostapdConfig()
+
+    desired = desired_config(current, ssid, wpa_enabled, wpa_key)
+    if existed and desired.render() == current.render():
+        return []
+
+    changes = changed_keys(current, desired) if existed else sorted(desired.settings())
+    raspiwifi_config.write_atomic(path, desired.render())
+    print(f"RaspiWiFi: hostapd.conf updated ({', '.join(changes)})")
+    if reload:
+        reload_hostapd()
+    return changes
+
+
+def apply_from_config(path=HOSTAPD_CONF, reload=True):
+    """apply() with the SSID prefix and WPA settings from raspiwifi.conf"""
+    return apply(ap_ssid(raspiwifi_config.get('ssid_prefix')),
+                 raspiwifi_config.get('wpa_enabled'),
+                 raspiwifi_config.get('wpa_key'),
+                 path=path, reload=reload)
+
+
+def reload_hostapd(interface=None):
+    """
+    Make a running hostapd re-read hostapd.conf. SIGHUP does that on every
+    version; without pkill, RELOAD_CONFIG (hostapd 2.10+) does too. The
+    older RELOAD command only re-enables the interface from the settings in
+    memory, so it is the last resort. Returns False if hostapd is not
+    running; it reads the new file when it is next started.
+    """
+    if command_runner.ok(['pkill', '-HUP', '-x', 'hostapd']):
+        return True
+    interface = interface or capabilities.interface()
+    for command in ('reload_config', 'reload'):
+        if 'OK' in command_runner.output(['hostapd_cli', '-p', CTRL_INTERFACE, '-i', interface, command]):
+            return True
+    return False
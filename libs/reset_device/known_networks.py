@@ -0,0 +1,272 @@
+import json
+import os
+import threading
+import time
+import uuid
+
+import raspiwifi_config
+import wpa_psk
+
+KNOWN_NETWORKS_FILE = '/etc/raspiwifi/known_networks.json'
+NM_CONNECTIONS_DIR = '/etc/NetworkManager/system-connections'
+NM_PROFILE_PREFIX = 'raspiwifi-'
+
+# Oldest (by last use) networks beyond this many are forgotten
+MAX_NETWORKS = 16
+
+# NetworkManager profile UUIDs are derived from the SSID, so rewriting the
+# profiles replaces them instead of adding one more per save
+NM_UUID_NAMESPACE = uuid.UUID('5d1c7e52-3a0b-4b8e-9a51-6f7e0c2d9b14')
+
+# Scoring against the scan cache (signal is in dBm, roughly -90..-30)
+SUCCESS_BONUS = 15
+FAILURE_PENALTY = 10
+MAX_FAILURE_PENALTY = 30
+CONNECT_SECONDS_WEIGHT = 0.5
+
+
+def new_entry(ssid):
+    return {
+        'ssid': ssid,
+        'psk': None,
+        'passphrase': None,
+        'added': time.time(),
+        'last_success': None,
+        'last_failure': None,
+        'failures': 0,
+        'connects': 0,
+        'avg_connect_seconds': None,
+        'last_rssi': None,
+    }
+
+
+def score(entry, signal):
+    """
+    Rank of a known network that is visible with signal (dBm): stronger is
+    better, a network whose last attempt succeeded gets a bonus, every
+    consecutive failure and every second of average connect time costs.
+    """
+    value = signal
+    if entry['last_success'] and (entry['last_failure'] or 0) <= entry['last_success']:
+        value += SUCCESS_BONUS
+    value -= min(entry['failures'] * FAILURE_PENALTY, MAX_FAILURE_PENALTY)
+    if entry['avg_connect_seconds'] is not None:
+        value -= entry['avg_connect_seconds'] * CONNECT_SECONDS_WEIGHT
+    return value
+
+
+class KnownNetworks:
+    """
+    Networks the device has been given credentials for, with their connect
+    history. Persisted as root-only JSON. Where possible the key is kept as
+    the derived PSK only, not as the passphrase.
+    """
+
+    def __init__(self, path=KNOWN_NETWORKS_FILE):
+        self.path = path
+        self._lock = threading.Lock()
+        self._networks = None
+
+    def all(self):
+        with self._lock:
+            return [dict(entry) for entry in self._load().values()]
+
+    def get(self, ssid):
+        with self._lock:
+            entry = self._load().get(ssid)
+            return dict(entry) if entry else None
+
+    def remember(self, ssid, key):
+        """Add or update a network's credentials; a changed key resets its history"""
+        psk = wpa_psk.psk(ssid, key) if key else None
+        passphrase = key if key and psk is None else None
+
+        with self._lock:
+            networks = self._load()
+            entry = networks.get(ssid)
+            if entry is None or entry['psk'] != psk or entry['passphrase'] != passphrase:
+                entry = new_entry(ssid)
+            entry['psk'] = psk
+            entry['passphrase'] = passphrase
+            networks[ssid] = entry
+            self._save()
+            return dict(entry)
+
+    def forget(self, ssid):
+        with self._lock:
+            if self._load().pop(ssid, None) is not None:
+                self._save()
+
+    def record_success(self, ssid, connect_seconds, rssi=None):
+        with self._lock:
+            entry = self._load().get(ssid)
+            if entry is None:
+                return
+            entry['last_success'] = time.time()
+            entry['failures'] = 0
+            entry['connects'] += 1
+            if entry['avg_connect_seconds'] is None:
+                entry['avg_connect_seconds'] = round(connect_seconds, 2)
+            else:
+                # Running mean over all successful connects
+                average = entry['avg_connect_seconds']
+                entry['avg_connect_seconds'] = round(average + (connect_seconds - average) / entry['connects'], 2)
+            if rssi is not None:
+                entry['last_rssi'] = rssi
+            self._save()
+
+    def record_failure(self, ssid):
+        with self._lock:
+            entry = self._load().get(ssid)
+            if entry is None:
+                return
+            entry['last_failure'] = time.time()
+            entry['failures'] += 1
+            self._save()
+
+    def ranked(self, scan_results=(), prefer=None):
+        """
+        Known networks, best first. Networks visible in scan_results (scan
+        records with .ssid and .signal) are ordered by score(); the rest
+        follow, most recently successful first. prefer (an SSID, e.g. the
+        one just submitted) always goes first.
+        """
+        signals = {}
+        for network in scan_results:
+            if network.signal is not None:
+                signals[network.ssid] = max(network.signal, signals.get(network.ssid, network.signal))
+
+        def sort_key(entry):
+            if entry['ssid'] == prefer:
+                return (0, 0)
+            if entry['ssid'] in signals:
+                return (1, -score(entry, signals[entry['ssid']]))
+            return (2, -(entry['last_success'] or 0))
+
+        return sorted(self.all(), key=sort_key)
+
+    def _load(self):
+        if self._networks is None:
+            try:
+                with open(self.path, encoding='utf-8') as networks_file:
+                    entries = json.load(networks_file)['networks']
+                self._networks = {entry['ssid']: dict(new_entry(entry['ssid']), **entry) for entry in entries}
+            except (OSError, ValueError, KeyError, TypeError):
+                self._networks = {}
+        return self._networks
+
+    def _save(self):
+        networks = self._networks
+        if len(networks) > MAX_NETWORKS:
+            by_use = sorted(networks.values(), key=lambda entry: entry['last_success'] or entry['added'])
+            for entry in by_use[:len(networks) - MAX_NETWORKS]:
+                del networks[entry['ssid']]
+        try:
+            raspiwifi_config.write_atomic(self.path, json.dumps({'networks': list(networks.values())}, indent=1),
+                                          default_mode=0o600)
+        except OSError as e:
+            print(f"RaspiWiFi: Could not save known networks: {e}")
+
+
+default_store = KnownNetworks()
+
+
+def remember(ssid, key):
+    return default_store.remember(ssid, key)
+
+
+def record_success(ssid, connect_seconds, rssi=None):
+    default_store.record_success(ssid, connect_seconds, rssi)
+
+
+def record_failure(ssid):
+    default_store.record_failure(ssid)
+
+
+def ranked(scan_results=(), prefer=None):
+    return default_store.ranked(scan_results, prefer)
+
+
+######## PROFILES ##########
+
+def _quote_wpa(value):
+    return '"' + value.replace('\\', '\\\\').replace('"', '\\"') + '"'
+
+
+def render_wpa_supplicant(networks, country='US'):
+    """wpa_supplicant.conf with one network block per entry, earlier entries at higher priority"""
+    lines = [
+        'ctrl_interface=DIR=/var/run/wpa_supplicant GROUP=netdev',
+        'update_config=1',
+        f'country={country}',
+        'ap_scan=1',
+    ]
+    for index, entry in enumerate(networks):
+        lines.append('')
+        lines.append('network={')
+        lines.append(f'    ssid={_quote_wpa(entry["ssid"])}')
+        if entry['psk'] is None and entry['passphrase'] is None:
+            lines.append('    key_mgmt=NONE')
+        else:
+            lines.append(f'    psk={entry["psk"]}' if entry['psk'] else f'    psk={_quote_wpa(entry["passphrase"])}')
+            lines.append('    key_mgmt=WPA-PSK')
+            lines.append('    proto=RSN WPA')  # Support both WPA and WPA2
+            lines.append('    pairwise=CCMP TKIP')  # Support both encryption types
+            lines.append('    group=CCMP TKIP')
+            lines.append('    scan_ssid=1')  # Allow hidden networks
+        lines.append(f'    priority={len(networks) - index}')
+        lines.append('    }')
+    return '\n'.join(lines) + '\n'
+
+
+def nm_profile_uuid(ssid):
+    return str(uuid.uuid5(NM_UUID_NAMESPACE, ssid))
+
+
+def render_nm_profile(entry, priority):
+    """NetworkManager keyfile for one known network"""
+    def escape(value):
+        return value.replace('\\', '\\\\').replace('\n', '\\n').replace('\r', '\\r')
+
+    lines = [
+        '[connection]',
+        f'id="{escape(entry["ssid"])}"',
+        f'uuid={nm_profile_uuid(entry["ssid"])}',
+        'type=wifi',
+        'autoconnect=true',
+        f'autoconnect-priority={priority}',
+        '',
+        '[wifi]',
+        f'ssid="{escape(entry["ssid"])}"',
+        'mode=infrastructure',
+        '',
+        '[wifi-security]',
+    ]
+    if entry['psk'] is None and entry['passphrase'] is None:
+        lines.append('key-mgmt=none')
+    else:
+        lines.append('key-mgmt=wpa-psk')
+        lines.append(f'psk={entry["psk"]}' if entry['psk'] else f'psk="{escape(entry["passphrase"])}"')
+    lines += ['', '[ipv4]', 'method=auto', '', '[ipv6]', 'method=auto']
+    return '\n'.join(lines) + '\n'
+
+
+def write_nm_profiles(networks, directory=NM_CONNECTIONS_DIR):
+    """
+    Write one NetworkManager profile per known network, earlier entries at
+    higher autoconnect priority, and remove profiles of forgotten networks.
+    Returns the written paths.
+    """
+    os.makedirs(directory, exist_ok=True)
+    written = []
+    for index, entry in enumerate(networks):
+        path = os.path.join(directory, f'{NM_PROFILE_PREFIX}{nm_profile_uuid(entry["ssid"])}.nmconnection')
+        # NetworkManager ignores keyfiles that are readable by anyone but root
+        raspiwifi_config.write_atomic(path, render_nm_profile(entry, len(networks) - index), default_mode=0o600)
+        written.append(path)
+
+    for filename in os.listdir(directory):
+        path = os.path.join(directory, filename)
+        if filename.startswith(NM_PROFILE_PREFIX) and path not in written:
+            os.remove(path)
+    return written
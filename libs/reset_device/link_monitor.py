@@ -0,0 +1,309 @@
+import asyncio
+import os
+import select
+import socket
+import struct
+import time
+import command_runner
+import metrics
+import reset_lib
+
+# rtnetlink constants (linux/rtnetlink.h, linux/if_link.h)
+RTMGRP_LINK = 0x1
+RTM_NEWLINK = 16
+RTM_DELLINK = 17
+IFLA_IFNAME = 3
+IFLA_OPERSTATE = 16
+IF_OPER_UP = 6
+IFF_LOWER_UP = 0x10000
+
+NLMSG_HEADER = struct.Struct('=LHHLL')
+IFINFO_MESSAGE = struct.Struct('=BxHiII')
+RTATTR_HEADER = struct.Struct('=HH')
+
+# Interval of the legacy polling loop. An association only counts as stable
+# once it has been reported active twice in a row, i.e. has lasted about one
+# polling interval. wpa_supplicant briefly associates for 6-8 seconds while it
+# checks a network key, so anything shorter must not reset the counter.
+POLL_INTERVAL = 10
+STABLE_LINK_SECONDS = POLL_INTERVAL
+
+LINK_UP = metrics.gauge('raspiwifi_link_up', '1 while the Wi-Fi link is associated')
+LINK_CHANGES = metrics.counter('raspiwifi_link_changes_total', 'Wi-Fi link state changes seen by the monitor')
+LINK_CHECKS = metrics.counter('raspiwifi_wifi_active_checks_total', 'is_wifi_active() results in polling mode')
+
+
+class NetlinkLinkEvents:
+    """Link up/down notifications straight from the kernel over rtnetlink"""
+
+    def __init__(self, interface='wlan0'):
+        self.interface = interface
+        self.sock = socket.socket(socket.AF_NETLINK, socket.SOCK_RAW, socket.NETLINK_ROUTE)
+        self.sock.bind((0, RTMGRP_LINK))
+
+    def fileno(self):
+        return self.sock.fileno()
+
+    def current_state(self):
+        return reset_lib.wifi_link_status(self.interface).associated
+
+    def read_states(self):
+        """Drain one datagram and return the link states reported for our interface"""
+        data = self.sock.recv(65536)
+        states = []
+        offset = 0
+
+        while offset + NLMSG_HEADER.size <= len(data):
+            msg_len, msg_type, _, _, _ = NLMSG_HEADER.unpack_from(data, offset)
+            if msg_len < NLMSG_HEADER.size:
+                break
+
+            if msg_type in (RTM_NEWLINK, RTM_DELLINK):
+                state = self._parse_link_message(data, offset + NLMSG_HEADER.size, offset + msg_len, msg_type)
+                if state is not None:
+                    states.append(state)
+
+            offset += (msg_len + 3) & ~3
+
+        return states
+
+    def _parse_link_message(self, data, start, end, msg_type):
+        _, _, _, flags, _ = IFINFO_MESSAGE.unpack_from(data, start)
+        offset = start + IFINFO_MESSAGE.size
+        name = None
+        operstate = None
+
+        while offset + RTATTR_HEADER.size <= end:
+            attr_len, attr_type = RTATTR_HEADER.unpack_from(data, offset)
+            if attr_len < RTATTR_HEADER.size:
+                break
+            payload = data[offset + RTATTR_HEADER.size:offset + attr_len]
+            if attr_type == IFLA_IFNAME:
+                name = payload.split(b'\0', 1)[0].decode('utf-8', errors='replace')
+            elif attr_type == IFLA_OPERSTATE and payload:
+                operstate = payload[0]
+            offset += (attr_len + 3) & ~3
+
+        if name != self.interface:
+            return None
+        if msg_type == RTM_DELLINK:
+            return False
+        if operstate is not None:
+            return operstate == IF_OPER_UP
+        return bool(flags & IFF_LOWER_UP)
+
+    def close(self):
+        self.sock.close()
+
+
+class IwEventLinkEvents:
+    """Association events parsed from a long-running `iw event` process"""
+
+    def __init__(self, interface='wlan0'):
+        self.interface = interface
+        self.process = command_runner.stream(['iw', 'event'])
+        self._buffer = b''
+
+    def fileno(self):
+        return self.process.stdout.fileno()
+
+    def current_state(self):
+        return reset_lib.wifi_link_status(self.interface).associated
+
+    def read_states(self):
+        chunk = os.read(self.fileno(), 4096)
+        if not chunk:
+            raise EOFError('iw event exited')
+
+        self._buffer += chunk
+        *lines, self._buffer = self._buffer.split(b'\n')
+        states = []
+
+        for raw_line in lines:
+            line = raw_line.decode('utf-8', errors='replace')
+            if not line.startswith(self.interface + ' '):
+                continue
+            if ': connected to' in line:
+                states.append(True)
+            elif ': disconnected' in line or ': deauth' in line or ': disassoc' in line:
+                states.append(False)
+
+        return states
+
+    def close(self):
+        self.process.terminate()
+        self.process.wait()
+
+
+def open_link_events(interface='wlan0'):
+    """Return the cheapest available link event source, or None if there is none"""
+    try:
+        return NetlinkLinkEvents(interface)
+    except (OSError, AttributeError):
+        pass
+
+    try:
+        return IwEventLinkEvents(interface)
+    except OSError:
+        return None
+
+
+class LinkMonitor:
+    """
+    Trigger a callback once the Wi-Fi link has not been stable for
+    auto_config_delay seconds.
+
+    In event mode the process sleeps until the kernel reports a link change
+    or one of two timers expires: the auto-config deadline (armed whenever
+    the link is not stable) and the stability timer (armed when the link
+    comes up and cancelling the deadline once the association has held).
+    """
+
+    def __init__(self, auto_config_delay, on_timeout, interface='wlan0', stable_time=STABLE_LINK_SECONDS):
+        self.auto_config_delay = auto_config_delay
+        self.on_timeout = on_timeout
+        self.interface = interface
+        self.stable_time = stable_time
+
+        self.link_up = False
+        self.deadline = None
+        self.stable_at = None
+
+    def run(self, is_wifi_active):
+        """Run in event mode, falling back to polling if no event source is available"""
+        events = open_link_events(self.interface)
+        if events is None:
+            print("RaspiWiFi: No link event source available, polling every %d seconds" % POLL_INTERVAL)
+            self.poll(is_wifi_active)
+            return
+
+        try:
+            self.run_events(events)
+        except (OSError, EOFError) as e:
+            print(f"RaspiWiFi: Link event source failed ({e}), polling every {POLL_INTERVAL} seconds")
+            events.close()
+            self.poll(is_wifi_active)
+
+    def run_events(self, events):
+        now = time.monotonic()
+        # Like the polling counter, the clock starts running at startup even
+        # if the link is already up, until the association proves stable.
+        self.deadline = now + self.auto_config_delay
+        self.link_changed(events.current_state(), now)
+
+        while True:
+            timeout = self._next_timeout(time.monotonic())
+            readable, _, _ = select.select([events], [], [], timeout)
+
+            now = time.monotonic()
+            if readable:
+                for state in events.read_states():
+                    self.link_changed(state, now)
+
+            if self.check_timers(now):
+                events.close()
+                return
+
+    async def run_async(self, events):
+        """
+        Event mode as an asyncio task: the event source is watched with
+        add_reader and the timers become wait timeouts, so the monitor shares
+        an event loop with other tasks instead of blocking a thread.
+        """
+        loop = asyncio.get_running_loop()
+        readable = asyncio.Event()
+        loop.add_reader(events.fileno(), readable.set)
+        try:
+            now = time.monotonic()
+            self.deadline = now + self.auto_config_delay
+            self.link_changed(events.current_state(), now)
+
+            while True:
+                try:
+                    await asyncio.wait_for(readable.wait(), self._next_timeout(time.monotonic()))
+                except asyncio.TimeoutError:
+                    pass
+
+                now = time.monotonic()
+                if readable.is_set():
+                    readable.clear()
+                    for state in events.read_states():
+                        self.link_changed(state, now)
+
+                if self.check_timers(now):
+                    return
+        finally:
+            loop.remove_reader(events.fileno())
+            events.close()
+
+    def link_changed(self, link_up, now):
+        if link_up == self.link_up:
+            return
+
+        self._set_link(link_up)
+        if link_up:
+            self.stable_at = now + self.stable_time
+        else:
+            self.stable_at = None
+            if self.deadline is None:
+                self.deadline = now + self.auto_config_delay
+
+    def check_timers(self, now):
+        """Apply expired timers. Returns True once the timeout callback has fired."""
+        if self.stable_at is not None and now >= self.stable_at:
+            self.stable_at = None
+            self.deadline = None
+
+        if self.deadline is not None and now >= self.deadline:
+            self.deadline = None
+            self.on_timeout()
+            return True
+
+        return False
+
+    def _set_link(self, link_up):
+        self.link_up = link_up
+        LINK_UP.set(1 if link_up else 0)
+        LINK_CHANGES.inc(state='up' if link_up else 'down')
+
+    def _next_timeout(self, now):
+        timers = [t for t in (self.deadline, self.stable_at) if t is not None]
+        if not timers:
+            return None
+        return max(0, min(timers) - now)
+
+    def poll(self, is_wifi_active):
+        """Legacy polling loop at POLL_INTERVAL second interval"""
+        no_conn_counter = 0
+        consecutive_active_reports = 0
+
+        while True:
+            time.sleep(POLL_INTERVAL)
+
+            # If iwconfig report no association with an AP add 10 to the "No
+            # Connection Couter"
+            active = is_wifi_active()
+            LINK_CHECKS.inc(active='true' if active else 'false')
+            if bool(active) != self.link_up:
+                self._set_link(bool(active))
+            if active == False:
+                no_conn_counter += POLL_INTERVAL
+                consecutive_active_reports = 0
+            # If iwconfig report association with an AP add 1 to the
+            # consecutive_active_reports counter and 10 to the no_conn_counter
+            else:
+                consecutive_active_reports += 1
+                no_conn_counter += POLL_INTERVAL
+                # Since wpa_supplicant seems to breifly associate with an AP for
+                # 6-8 seconds to check the network key the below will reset the
+                # no_conn_counter to 0 only if two 10 second checks have come up active.
+                if consecutive_active_reports >= 2:
+                    no_conn_counter = 0
+                    consecutive_active_reports = 0
+
+            # If the number of seconds not associated with an AP is greater or
+            # equal to the auto_config_delay trigger a reset into AP Host
+            # (Configuration) mode.
+            if no_conn_counter >= self.auto_config_delay:
+                self.on_timeout()
+                return
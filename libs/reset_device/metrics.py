@@ -0,0 +1,368 @@
+import atexit
+import contextlib
+import fcntl
+import glob
+import json
+import math
+import os
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import raspiwifi_config
+
+# One <job>.prom file per process; point node_exporter's textfile collector here
+METRICS_DIR = '/run/raspiwifi/metrics'
+# Survives the reboot that reset_to_host_mode() triggers
+RESET_COUNTS_FILE = '/etc/raspiwifi/reset_counts.json'
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+DEFAULT_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+EXPORT_INTERVAL = 15
+
+
+def _format_value(value):
+    if value == math.inf:
+        return '+Inf'
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _format_labels(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in labels) + '}'
+
+
+def _add_labels(line, labels):
+    """Prepend labels to one sample line; comment lines are returned unchanged"""
+    if not labels or not line or line.startswith('#'):
+        return line
+    prefix = ','.join(f'{name}="{_escape(value)}"' for name, value in labels)
+    brace = line.find('{')
+    space = line.find(' ')
+    if brace != -1 and brace < space:
+        existing = line[brace + 1:]
+        return f'{line[:brace]}{{{prefix}{"," if not existing.startswith("}") else ""}{existing}'
+    return f'{line[:space]}{{{prefix}}}{line[space:]}'
+
+
+class Metric:
+    """A metric family; values are kept per label set (keyword arguments)"""
+
+    kind = None
+
+    def __init__(self, name, documentation):
+        self.name = name
+        self.documentation = documentation
+        self._lock = threading.Lock()
+        self._values = {}
+
+    def render(self, const_labels=()):
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} {self.kind}']
+        with self._lock:
+            for labels, value in sorted(self._values.items()):
+                lines.extend(self._samples(tuple(const_labels) + labels, value))
+        return lines
+
+    def _samples(self, labels, value):
+        return [f'{self.name}{_format_labels(labels)} {_format_value(value)}']
+
+
+class Counter(Metric):
+    kind = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(Metric):
+    kind = 'gauge'
+
+    def set(self, value, **labels):
+        with self._lock:
+            self._values[tuple(sorted(labels.items()))] = value
+
+    def inc(self, amount=1, **labels):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+
+class Histogram(Metric):
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation)
+        self.buckets = tuple(sorted(buckets)) + (math.inf,)
+
+    def observe(self, value, **labels):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = {'buckets': [0] * len(self.buckets), 'sum': 0.0, 'count': 0}
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    state['buckets'][index] += 1
+                    break
+            state['sum'] += value
+            state['count'] += 1
+
+    @contextlib.contextmanager
+    def time(self, **labels):
+        """Observe how long the with block took, in seconds"""
+        started = time.monotonic()
+        try:
+            yield
+        finally:
+            self.observe(time.monotonic() - started, **labels)
+
+    def _samples(self, labels, state):
+        samples = []
+        cumulative = 0
+        for bound, count in zip(self.buckets, state['buckets']):
+            cumulative += count
+            bucket_labels = labels + (('le', _format_value(bound)),)
+            samples.append(f'{self.name}_bucket{_format_labels(bucket_labels)} {cumulative}')
+        samples.append(f'{self.name}_sum{_format_labels(labels)} {_format_value(state["sum"])}')
+        samples.append(f'{self.name}_count{_format_labels(labels)} {state["count"]}')
+        return samples
+
+
+class Registry:
+    """
+    The metrics of one process. counter(), gauge() and histogram() return
+    the existing metric for a name, so modules can declare what they record
+    at import time. Collectors are callables returning extra exposition
+    lines, computed when the registry is rendered.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._metrics = {}
+        self._collectors = []
+
+    def counter(self, name, documentation):
+        return self._get(Counter, name, documentation)
+
+    def gauge(self, name, documentation):
+        return self._get(Gauge, name, documentation)
+
+    def histogram(self, name, documentation, buckets=DEFAULT_BUCKETS):
+        return self._get(Histogram, name, documentation, buckets)
+
+    def collector(self, function):
+        with self._lock:
+            if function not in self._collectors:
+                self._collectors.append(function)
+        return function
+
+    def render(self, process=None):
+        """
+        The registry in the Prometheus text exposition format. With a
+        process name every series gets a process label, so the same metric
+        recorded by several RaspiWiFi processes stays distinct.
+        """
+        const_labels = (('process', process),) if process else ()
+        with self._lock:
+            metrics = list(self._metrics.values())
+            collectors = list(self._collectors)
+        lines = []
+        for metric in metrics:
+            lines.extend(metric.render(const_labels))
+        for collect in collectors:
+            try:
+                lines.extend(_add_labels(line, const_labels) for line in collect())
+            except Exception as e:
+                print(f"RaspiWiFi: metrics collector {collect.__name__} failed: {e}")
+        return '\n'.join(lines) + '\n' if lines else ''
+
+    def _get(self, cls, name, *args):
+        with self._lock:
+            metric = self._metrics.get(name)
+            if metric is None:
+                metric = self._metrics[name] = cls(name, *args)
+            elif not isinstance(metric, cls):
+                raise ValueError(f"metric {name} is already registered as a {metric.kind}")
+            return metric
+
+
+default_registry = Registry()
+
+
+def counter(name, documentation):
+    return default_registry.counter(name, documentation)
+
+
+def gauge(name, documentation):
+    return default_registry.gauge(name, documentation)
+
+
+def histogram(name, documentation, buckets=DEFAULT_BUCKETS):
+    return default_registry.histogram(name, documentation, buckets)
+
+
+######## RESET COUNTS ##########
+
+def count_reset(trigger, path=RESET_COUNTS_FILE):
+    """Count a reset to host mode by trigger; kept on disk because a reboot follows"""
+    try:
+        with open(path, 'a+', encoding='utf-8') as counts_file:
+            fcntl.flock(counts_file, fcntl.LOCK_EX)
+            counts_file.seek(0)
+            try:
+                counts = json.loads(counts_file.read() or '{}')
+            except ValueError:
+                counts = {}
+            counts[trigger] = counts.get(trigger, 0) + 1
+            counts_file.seek(0)
+            counts_file.truncate()
+            counts_file.write(json.dumps(counts))
+            counts_file.flush()
+            os.fsync(counts_file.fileno())
+    except OSError as e:
+        print(f"RaspiWiFi: Could not count reset: {e}")
+
+
+def reset_counts(path=RESET_COUNTS_FILE):
+    """Collector for the persisted reset counts"""
+    try:
+        with open(path, encoding='utf-8') as counts_file:
+            counts = json.load(counts_file)
+    except (OSError, ValueError):
+        counts = {}
+    name = 'raspiwifi_host_mode_resets_total'
+    lines = [f'# HELP {name} Resets to host (configuration) mode, each followed by a reboot',
+             f'# TYPE {name} counter']
+    lines.extend(f'{name}{_format_labels((("trigger", trigger),))} {count}'
+                 for trigger, count in sorted(counts.items()))
+    return lines
+
+
+######## EXPORT ##########
+
+def textfile_path(job, directory=None):
+    return os.path.join(directory or raspiwifi_config.get('metrics_dir'), job + '.prom')
+
+
+def write_textfile(job, registry=default_registry, directory=None):
+    path = textfile_path(job, directory)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    raspiwifi_config.write_atomic(path, registry.render(process=job))
+
+
+def read_textfiles(exclude=None, directory=None):
+    """Exposition text of the other RaspiWiFi processes, from their textfiles"""
+    texts = []
+    for path in sorted(glob.glob(textfile_path('*', directory))):
+        if exclude is not None and path == textfile_path(exclude, directory):
+            continue
+        try:
+            with open(path, encoding='utf-8') as prom_file:
+                texts.append(prom_file.read())
+        except OSError:
+            pass
+    return ''.join(texts)
+
+
+def merge(*texts):
+    """
+    Merge exposition texts into one, with a single HELP and TYPE per metric
+    family followed by the samples of every text. Samples belong to the
+    family of the HELP/TYPE lines before them, as render() writes them.
+    """
+    families = {}
+    family = None
+    for text in texts:
+        for line in text.splitlines():
+            if not line.strip():
+                continue
+            if line.startswith('# HELP ') or line.startswith('# TYPE '):
+                _, kind, name = line.split(' ', 3)[:3]
+                family = families.setdefault(name, {'HELP': None, 'TYPE': None, 'samples': {}})
+                family[kind] = family[kind] or line
+            elif not line.startswith('#') and family is not None:
+                family['samples'][line] = None
+    lines = []
+    for family in families.values():
+        lines.extend(line for line in (family['HELP'], family['TYPE']) if line)
+        lines.extend(family['samples'])
+    return '\n'.join(lines) + '\n' if lines else ''
+
+
+def exposition(job=None, registry=default_registry):
+    """This process's metrics merged with those of the other processes"""
+    return merge(registry.render(process=job), read_textfiles(exclude=job))
+
+
+_exporter = {'job': None}
+
+
+def exporter_job():
+    return _exporter['job']
+
+
+def start_exporter(job, port=None, interval=EXPORT_INTERVAL, registry=default_registry):
+    """
+    Write this process's metrics to <metrics_dir>/<job>.prom every interval
+    seconds (and at exit), and with a port also serve everything on this
+    device over HTTP. Only the first call in a process does anything, so the
+    unified daemon exports once for all of its tasks.
+    """
+    with default_registry._lock:
+        if _exporter['job'] is not None:
+            return False
+        _exporter['job'] = job
+
+    def export():
+        try:
+            write_textfile(job, registry)
+        except OSError as e:
+            print(f"RaspiWiFi: Could not write metrics: {e}")
+
+    def export_loop():
+        while True:
+            export()
+            time.sleep(interval)
+
+    threading.Thread(target=export_loop, name='metrics-export', daemon=True).start()
+    atexit.register(export)
+    if port:
+        serve(port, job, registry)
+    return True
+
+
+def serve(port, job=None, registry=default_registry, host='0.0.0.0'):
+    """Serve exposition() on http://host:port/metrics from a daemon thread"""
+
+    class MetricsHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split('?', 1)[0] != '/metrics':
+                self.send_error(404)
+                return
+            body = exposition(job, registry).encode('utf-8')
+            self.send_response(200)
+            self.send_header('Content-Type', CONTENT_TYPE)
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    try:
+        server = ThreadingHTTPServer((host, port), MetricsHandler)
+    except OSError as e:
+        print(f"RaspiWiFi: Could not listen for metrics on port {port}: {e}")
+        return None
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name='metrics-listener', daemon=True).start()
+    return server
@@ -0,0 +1,214 @@
+import fcntl
+import os
+import tempfile
+import threading
+
+CONFIG_PATH = '/etc/raspiwifi/raspiwifi.conf'
+
+# Values used when a key is missing from the file (older installs) or the file
+# itself is missing. Stored as the strings that appear in raspiwifi.conf.
+DEFAULTS = {
+    'ssid_prefix': 'RaspiWiFi Setup',
+    'auto_config': '0',
+    'auto_config_delay': '300',
+    'ssl_enabled': '0',
+    'server_port': '80',
+    'wpa_enabled': '0',
+    'wpa_key': '',
+    'scan_cache_ttl': '30',
+    'scan_interval': '60',
+    'monitor_mode': 'event',
+    'reset_boot_delay': '10',
+    'server_mode': 'production',
+    'server_threads': '8',
+    'server_timeout': '30',
+    'debug_routes': '0',
+    'captive_portal_dns': '1',
+    'ssl_cert_rotate_days': '365',
+    'daemon_mode': 'multi',
+    'fast_start': '1',
+    'network_backend': 'auto',
+    'metrics_dir': '/run/raspiwifi/metrics',
+    'metrics_port': '0',
+}
+
+BOOL_KEYS = {'auto_config', 'ssl_enabled', 'wpa_enabled', 'debug_routes', 'captive_portal_dns', 'fast_start'}
+INT_KEYS = {'auto_config_delay', 'server_port', 'scan_cache_ttl', 'scan_interval', 'reset_boot_delay',
+            'server_threads', 'server_timeout', 'ssl_cert_rotate_days', 'metrics_port'}
+
+
+def parse_lines(lines):
+    values = {}
+    for line in lines:
+        if '=' not in line or line.lstrip().startswith('#'):
+            continue
+        key, value = line.split('=', 1)
+        values[key.strip()] = value.rstrip()
+    return values
+
+
+def to_string(value):
+    if isinstance(value, bool):
+        return '1' if value else '0'
+    value = str(value)
+    if '\n' in value or '\r' in value:
+        raise ValueError('configuration values can not contain line breaks')
+    return value
+
+
+def write_atomic(path, content, default_mode=0o644, mode=None):
+    """
+    Replace path with content via a temporary file in the same directory and
+    a rename, keeping the file mode (default_mode for a new file), so readers
+    never see a partial file. mode forces a mode instead, e.g. 0o600 for a
+    private key.
+    """
+    directory = os.path.dirname(path) or '.'
+    fd, temp_path = tempfile.mkstemp(prefix='.' + os.path.basename(path) + '.', dir=directory)
+    try:
+        with os.fdopen(fd, 'w', encoding='utf-8') as temp_file:
+            temp_file.write(content)
+            temp_file.flush()
+            os.fsync(temp_file.fileno())
+        if mode is not None:
+            os.chmod(temp_path, mode)
+        else:
+            try:
+                os.chmod(temp_path, os.stat(path).st_mode & 0o7777)
+            except FileNotFoundError:
+                os.chmod(temp_path, default_mode)
+        os.replace(temp_path, path)
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+
+    dir_fd = os.open(directory, os.O_RDONLY)
+    try:
+        os.fsync(dir_fd)
+    finally:
+        os.close(dir_fd)
+
+
+class ConfigStore:
+    """
+    raspiwifi.conf reader/writer shared by the configuration app and the
+    reset daemons.
+
+    Parsed values are cached until a stat() shows the file changed (mtime,
+    size or inode), so repeated reads cost one stat call. Updates rewrite the
+    whole file into a temporary file and rename it over the original, so
+    readers always see either the old or the new file, never a partial one.
+    """
+
+    def __init__(self, path=CONFIG_PATH):
+        self.path = path
+        self._lock = threading.Lock()
+        self._signature = None
+        self._values = None
+
+    def load(self):
+        """Return all settings as strings, with defaults filled in for missing keys"""
+        values = dict(DEFAULTS)
+        values.update(self._file_values())
+        return values
+
+    def get(self, key, default=None):
+        """Return a single setting converted to its type (bool, int or str)"""
+        values = self.load()
+        if key not in values:
+            return default
+
+        raw = values[key]
+        if key in BOOL_KEYS:
+            return raw.strip() == '1'
+        if key in INT_KEYS:
+            try:
+                return int(raw)
+            except ValueError:
+                print(f"Warning: invalid value for {key} in {self.path}: {raw!r}, using default")
+                return int(DEFAULTS[key]) if key in DEFAULTS else default
+        return raw
+
+    def update(self, **changes):
+        """Set the given keys, keeping the order and any other lines of the file"""
+        changes = {key: to_string(value) for key, value in changes.items()}
+
+        with self._lock, self._file_lock():
+            try:
+                with open(self.path, encoding='utf-8') as config_file:
+                    lines = config_file.read().splitlines()
+            except FileNotFoundError:
+                lines = []
+
+            remaining = dict(changes)
+            new_lines = []
+            for line in lines:
+                key = line.split('=', 1)[0].strip() if '=' in line else None
+                if key in remaining:
+                    new_lines.append(key + '=' + remaining.pop(key))
+                else:
+                    new_lines.append(line)
+            for key, value in remaining.items():
+                new_lines.append(key + '=' + value)
+
+            write_atomic(self.path, '\n'.join(new_lines) + '\n')
+            self._signature = None
+
+    def _file_values(self):
+        try:
+            stat = os.stat(self.path)
+        except OSError:
+            return {}
+
+        signature = (stat.st_mtime_ns, stat.st_size, stat.st_ino)
+        with self._lock:
+            if signature == self._signature:
+                return self._values
+
+        try:
+            with open(self.path, encoding='utf-8', errors='replace') as config_file:
+                values = parse_lines(config_file)
+        except OSError as e:
+            print(f"Warning: Could not read config file: {e}")
+            return {}
+
+        with self._lock:
+            self._signature = signature
+            self._values = values
+        return values
+
+    def _file_lock(self):
+        # Serialises writers across processes (app, reset daemons, setup)
+        return _FileLock(self.path + '.lock')
+
+
+class _FileLock:
+    def __init__(self, path):
+        self.path = path
+        self.fd = None
+
+    def __enter__(self):
+        self.fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o600)
+        fcntl.flock(self.fd, fcntl.LOCK_EX)
+        return self
+
+    def __exit__(self, *exc_info):
+        fcntl.flock(self.fd, fcntl.LOCK_UN)
+        os.close(self.fd)
+        self.fd = None
+
+
+default_store = ConfigStore()
+
+
+def load():
+    return default_store.load()
+
+
+def get(key, default=None):
+    return default_store.get(key, default)
+
+
+def update(**changes):
+    default_store.update(**changes)
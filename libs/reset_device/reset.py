@@ -1,59 +1,56 @@
-import RPi.GPIO as GPIO
-import os
 import time
-import subprocess
 import reset_lib
-
-# Add boot delay to prevent immediate reboot loops
-print("RaspiWiFi: Waiting 10 seconds before checking configuration...")
-time.sleep(10)
-
-GPIO.setmode(GPIO.BCM)
-GPIO.setup(18, GPIO.IN, pull_up_down=GPIO.PUD_DOWN)
-
-counter = 0
-serial_last_four = subprocess.check_output(['cat', '/proc/cpuinfo'])[-5:-1].decode('utf-8')
-config_hash = reset_lib.config_file_hash()
-ssid_prefix = config_hash['ssid_prefix'] + " "
-reboot_required = False
-
-
-# Check if configuration is in progress and skip reboot if so
-if os.path.exists('/tmp/raspiwifi_configuring'):
-    print("Configuration in progress, skipping automatic reboot")
-    reboot_required = False
-elif os.path.exists('/tmp/raspiwifi_recent_boot'):
-    print("Recent boot detected, skipping reboot to prevent loops")
-    reboot_required = False
-else:
-    # Create flag to prevent reboot loops
-    os.system('touch /tmp/raspiwifi_recent_boot')
-    # Remove the flag after 60 seconds
-    os.system('(sleep 60; rm -f /tmp/raspiwifi_recent_boot) &')
-    
-    reboot_required = reset_lib.wpa_check_activate(config_hash['wpa_enabled'], config_hash['wpa_key'])
-    if not reboot_required:
-        reboot_required = reset_lib.update_ssid(ssid_prefix, serial_last_four)
-
-if reboot_required == True:
-    print("RaspiWiFi: Configuration change detected, rebooting in 5 seconds...")
-    time.sleep(5)
-    os.system('reboot')
-
-# This is the main logic loop waiting for a button to be pressed on GPIO 18 for 10 seconds.
-# If that happens the device will reset to its AP Host mode allowing for reconfiguration on a new network.
-while True:
-    while GPIO.input(18) == 1:
-        time.sleep(1)
-        counter = counter + 1
-
-        print(counter)
-
-        if counter == 9:
-            reset_lib.reset_to_host_mode()
-
-        if GPIO.input(18) == 0:
-            counter = 0
-            break
-
-    time.sleep(1)
+import hostapd_config
+import raspiwifi_config
+import reset_button
+import boot_timeline
+import metrics
+
+BOOT_CONFIGURATION_SECONDS = metrics.gauge('raspiwifi_boot_configuration_seconds',
+                                           'Time taken to bring hostapd.conf up to date at startup')
+HOSTAPD_CHANGES = metrics.counter('raspiwifi_hostapd_config_changes_total',
+                                  'hostapd.conf settings changed by the reset daemon, by key')
+RESET_ARMED = metrics.gauge('raspiwifi_reset_button_armed', '1 while the reset button is being watched')
+
+# This daemon runs in both modes, so it exports the counts that outlive the reboot
+metrics.default_registry.collector(metrics.reset_counts)
+
+
+def apply_boot_configuration():
+    """
+    Apply SSID / WPA changes from raspiwifi.conf to hostapd.conf. A running
+    hostapd reloads the file, so no reboot is needed.
+    """
+    started = time.monotonic()
+    for key in hostapd_config.apply_from_config():
+        HOSTAPD_CHANGES.inc(key=key)
+    BOOT_CONFIGURATION_SECONDS.set(round(time.monotonic() - started, 3))
+
+
+def watch_button():
+    """
+    Wait for a button to be held on GPIO 18 for 10 seconds. If that happens the
+    device will reset to its AP Host mode allowing for reconfiguration on a new network.
+    The process sleeps until the pin changes level instead of polling it.
+    """
+    backend = reset_button.open_backend(reset_button.RESET_PIN)
+    if backend is not None:
+        watcher = reset_button.ButtonWatcher(backend, lambda: reset_lib.reset_to_host_mode('button'))
+        boot_timeline.mark('reset_armed')
+        RESET_ARMED.set(1)
+        watcher.run()
+
+
+if __name__ == '__main__':
+    boot_timeline.mark('reset_started')
+    # In client mode there is no portal; metrics_port serves the whole device's metrics
+    metrics.start_exporter('reset', port=raspiwifi_config.get('metrics_port'))
+
+    # Add boot delay to prevent immediate reboot loops
+    boot_delay = raspiwifi_config.get('reset_boot_delay')
+    print(f"RaspiWiFi: Waiting {boot_delay} seconds before checking configuration...")
+    time.sleep(boot_delay)
+    boot_timeline.mark('reset_boot_delay_done')
+
+    apply_boot_configuration()
+    watch_button()
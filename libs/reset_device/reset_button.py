@@ -0,0 +1,154 @@
+import sys
+import threading
+import time
+
+RESET_PIN = 18
+HOLD_SECONDS = 10
+DEBOUNCE_SECONDS = 0.05
+
+
+class RPiGPIOBackend:
+    """Reset button on a real Raspberry Pi GPIO pin (pulled down, HIGH when pressed)"""
+
+    def __init__(self, pin=RESET_PIN, debounce=DEBOUNCE_SECONDS):
+        import RPi.GPIO as GPIO
+
+        self.GPIO = GPIO
+        self.pin = pin
+        self.bouncetime = max(1, int(debounce * 1000))
+
+        GPIO.setmode(GPIO.BCM)
+        GPIO.setup(pin, GPIO.IN, pull_up_down=GPIO.PUD_DOWN)
+
+    def read(self):
+        return self.GPIO.input(self.pin)
+
+    def wait_for_edge(self, timeout=None):
+        """Block until the pin changes level. Returns False if timeout (seconds) expired first."""
+        if timeout is None:
+            channel = self.GPIO.wait_for_edge(self.pin, self.GPIO.BOTH, bouncetime=self.bouncetime)
+        else:
+            timeout_ms = max(1, int(timeout * 1000))
+            channel = self.GPIO.wait_for_edge(self.pin, self.GPIO.BOTH, bouncetime=self.bouncetime, timeout=timeout_ms)
+        return channel is not None
+
+    def close(self):
+        self.GPIO.cleanup(self.pin)
+
+
+class FakeGPIOBackend:
+    """
+    Simulated reset button for running the hold/reset logic without GPIO
+    hardware. Drive it from another thread with press() and release().
+    """
+
+    def __init__(self, pin=RESET_PIN, level=0):
+        self.pin = pin
+        self.level = level
+        self._edges = 0
+        self._condition = threading.Condition()
+
+    def set_level(self, level):
+        with self._condition:
+            if level != self.level:
+                self.level = level
+                self._edges += 1
+                self._condition.notify_all()
+
+    def press(self):
+        self.set_level(1)
+
+    def release(self):
+        self.set_level(0)
+
+    def read(self):
+        with self._condition:
+            return self.level
+
+    def wait_for_edge(self, timeout=None):
+        with self._condition:
+            edges = self._edges
+            return self._condition.wait_for(lambda: self._edges != edges, timeout)
+
+    def close(self):
+        pass
+
+
+def open_backend(pin=RESET_PIN):
+    """Return the RPi.GPIO backend, or None if RPi.GPIO is not available"""
+    try:
+        return RPiGPIOBackend(pin)
+    except (ImportError, RuntimeError) as e:
+        print(f"RaspiWiFi: GPIO unavailable ({e})")
+        return None
+
+
+class ButtonWatcher:
+    """
+    Call on_hold once the reset button has been held for hold_time seconds.
+
+    Sleeps in wait_for_edge() while the button is idle. A press only counts
+    once the level is still HIGH after the debounce period, and the hold is
+    timed with the monotonic clock, so it is not affected by poll granularity
+    or wall-clock changes.
+    """
+
+    def __init__(self, backend, on_hold, hold_time=HOLD_SECONDS, debounce=DEBOUNCE_SECONDS, idle_timeout=None):
+        self.backend = backend
+        self.on_hold = on_hold
+        self.hold_time = hold_time
+        self.debounce = debounce
+        # None sleeps until the next edge; set it only if stop() must be
+        # honoured while the button is idle
+        self.idle_timeout = idle_timeout
+        self._stop = threading.Event()
+
+    def stop(self):
+        self._stop.set()
+
+    def run(self):
+        while not self._stop.is_set():
+            if self.backend.read() != 1:
+                self.backend.wait_for_edge(timeout=self.idle_timeout)
+                continue
+
+            if self.wait_for_hold():
+                self.on_hold()
+                return
+
+    def wait_for_hold(self):
+        """Time one press. Returns True if it was held for the full hold_time."""
+        pressed_at = time.monotonic()
+
+        # Ignore contact bounce and short glitches
+        if self.backend.wait_for_edge(timeout=self.debounce) or self.backend.read() != 1:
+            return False
+
+        while True:
+            remaining = self.hold_time - (time.monotonic() - pressed_at)
+            if remaining <= 0:
+                return self.backend.read() == 1
+
+            if self.backend.wait_for_edge(timeout=remaining) and self.backend.read() != 1:
+                return False
+
+
+if __name__ == '__main__':
+    # Time the hold logic on any Linux box: python3 reset_button.py [hold_seconds]
+    hold_time = float(sys.argv[1]) if len(sys.argv) > 1 else 2.0
+    backend = FakeGPIOBackend()
+    fired = threading.Event()
+    watcher = ButtonWatcher(backend, fired.set, hold_time=hold_time)
+    thread = threading.Thread(target=watcher.run, daemon=True)
+    thread.start()
+
+    # A press released too early must not trigger a reset
+    backend.press()
+    time.sleep(hold_time / 2)
+    backend.release()
+    print(f"short press triggered reset: {fired.wait(hold_time)}")
+
+    pressed_at = time.monotonic()
+    backend.press()
+    fired.wait()
+    print(f"long press triggered reset after {time.monotonic() - pressed_at:.3f} s (hold_time {hold_time} s)")
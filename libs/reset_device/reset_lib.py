@@ -1,108 +1,219 @@
 import os
-import fileinput
-import subprocess
+import re
+import glob
+import fcntl
+import shutil
+import socket
+import struct
+import collections
+import command_runner
+import metrics
+import raspiwifi_config
+
+RESET_DEVICE_DIR = '/usr/lib/raspiwifi/reset_device'
+STATIC_FILES = os.path.join(RESET_DEVICE_DIR, 'static_files')
+CRON_DIR = '/etc/cron.raspiwifi'
 
 def config_file_hash():
-	config_file = open('/etc/raspiwifi/raspiwifi.conf')
-	config_hash = {}
+	return raspiwifi_config.load()
 
-	for line in config_file:
-		line_key = line.split("=")[0]
-		line_value = line.split("=")[1].rstrip()
-		config_hash[line_key] = line_value
+# Snapshot of the Wi-Fi link. signal is in dBm and link_quality is the
+# driver's link quality value; either may be None if it is not reported.
+WifiLinkStatus = collections.namedtuple('WifiLinkStatus', ['associated', 'signal', 'link_quality', 'operstate', 'carrier', 'source'])
 
-	return config_hash
+def read_proc_wireless(interface='wlan0'):
+	"""Return (link_quality, signal) from /proc/net/wireless, or None if the interface is not listed"""
+	try:
+		with open('/proc/net/wireless') as wireless_file:
+			# Two header lines, then "wlan0: 0000   70.  -40.  -256  ..."
+			for line in wireless_file.readlines()[2:]:
+				name, _, counters = line.partition(':')
+				if name.strip() != interface:
+					continue
+				fields = counters.split()
+				link_quality = int(float(fields[1]))
+				signal = int(float(fields[2]))
+				return (link_quality, signal)
+	except (OSError, IndexError, ValueError):
+		pass
 
-def wpa_check_activate(wpa_enabled, wpa_key):
-	wpa_active = False
-	reboot_required = False
-	current_wpa_key = None
+	return None
 
-	# Check current hostapd configuration
+def read_sysfs_value(interface, name):
+	try:
+		with open('/sys/class/net/' + interface + '/' + name) as sysfs_file:
+			return sysfs_file.read().strip()
+	except OSError:
+		# carrier can not be read while the interface is administratively down
+		return None
+
+def wifi_link_status(interface='wlan0'):
+	"""
+	Read the link state straight from the kernel (/sys/class/net and
+	/proc/net/wireless) without forking. Falls back to parsing iwconfig only
+	if the interface is missing from sysfs.
+	"""
+	operstate = read_sysfs_value(interface, 'operstate')
+
+	if operstate is None:
+		return iwconfig_link_status(interface)
+
+	carrier = read_sysfs_value(interface, 'carrier') == '1'
+	link_quality = signal = None
+
+	wireless = read_proc_wireless(interface)
+	if wireless is not None:
+		link_quality, signal = wireless
+
+	# A station interface only reports carrier once it is associated with an AP
+	associated = operstate == 'up' or (carrier and operstate != 'dormant')
+	if not associated:
+		link_quality = signal = None
+
+	return WifiLinkStatus(associated, signal, link_quality, operstate, carrier, 'sysfs')
+
+def unescape_ssid(text):
+	"""Decode an SSID as iw and wpa_cli print it (\\xNN, \\", \\\\, \\e, \\n, \\r, \\t escapes)"""
+	escapes = {'"': b'"', '\\': b'\\', 'e': b'\x1b', 'n': b'\n', 'r': b'\r', 't': b'\t'}
+	data = bytearray()
+	index = 0
+	while index < len(text):
+		char = text[index]
+		if char == '\\' and text[index + 1:index + 2] == 'x' and len(text) >= index + 4:
+			try:
+				data.append(int(text[index + 2:index + 4], 16))
+				index += 4
+				continue
+			except ValueError:
+				pass
+		if char == '\\' and text[index + 1:index + 2] in escapes:
+			data += escapes[text[index + 1]]
+			index += 2
+			continue
+		data += char.encode('utf-8')
+		index += 1
+	return data.decode('utf-8', errors='replace')
+
+def associated_ssid(interface='wlan0'):
+	"""SSID of the network the interface is associated with, or None"""
+	for line in command_runner.output(['iw', 'dev', interface, 'link']).splitlines():
+		line = line.strip()
+		if line.startswith('SSID: '):
+			return unescape_ssid(line[len('SSID: '):])
+	# No iw, or a driver that only talks wext
+	for line in command_runner.output(['wpa_cli', '-i', interface, 'status']).splitlines():
+		if line.startswith('ssid='):
+			return unescape_ssid(line[len('ssid='):])
+	return None
+
+def interface_ipv4_address(interface='wlan0'):
+	"""Return the interface's IPv4 address, or None if it has none (no fork)"""
+	sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+	try:
+		request = struct.pack('256s', interface.encode('utf-8')[:15])
+		# SIOCGIFADDR
+		response = fcntl.ioctl(sock.fileno(), 0x8915, request)
+		return socket.inet_ntoa(response[20:24])
+	except OSError:
+		return None
+	finally:
+		sock.close()
+
+def iwconfig_link_status(interface='wlan0'):
+	result = command_runner.run(['iwconfig', interface])
+	if not result.ok:
+		return WifiLinkStatus(False, None, None, None, None, 'unavailable')
+	iwconfig_out = result.stdout
+
+	associated = "Access Point: Not-Associated" not in iwconfig_out
+	link_quality = signal = None
+
+	quality_match = re.search(r'Link Quality[=:](\d+)', iwconfig_out)
+	if quality_match:
+		link_quality = int(quality_match.group(1))
+	signal_match = re.search(r'Signal level[=:](-?\d+)', iwconfig_out)
+	if signal_match:
+		signal = int(signal_match.group(1))
+
+	return WifiLinkStatus(associated, signal, link_quality, None, None, 'iwconfig')
+
+def is_wifi_active(interface='wlan0'):
+	return wifi_link_status(interface).associated
+
+def write_dnsmasq_conf(template='/usr/lib/raspiwifi/reset_device/static_files/dnsmasq.conf', dnsmasq_conf='/etc/dnsmasq.conf'):
+	"""
+	Generate /etc/dnsmasq.conf from the static template. With
+	captive_portal_dns=1 every name resolves to the Pi, so client OS
+	connectivity probes reach the portal and open its sign-in sheet.
+	"""
+	with open(template) as template_file:
+		content = template_file.read().rstrip('\n') + '\n'
+
+	if raspiwifi_config.get('captive_portal_dns'):
+		content += '\n# Captive portal: resolve every name to the portal\naddress=/#/10.0.0.1\n'
+
+	with open(dnsmasq_conf, 'w') as dnsmasq_file:
+		dnsmasq_file.write(content)
+
+######## FILE OPERATIONS ##########
+
+def remove_files(*patterns):
+	"""rm -f: remove every file matching the glob patterns, ignoring missing ones"""
+	for pattern in patterns:
+		for path in glob.glob(pattern):
+			try:
+				os.remove(path)
+			except OSError:
+				pass
+
+def move_file(source, destination):
+	"""mv: replaces an existing destination and ignores a missing source. Returns True if the file was moved."""
+	if os.path.isdir(destination):
+		destination = os.path.join(destination, os.path.basename(source))
 	try:
-		with open('/etc/hostapd/hostapd.conf') as hostapd_conf:
-			for line in hostapd_conf:
-				if 'wpa_passphrase=' in line:
-					wpa_active = True
-					current_wpa_key = line.strip().split('=', 1)[1]
-					break
-	except:
+		os.replace(source, destination)
+		return True
+	except FileNotFoundError:
+		return False
+	except OSError:
 		pass
-
-	# Only make changes if configuration has actually changed
-	if wpa_enabled == '1' and wpa_active == False:
-		# Need to enable WPA but it's currently disabled
-		reboot_required = True
-		os.system('cp /usr/lib/raspiwifi/reset_device/static_files/hostapd.conf.wpa /etc/hostapd/hostapd.conf')
-		# Update with the correct key
-		with fileinput.FileInput('/etc/hostapd/hostapd.conf', inplace=True) as hostapd_conf:
-			for line in hostapd_conf:
-				if 'wpa_passphrase=' in line:
-					print('wpa_passphrase=' + wpa_key)
-				else:
-					print(line, end = '')
-	
-	elif wpa_enabled == '1' and wpa_active == True and current_wpa_key != wpa_key:
-		# WPA is enabled but key has changed
-		reboot_required = True
-		with fileinput.FileInput('/etc/hostapd/hostapd.conf', inplace=True) as hostapd_conf:
-			for line in hostapd_conf:
-				if 'wpa_passphrase=' in line:
-					print('wpa_passphrase=' + wpa_key)
-				else:
-					print(line, end = '')
-
-	elif wpa_enabled == '0' and wpa_active == True:
-		# Need to disable WPA but it's currently enabled
-		reboot_required = True
-		os.system('cp /usr/lib/raspiwifi/reset_device/static_files/hostapd.conf.nowpa /etc/hostapd/hostapd.conf')
-
-	return reboot_required
-
-def update_ssid(ssid_prefix, serial_last_four):
-	reboot_required = False
-	ssid_correct = False
-
-	with open('/etc/hostapd/hostapd.conf') as hostapd_conf:
-		for line in hostapd_conf:
-			if ssid_prefix in line:
-				ssid_correct = True
-
-	if ssid_correct == False:
-		with fileinput.FileInput("/etc/hostapd/hostapd.conf", inplace=True) as file:
-			for line in file:
-				if 'ssid=' in line:
-					line_array = line.split('=')
-					line_array[1] = ssid_prefix + ' ' + serial_last_four
-					print(line_array[0] + '=' + line_array[1])
-				else:
-					print(line, end = '')
-
-		reboot_required = True
-			
-	return reboot_required
-
-def is_wifi_active():
-	iwconfig_out = subprocess.check_output(['iwconfig']).decode('utf-8')
-	wifi_active = True
-
-	if "Access Point: Not-Associated" in iwconfig_out:
-		wifi_active = False
-
-	return wifi_active
-
-def reset_to_host_mode():
-	if not os.path.isfile('/etc/raspiwifi/host_mode'):
-		os.system('aplay /usr/lib/raspiwifi/reset_device/button_chime.wav')
-		os.system('rm -f /etc/wpa_supplicant/wpa_supplicant.conf')
-		os.system('rm -f /home/pi/Projects/RaspiWifi/tmp/*')
-		os.system('rm /etc/cron.raspiwifi/apclient_bootstrapper')
-		os.system('cp /usr/lib/raspiwifi/reset_device/static_files/aphost_bootstrapper /etc/cron.raspiwifi/')
-		os.system('chmod +x /etc/cron.raspiwifi/aphost_bootstrapper')
-		os.system('mv /etc/dhcpcd.conf /etc/dhcpcd.conf.original')
-		os.system('cp /usr/lib/raspiwifi/reset_device/static_files/dhcpcd.conf /etc/')
-		os.system('mv /etc/dnsmasq.conf /etc/dnsmasq.conf.original')
-		os.system('cp /usr/lib/raspiwifi/reset_device/static_files/dnsmasq.conf /etc/')
-		os.system('cp /usr/lib/raspiwifi/reset_device/static_files/dhcpcd.conf /etc/')
-		os.system('touch /etc/raspiwifi/host_mode')
-	os.system('reboot')
+	# Another file system: copy over the destination, then remove the source
+	try:
+		shutil.copy2(source, destination)
+		os.remove(source)
+		return True
+	except OSError as e:
+		print(f"RaspiWiFi: Could not move {source} to {destination}: {e}")
+		return False
+
+def copy_file(source, destination):
+	"""cp that reports instead of raising. Returns True if the file was copied."""
+	try:
+		shutil.copy(source, destination)
+		return True
+	except OSError as e:
+		print(f"RaspiWiFi: Could not copy {source} to {destination}: {e}")
+		return False
+
+def install_bootstrapper(name, cron_dir=CRON_DIR):
+	"""Copy a bootstrapper from static_files into /etc/cron.raspiwifi and make it executable"""
+	path = os.path.join(cron_dir, name)
+	if copy_file(os.path.join(STATIC_FILES, name), path):
+		os.chmod(path, 0o755)
+
+def reset_to_host_mode(trigger='manual'):
+	metrics.count_reset(trigger)
+	try:
+		if not os.path.isfile('/etc/raspiwifi/host_mode'):
+			command_runner.run(['aplay', os.path.join(RESET_DEVICE_DIR, 'button_chime.wav')])
+			remove_files('/etc/wpa_supplicant/wpa_supplicant.conf', '/home/pi/Projects/RaspiWifi/tmp/*',
+			             os.path.join(CRON_DIR, 'apclient_bootstrapper'))
+			install_bootstrapper('aphost_bootstrapper')
+			move_file('/etc/dhcpcd.conf', '/etc/dhcpcd.conf.original')
+			copy_file(os.path.join(STATIC_FILES, 'dhcpcd.conf'), '/etc/dhcpcd.conf')
+			move_file('/etc/dnsmasq.conf', '/etc/dnsmasq.conf.original')
+			write_dnsmasq_conf()
+			open('/etc/raspiwifi/host_mode', 'a').close()
+	finally:
+		# Like before, the reboot happens even if a step above failed
+		command_runner.run(['reboot'])
@@ -0,0 +1,110 @@
+import time
+
+import command_runner
+
+# Unit file states in which `systemctl enable` / `disable` actually change something
+ENABLEABLE_STATES = ('disabled', 'masked')
+DISABLEABLE_STATES = ('enabled', 'enabled-runtime')
+
+
+def want(enabled=None, active=None, restart=False):
+    """
+    Desired end state of one service. None means "leave as it is".
+    restart=True restarts the service even if it is already running.
+    """
+    return {'enabled': enabled, 'active': active, 'restart': restart}
+
+
+def query_states(services):
+    """Return {service: {'load', 'active', 'unit_file'}} from a single `systemctl show` call"""
+    units = [_unit(name) for name in services]
+    result = command_runner.run(['systemctl', 'show', '-p', 'Id,LoadState,ActiveState,UnitFileState'] + units)
+
+    by_unit = {}
+    current = {}
+    for line in result.stdout.splitlines() + ['']:
+        if not line.strip():
+            if 'Id' in current:
+                by_unit[current['Id']] = current
+            current = {}
+            continue
+        key, _, value = line.partition('=')
+        current[key] = value
+
+    states = {}
+    for name in services:
+        properties = by_unit.get(_unit(name), {})
+        states[name] = {
+            'load': properties.get('LoadState', 'not-found'),
+            'active': properties.get('ActiveState', 'inactive'),
+            'unit_file': properties.get('UnitFileState', ''),
+        }
+    return states
+
+
+def plan(desired, states):
+    """Compute the systemctl operations needed to move from states to desired"""
+    operations = {'unmask': [], 'enable': [], 'disable': [], 'stop': [], 'start': [], 'restart': []}
+
+    for name, spec in desired.items():
+        state = states[name]
+        if state['load'] == 'not-found':
+            continue
+
+        running = state['active'] in ('active', 'activating', 'reloading')
+        needs_unit = spec['enabled'] or spec['active'] or spec['restart']
+
+        if needs_unit and state['unit_file'] == 'masked':
+            operations['unmask'].append(name)
+
+        if spec['enabled'] is True and state['unit_file'] in ENABLEABLE_STATES:
+            operations['enable'].append(name)
+        elif spec['enabled'] is False and state['unit_file'] in DISABLEABLE_STATES:
+            operations['disable'].append(name)
+
+        if spec['active'] is False:
+            if running:
+                operations['stop'].append(name)
+        elif spec['restart']:
+            operations['restart'].append(name)
+        elif spec['active'] is True and not running:
+            operations['start'].append(name)
+
+    return [(action, names) for action, names in operations.items() if names]
+
+
+def apply(desired, log=print):
+    """
+    Bring services to the desired end state with as few systemctl calls as
+    possible: one query for all current states, then at most one call per
+    action (unmask, enable, disable, stop, start, restart) covering every
+    service that needs it. Services already in the desired state are not
+    touched.
+
+    desired -- {service_name: want(...)}
+    Returns a report of each step: action, services, seconds, returncode.
+    """
+    report = []
+
+    started = time.monotonic()
+    states = query_states(list(desired))
+    report.append({'action': 'query', 'services': list(desired),
+                   'seconds': round(time.monotonic() - started, 3), 'returncode': 0})
+
+    for action, names in plan(desired, states):
+        started = time.monotonic()
+        result = command_runner.run(['systemctl', action] + names)
+        seconds = time.monotonic() - started
+        report.append({'action': action, 'services': names,
+                       'seconds': round(seconds, 3), 'returncode': result.returncode})
+
+        if result.returncode != 0:
+            log(f"Warning: systemctl {action} {' '.join(names)} failed: {result.stderr.strip()}")
+        else:
+            log(f"systemctl {action} {' '.join(names)} ({seconds:.2f}s)")
+
+    return report
+
+
+def _unit(name):
+    return name if '.' in name else name + '.service'
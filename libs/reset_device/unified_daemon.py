@@ -0,0 +1,214 @@
+import asyncio
+import importlib
+import os
+import subprocess
+import sys
+
+import boot_timeline
+import connection_monitor
+import link_monitor
+import metrics
+import raspiwifi_config
+import reset
+import reset_lib
+
+RESET_DEVICE_DIR = os.path.dirname(os.path.realpath(__file__))
+CONFIGURATION_APP_DIR = os.path.realpath(os.path.join(RESET_DEVICE_DIR, '..', 'configuration_app'))
+
+# Scripts that make up the multi-process layout, and the unified daemon itself
+RASPIWIFI_SCRIPTS = ('unified_daemon.py', 'reset.py', 'app.py', 'fast_start.py', 'connection_monitor.py')
+
+# Modules each layout imports, one list per interpreter
+LAYOUTS = {
+    'ap': {
+        'multi': [['reset'], ['app']],
+        'unified': [['unified_daemon', 'app']],
+    },
+    'client': {
+        'multi': [['reset'], ['connection_monitor']],
+        'unified': [['unified_daemon']],
+    },
+}
+
+
+class UnifiedDaemon:
+    """
+    One interpreter running what the multi-process layout runs as separate
+    processes: the reset daemon (boot configuration check and GPIO button
+    watcher) plus either the web portal (AP mode) or the connection monitor
+    (client mode). They share one raspiwifi_config store, one scan cache and
+    one view of the link.
+
+    Everything is a task on a single asyncio loop. The link monitor is fully
+    non-blocking (add_reader on the netlink socket); the pieces that can only
+    block -- RPi.GPIO's wait_for_edge and the WSGI server -- run on worker
+    threads owned by the loop.
+    """
+
+    def __init__(self, mode):
+        self.mode = mode
+        self.monitor = None
+        self.app_module = None
+        self.task_states = {}
+
+    async def run(self):
+        # One textfile (and listener) for all tasks; the portal's own exporter call is a no-op
+        metrics.start_exporter('unified', port=raspiwifi_config.get('metrics_port'))
+        tasks = [self._supervise('reset', self.reset_task())]
+        if self.mode == 'ap':
+            tasks.append(self._supervise('portal', self.portal_task()))
+        else:
+            tasks.append(self._supervise('link_monitor', self.link_task()))
+        await asyncio.gather(*tasks)
+
+    async def reset_task(self):
+        boot_timeline.mark('reset_started')
+
+        # Add boot delay to prevent immediate reboot loops
+        boot_delay = raspiwifi_config.get('reset_boot_delay')
+        print(f"RaspiWiFi: Waiting {boot_delay} seconds before checking configuration...")
+        await asyncio.sleep(boot_delay)
+        boot_timeline.mark('reset_boot_delay_done')
+
+        await asyncio.to_thread(reset.apply_boot_configuration)
+        await asyncio.to_thread(reset.watch_button)
+
+    async def portal_task(self):
+        if CONFIGURATION_APP_DIR not in sys.path:
+            sys.path.insert(0, CONFIGURATION_APP_DIR)
+        # Importing Flask and the app takes a while; keep it off the loop
+        self.app_module = await asyncio.to_thread(importlib.import_module, 'app')
+        await asyncio.to_thread(self.app_module.serve)
+
+    async def link_task(self):
+        self.monitor = connection_monitor.make_monitor()
+        if self.monitor is None:
+            return
+
+        if raspiwifi_config.get('monitor_mode') != 'poll':
+            events = link_monitor.open_link_events(self.monitor.interface)
+            if events is not None:
+                try:
+                    await self.monitor.run_async(events)
+                    return
+                except (OSError, EOFError) as e:
+                    print(f"RaspiWiFi: Link event source failed ({e}), polling instead")
+            else:
+                print("RaspiWiFi: No link event source available, polling instead")
+
+        await asyncio.to_thread(self.monitor.poll, lambda: reset_lib.is_wifi_active(self.monitor.interface))
+
+    async def _supervise(self, name, coroutine):
+        # A failing task is logged but does not take the others down
+        self.task_states[name] = 'running'
+        try:
+            await coroutine
+            self.task_states[name] = 'finished'
+        except Exception as e:
+            self.task_states[name] = f'failed: {e}'
+            print(f"RaspiWiFi: {name} task failed: {e}")
+
+
+######## RESOURCE REPORT ##########
+
+CLOCK_TICKS = os.sysconf('SC_CLK_TCK')
+
+
+def process_usage(pid):
+    """Return {'rss_kb', 'cpu_seconds', 'age_seconds'} for a process from /proc"""
+    rss_kb = 0
+    with open(f'/proc/{pid}/status') as status_file:
+        for line in status_file:
+            if line.startswith('VmRSS:'):
+                rss_kb = int(line.split()[1])
+                break
+
+    with open(f'/proc/{pid}/stat') as stat_file:
+        # The command name may contain spaces; fields after it are fixed
+        fields = stat_file.read().rsplit(')', 1)[1].split()
+    cpu_seconds = (int(fields[11]) + int(fields[12])) / CLOCK_TICKS
+    age_seconds = boot_timeline.now() - int(fields[19]) / CLOCK_TICKS
+
+    return {'rss_kb': rss_kb, 'cpu_seconds': cpu_seconds, 'age_seconds': age_seconds}
+
+
+def raspiwifi_processes():
+    """Yield (pid, script) for every running RaspiWiFi Python process"""
+    for entry in os.listdir('/proc'):
+        if not entry.isdigit() or int(entry) == os.getpid():
+            continue
+        try:
+            with open(f'/proc/{entry}/cmdline', 'rb') as cmdline_file:
+                arguments = cmdline_file.read().decode('utf-8', errors='replace').split('\0')
+        except OSError:
+            continue
+        if not arguments or 'python' not in os.path.basename(arguments[0]):
+            continue
+        for argument in arguments[1:]:
+            if os.path.basename(argument) in RASPIWIFI_SCRIPTS:
+                yield int(entry), os.path.basename(argument)
+                break
+
+
+def report():
+    """Print RSS and CPU use of the running RaspiWiFi processes"""
+    rows = []
+    for pid, script in raspiwifi_processes():
+        try:
+            rows.append((pid, script, process_usage(pid)))
+        except OSError:
+            continue
+
+    if not rows:
+        print("No RaspiWiFi processes running")
+        return
+
+    layout = 'unified' if any(script == 'unified_daemon.py' for _, script, _ in rows) else 'multi-process'
+    print(f"RaspiWiFi processes ({layout} layout):")
+    for pid, script, usage in rows:
+        cpu_percent = 100 * usage['cpu_seconds'] / max(usage['age_seconds'], 1e-6)
+        print(f"  {pid:>7} {script:<24} {usage['rss_kb'] / 1024:>7.1f} MB RSS "
+              f"{usage['cpu_seconds']:>8.2f}s CPU ({cpu_percent:.2f}% since start)")
+    print(f"  {'total':>7} {'':<24} {sum(usage['rss_kb'] for _, _, usage in rows) / 1024:>7.1f} MB RSS "
+          f"{sum(usage['cpu_seconds'] for _, _, usage in rows):>8.2f}s CPU")
+
+
+def measure_interpreter(modules):
+    """Start an interpreter that imports modules and idles; return its usage once the imports are done"""
+    code = (f"import sys; sys.path[:0] = {[RESET_DEVICE_DIR, CONFIGURATION_APP_DIR]!r}; "
+            f"import {', '.join(modules)}; print('ready', flush=True); sys.stdin.read()")
+    process = subprocess.Popen([sys.executable, '-c', code], stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+                               text=True)
+    try:
+        if process.stdout.readline().strip() != 'ready':
+            raise RuntimeError(f"importing {', '.join(modules)} failed")
+        return process_usage(process.pid)
+    finally:
+        process.stdin.close()
+        process.wait()
+
+
+def compare(mode):
+    """Compare the startup RSS and CPU cost of the multi-process and unified layouts"""
+    for layout, interpreters in LAYOUTS[mode].items():
+        usages = [measure_interpreter(modules) for modules in interpreters]
+        rss_mb = sum(usage['rss_kb'] for usage in usages) / 1024
+        cpu_seconds = sum(usage['cpu_seconds'] for usage in usages)
+        print(f"{mode} mode, {layout:<8} {len(usages)} interpreter(s): {rss_mb:6.1f} MB RSS, "
+              f"{cpu_seconds:.2f}s CPU to import")
+
+
+if __name__ == '__main__':
+    # unified_daemon.py ap|client   -- run the daemon (started by boot_orchestrator.py)
+    # unified_daemon.py report      -- RSS/CPU of the running RaspiWiFi processes
+    # unified_daemon.py compare [ap|client] -- import cost of both layouts
+    command = sys.argv[1] if len(sys.argv) > 1 else ''
+    if command in ('ap', 'client'):
+        asyncio.run(UnifiedDaemon(command).run())
+    elif command == 'report':
+        report()
+    elif command == 'compare':
+        compare(sys.argv[2] if len(sys.argv) > 2 else 'ap')
+    else:
+        print("usage: unified_daemon.py ap|client|report|compare [ap|client]")
+        sys.exit(1)
@@ -0,0 +1,125 @@
+import hashlib
+import json
+import os
+import re
+import sys
+import tempfile
+import threading
+import time
+
+import raspiwifi_config
+
+PSK_CACHE = '/etc/raspiwifi/psk_cache.json'
+
+# Cached PSKs beyond this many (least recently added first) are dropped
+MAX_ENTRIES = 32
+
+HEX_PSK = re.compile(r'^[0-9a-fA-F]{64}$')
+
+
+def derive_psk(ssid, passphrase):
+    """
+    The 256-bit WPA PSK as 64 hex digits: PBKDF2-HMAC-SHA1 over the
+    passphrase, salted with the SSID, 4096 iterations (IEEE 802.11i).
+    This is what wpa_supplicant and hostapd compute from a passphrase.
+    """
+    return hashlib.pbkdf2_hmac('sha1', passphrase.encode('utf-8'), ssid.encode('utf-8'), 4096, 32).hex()
+
+
+def valid_passphrase(passphrase):
+    return 8 <= len(passphrase.encode('utf-8')) <= 63
+
+
+class PskCache:
+    """
+    Derived PSKs keyed by SSID and a SHA-256 of the passphrase, so the
+    passphrase itself is never written to the cache. Kept in memory and in
+    a root-only JSON file, so a PSK is derived once, not on every start.
+    """
+
+    def __init__(self, path=PSK_CACHE):
+        self.path = path
+        self._lock = threading.Lock()
+        self._entries = None
+
+    def psk(self, ssid, passphrase):
+        """
+        Return the hex PSK for ssid and passphrase, or None if passphrase is
+        not a valid WPA passphrase (the caller then keeps the passphrase).
+        A passphrase that already is a 64 digit hex PSK is returned as is.
+        """
+        if HEX_PSK.match(passphrase):
+            return passphrase.lower()
+        if not valid_passphrase(passphrase):
+            return None
+
+        key = self._key(ssid, passphrase)
+        with self._lock:
+            entries = self._load()
+            if key in entries:
+                return entries[key]
+
+        psk = derive_psk(ssid, passphrase)
+        with self._lock:
+            entries = self._load()
+            entries[key] = psk
+            while len(entries) > MAX_ENTRIES:
+                del entries[next(iter(entries))]
+            try:
+                raspiwifi_config.write_atomic(self.path, json.dumps(entries), default_mode=0o600)
+            except OSError as e:
+                print(f"RaspiWiFi: Could not store PSK cache: {e}")
+        return psk
+
+    @staticmethod
+    def _key(ssid, passphrase):
+        return ssid.encode('utf-8').hex() + ':' + hashlib.sha256(passphrase.encode('utf-8')).hexdigest()
+
+    def _load(self):
+        if self._entries is None:
+            try:
+                with open(self.path, encoding='utf-8') as cache_file:
+                    self._entries = dict(json.load(cache_file))
+            except (OSError, ValueError, TypeError):
+                self._entries = {}
+        return self._entries
+
+
+default_cache = PskCache()
+
+
+def psk(ssid, passphrase):
+    return default_cache.psk(ssid, passphrase)
+
+
+######## BENCHMARK ##########
+
+def benchmark(rounds=20):
+    """
+    Time the PBKDF2 derivation that wpa_supplicant and hostapd run on every
+    start and connect when given a passphrase, against reading the
+    precomputed PSK from the cache.
+    """
+    ssid, passphrase = 'RaspiWiFi Benchmark', 'correct horse battery staple'
+
+    started = time.perf_counter()
+    for _ in range(rounds):
+        derive_psk(ssid, passphrase)
+    derive = (time.perf_counter() - started) / rounds
+
+    with tempfile.TemporaryDirectory() as cache_dir:
+        cache = PskCache(os.path.join(cache_dir, 'psk_cache.json'))
+        cache.psk(ssid, passphrase)
+        started = time.perf_counter()
+        for _ in range(rounds):
+            cache.psk(ssid, passphrase)
+        cached = (time.perf_counter() - started) / rounds
+
+    return {'derive_ms': derive * 1000, 'cached_ms': cached * 1000}
+
+
+if __name__ == '__main__':
+    # python3 wpa_psk.py [rounds] -- per-connect PSK cost with a passphrase vs a precomputed PSK
+    result = benchmark(int(sys.argv[1]) if len(sys.argv) > 1 else 20)
+    print(f"passphrase (PBKDF2 on every start/connect): {result['derive_ms']:.2f} ms")
+    print(f"precomputed psk (cache lookup, once):       {result['cached_ms']:.4f} ms")
@@ -1,7 +1,20 @@
 import os
+import shutil
 import sys
 
-os.system('clear')
+sys.path.append(os.path.join(os.path.dirname(os.path.realpath(__file__)), 'reset_device'))
+import command_runner
+import reset_lib
+
+CRONTAB_LINES = ('# RaspiWiFi Startup', '@reboot root run-parts /etc/cron.raspiwifi/')
+
+def remove_crontab_entries(path='/etc/crontab'):
+    with open(path) as crontab:
+        lines = crontab.read().splitlines(keepends=True)
+    with open(path, 'w') as crontab:
+        crontab.writelines(line for line in lines if line.strip() not in CRONTAB_LINES)
+
+command_runner.run(['clear'], capture=False)
 print()
 print()
 print("#################################")
@@ -15,26 +28,24 @@ print()
 if (uninstall_answer.lower() == "y"):
     print('Uninstalling RaspiWiFi from your system...')
 
-    os.system('cp ' + os.path.dirname(os.path.realpath(__file__)) + '/reset_device/static_files/wpa_supplicant.conf.default /etc/wpa_supplicant/wpa_supplicant.conf')
-    os.system('chmod 600 /etc/wpa_supplicant/wpa_supplicant.conf')
-    os.system('mv /etc/wpa_supplicant/wpa_supplicant.conf.original /etc/wpa_supplicant/wpa_supplicant.conf 2>/dev/null')
-    os.system('rm -rf /etc/raspiwifi')
-    os.system('rm -rf /usr/lib/raspiwifi')
-    os.system('rm -rf /etc/cron.raspiwifi')
-    os.system('rm /etc/dnsmasq.conf')
-    os.system('mv /etc/dnsmasq.conf.original /etc/dnsmasq.conf 2>/dev/null')
-    os.system('rm /etc/hostapd/hostapd.conf')
-    os.system('rm /etc/dhcpcd.conf')
-    os.system('mv /etc/dhcpcd.conf.original /etc/dhcpcd.conf 2>/dev/null')
-    os.system('sed -i \'s/# RaspiWiFi Startup//\' /etc/crontab')
-    os.system('sed -i \'s/@reboot root run-parts \/etc\/cron.raspiwifi\///\' /etc/crontab')
+    default_conf = os.path.join(os.path.dirname(os.path.realpath(__file__)), 'reset_device', 'static_files', 'wpa_supplicant.conf.default')
+    if reset_lib.copy_file(default_conf, '/etc/wpa_supplicant/wpa_supplicant.conf'):
+        os.chmod('/etc/wpa_supplicant/wpa_supplicant.conf', 0o600)
+    reset_lib.move_file('/etc/wpa_supplicant/wpa_supplicant.conf.original', '/etc/wpa_supplicant/wpa_supplicant.conf')
+    for directory in ('/etc/raspiwifi', '/usr/lib/raspiwifi', '/etc/cron.raspiwifi', '/var/log/raspiwifi'):
+        shutil.rmtree(directory, ignore_errors=True)
+    reset_lib.remove_files('/etc/NetworkManager/system-connections/raspiwifi-*.nmconnection',
+                           '/etc/dnsmasq.conf', '/etc/hostapd/hostapd.conf', '/etc/dhcpcd.conf')
+    reset_lib.move_file('/etc/dnsmasq.conf.original', '/etc/dnsmasq.conf')
+    reset_lib.move_file('/etc/dhcpcd.conf.original', '/etc/dhcpcd.conf')
+    remove_crontab_entries()
     
     print()
     print()
     reboot_answer = input('Uninstallation is complete. Would you like to reboot the system now?: ')
 
     if(reboot_answer.lower() == "y"):
-        os.system('reboot')
+        command_runner.run(['reboot'])
 else:
     print()
     print('No changes made. Exiting unistaller...')
\ No newline at end of file
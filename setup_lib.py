@@ -1,5 +1,18 @@
 import os
-import subprocess
+import shutil
+import sys
+import time
+
+sys.path.append(os.path.join(os.path.dirname(os.path.realpath(__file__)), 'libs', 'reset_device'))
+import command_runner
+import raspiwifi_config
+import service_control
+import reset_lib
+
+INSTALL_DIR = '/usr/lib/raspiwifi'
+
+def clear_screen():
+	command_runner.run(['clear'], capture=False)
 
 def cleanup_old_network_connections():
 	"""
@@ -9,104 +22,76 @@ def cleanup_old_network_connections():
 	print("Cleaning up old NetworkManager WiFi connections...")
 	try:
 		# Get list of all NetworkManager connections
-		result = subprocess.run(['nmcli', '-t', '-f', 'NAME,TYPE', 'connection', 'show'], 
-		                       capture_output=True, text=True)
+		result = command_runner.run(['nmcli', '-t', '-f', 'NAME,TYPE', 'connection', 'show'])
 		
-		if result.returncode == 0:
+		if result.ok:
 			connections = result.stdout.strip().split('\n')
 			for conn_line in connections:
 				if conn_line and ':802-11-wireless' in conn_line:
 					name = conn_line.split(':')[0]
 					if name:
 						print(f"Deleting NetworkManager WiFi connection: {name}")
-						subprocess.run(['nmcli', 'connection', 'delete', name], 
-						              capture_output=True)
+						command_runner.run(['nmcli', 'connection', 'delete', name])
 		
 		# Also remove connection files directly
-		os.system('rm -f /etc/NetworkManager/system-connections/*.nmconnection 2>/dev/null')
+		reset_lib.remove_files('/etc/NetworkManager/system-connections/*.nmconnection')
 		print("Old WiFi connections cleaned up successfully")
 		
 	except Exception as e:
 		print(f"Warning: Error cleaning up old connections: {str(e)}")
 
 def install_prereqs():
-	os.system('clear')
-	os.system('apt update')	
-	os.system('clear')
-	os.system('apt install python3 python3-rpi.gpio python3-pip dnsmasq hostapd -y')
-	os.system('clear')
+	clear_screen()
+	command_runner.run(['apt', 'update'], capture=False)
+	clear_screen()
+	command_runner.run(['apt', 'install', 'python3', 'python3-rpi.gpio', 'python3-pip', 'dnsmasq', 'hostapd', '-y'], capture=False)
+	clear_screen()
 	print("Installing Flask web server...")	
-	os.system('pip3 install flask pyopenssl')
+	command_runner.run(['pip3', 'install', 'flask', 'pyopenssl', 'cheroot'], capture=False)
 	
 	# Robust service management during setup
 	print("Configuring system services...")
 	
-	# Function to robustly manage services during setup
-	def setup_service(service_name, should_enable=True, should_start=True):
-		print(f"Setting up {service_name}...")
-		
-		# Unmask first
-		result = os.system(f'systemctl unmask {service_name} 2>/dev/null')
-		if result != 0:
-			print(f"Warning: Could not unmask {service_name}")
-		
-		# Enable if requested
-		if should_enable:
-			result = os.system(f'systemctl enable {service_name} 2>/dev/null')
-			if result != 0:
-				print(f"Warning: Could not enable {service_name}")
-		
-		# Start if requested
-		if should_start:
-			result = os.system(f'systemctl start {service_name} 2>/dev/null')
-			if result != 0:
-				print(f"Warning: Could not start {service_name}")
-		
-		# Verify the service state
-		os.system(f'systemctl is-enabled {service_name} 2>/dev/null && echo "{service_name} is enabled" || echo "{service_name} is not enabled"')
-		if should_start:
-			os.system(f'systemctl is-active {service_name} 2>/dev/null && echo "{service_name} is running" || echo "{service_name} is not running"')
-	
-	# Unmask and enable hostapd and dnsmasq (but don't start them yet)
-	setup_service('hostapd', should_enable=True, should_start=False)
-	setup_service('dnsmasq', should_enable=True, should_start=False)
-	
-	# Disable NetworkManager to avoid conflicts with dhcpcd
-	print("Disabling NetworkManager to avoid network conflicts...")
-	os.system('systemctl disable NetworkManager 2>/dev/null')
-	os.system('systemctl stop NetworkManager 2>/dev/null')
-	
-	# Ensure dhcpcd is enabled and running
-	setup_service('dhcpcd', should_enable=True, should_start=True)
-	
-	os.system('clear')
+	# Unmask and enable hostapd and dnsmasq (but don't start them yet),
+	# disable NetworkManager to avoid conflicts with dhcpcd and ensure
+	# dhcpcd is enabled and running. Only the changes actually needed are
+	# applied, batched into one systemctl call per action.
+	service_control.apply({
+		'hostapd': service_control.want(enabled=True),
+		'dnsmasq': service_control.want(enabled=True),
+		'NetworkManager': service_control.want(enabled=False, active=False),
+		'dhcpcd': service_control.want(enabled=True, active=True),
+	})
+	
+	clear_screen()
 
 def copy_configs(wpa_enabled_choice):
 	# Clean up old NetworkManager WiFi connections before setup
 	cleanup_old_network_connections()
 	
-	os.system('mkdir /usr/lib/raspiwifi')
-	os.system('mkdir /etc/raspiwifi')
-	os.system('cp -a libs/* /usr/lib/raspiwifi/')
-	os.system('mv /etc/wpa_supplicant/wpa_supplicant.conf /etc/wpa_supplicant/wpa_supplicant.conf.original')
-	os.system('rm -f ./tmp/*')
-	os.system('mv /etc/dnsmasq.conf /etc/dnsmasq.conf.original')
-	os.system('cp /usr/lib/raspiwifi/reset_device/static_files/dnsmasq.conf /etc/')
+	os.makedirs(INSTALL_DIR, exist_ok=True)
+	os.makedirs('/etc/raspiwifi', exist_ok=True)
+	shutil.copytree('libs', INSTALL_DIR, symlinks=True, dirs_exist_ok=True)
+	# Installed first: dnsmasq.conf below is rendered from its settings
+	reset_lib.move_file(os.path.join(reset_lib.STATIC_FILES, 'raspiwifi.conf'), raspiwifi_config.CONFIG_PATH)
+	reset_lib.move_file('/etc/wpa_supplicant/wpa_supplicant.conf', '/etc/wpa_supplicant/wpa_supplicant.conf.original')
+	reset_lib.remove_files('./tmp/*')
+	reset_lib.move_file('/etc/dnsmasq.conf', '/etc/dnsmasq.conf.original')
+	reset_lib.write_dnsmasq_conf()
 
 	if wpa_enabled_choice.lower() == "y":
-		os.system('cp /usr/lib/raspiwifi/reset_device/static_files/hostapd.conf.wpa /etc/hostapd/hostapd.conf')
+		reset_lib.copy_file(os.path.join(reset_lib.STATIC_FILES, 'hostapd.conf.wpa'), '/etc/hostapd/hostapd.conf')
 	else:
-		os.system('cp /usr/lib/raspiwifi/reset_device/static_files/hostapd.conf.nowpa /etc/hostapd/hostapd.conf')
+		reset_lib.copy_file(os.path.join(reset_lib.STATIC_FILES, 'hostapd.conf.nowpa'), '/etc/hostapd/hostapd.conf')
 	
-	os.system('mv /etc/dhcpcd.conf /etc/dhcpcd.conf.original')
-	os.system('cp /usr/lib/raspiwifi/reset_device/static_files/dhcpcd.conf /etc/')
-	os.system('mkdir /etc/cron.raspiwifi')
-	os.system('cp /usr/lib/raspiwifi/reset_device/static_files/aphost_bootstrapper /etc/cron.raspiwifi')
-	os.system('chmod +x /etc/cron.raspiwifi/aphost_bootstrapper')
-	os.system('echo "# RaspiWiFi Startup" >> /etc/crontab')
-	os.system('echo "@reboot root run-parts /etc/cron.raspiwifi/" >> /etc/crontab')
-	os.system('mv /usr/lib/raspiwifi/reset_device/static_files/raspiwifi.conf /etc/raspiwifi')
-	os.system('touch /etc/raspiwifi/host_mode')
+	reset_lib.move_file('/etc/dhcpcd.conf', '/etc/dhcpcd.conf.original')
+	reset_lib.copy_file(os.path.join(reset_lib.STATIC_FILES, 'dhcpcd.conf'), '/etc/')
+	os.makedirs(reset_lib.CRON_DIR, exist_ok=True)
+	reset_lib.install_bootstrapper('aphost_bootstrapper')
+	with open('/etc/crontab', 'a') as crontab:
+		crontab.write('# RaspiWiFi Startup\n')
+		crontab.write('@reboot root run-parts /etc/cron.raspiwifi/\n')
+	open('/etc/raspiwifi/host_mode', 'a').close()
 	
 	# Configure static IP for wlan0 before completing setup
 	configure_static_ip()
@@ -115,29 +100,32 @@ def copy_configs(wpa_enabled_choice):
 	ensure_wlan0_static_ip()
 
 def update_main_config_file(entered_ssid, auto_config_choice, auto_config_delay, ssl_enabled_choice, server_port_choice, wpa_enabled_choice, wpa_entered_key):
+	changes = {}
+
 	if entered_ssid != "":
-		os.system('sed -i \'s/RaspiWiFi Setup/' + entered_ssid + '/\' /etc/raspiwifi/raspiwifi.conf')
+		changes['ssid_prefix'] = entered_ssid
 	if wpa_enabled_choice.lower() == "y":
-		os.system('sed -i \'s/wpa_enabled=0/wpa_enabled=1/\' /etc/raspiwifi/raspiwifi.conf')
-		os.system('sed -i \'s/wpa_key=0/wpa_key=' + wpa_entered_key + '/\' /etc/raspiwifi/raspiwifi.conf')
+		changes['wpa_enabled'] = True
+		changes['wpa_key'] = wpa_entered_key
 	if auto_config_choice.lower() == "y":
-		os.system('sed -i \'s/auto_config=0/auto_config=1/\' /etc/raspiwifi/raspiwifi.conf')
+		changes['auto_config'] = True
 	if auto_config_delay != "":
-		os.system('sed -i \'s/auto_config_delay=300/auto_config_delay=' + auto_config_delay + '/\' /etc/raspiwifi/raspiwifi.conf')
+		changes['auto_config_delay'] = auto_config_delay
 	if ssl_enabled_choice.lower() == "y":
-		os.system('sed -i \'s/ssl_enabled=0/ssl_enabled=1/\' /etc/raspiwifi/raspiwifi.conf')
+		changes['ssl_enabled'] = True
 	if server_port_choice != "":
-		os.system('sed -i \'s/server_port=80/server_port=' + server_port_choice + '/\' /etc/raspiwifi/raspiwifi.conf')
+		changes['server_port'] = server_port_choice
+
+	raspiwifi_config.update(**changes)
 
 def configure_static_ip():
 	"""Configure wlan0 with static IP 10.0.0.1 before rebooting"""
 	# Stop any conflicting network managers
-	os.system('systemctl stop NetworkManager 2>/dev/null')
-	os.system('systemctl disable NetworkManager 2>/dev/null')
-	
-	# Ensure dhcpcd is running
-	os.system('systemctl enable dhcpcd')
-	os.system('systemctl start dhcpcd')
+	# and ensure dhcpcd is running
+	service_control.apply({
+		'NetworkManager': service_control.want(enabled=False, active=False),
+		'dhcpcd': service_control.want(enabled=True, active=True),
+	})
 		# Ensure wlan0 has static IP configuration
 	dhcpcd_config = """# RaspiWiFi Configuration
 interface wlan0
@@ -151,38 +139,37 @@ static domain_name_servers=8.8.8.8 8.8.4.4
 		dhcpcd_file.write(dhcpcd_config)
 	
 	# Set the IP immediately using ifconfig (for instant effect)
-	os.system('ip link set wlan0 down')
-	os.system('sleep 1')
-	os.system('ip link set wlan0 up')
-	os.system('sleep 2')
-	os.system('ifconfig wlan0 10.0.0.1 netmask 255.255.255.0 up')
+	command_runner.run(['ip', 'link', 'set', 'wlan0', 'down'])
+	time.sleep(1)
+	command_runner.run(['ip', 'link', 'set', 'wlan0', 'up'])
+	time.sleep(2)
+	command_runner.run(['ifconfig', 'wlan0', '10.0.0.1', 'netmask', '255.255.255.0', 'up'])
 	
 	# Restart dhcpcd service to apply persistent changes
-	os.system('systemctl restart dhcpcd')
+	service_control.apply({'dhcpcd': service_control.want(restart=True)})
 	
 	# Give it a moment to apply
-	os.system('sleep 3')
+	time.sleep(3)
 	
 	# Verify the IP was set correctly
-	os.system('ifconfig wlan0 | grep "inet 10.0.0.1"')
+	print(f"wlan0 address: {reset_lib.interface_ipv4_address('wlan0')}")
 
 def ensure_wlan0_static_ip():
 	"""Ensure wlan0 always has the static IP when in AP mode"""
 	# Check if we're in host mode (AP mode)
 	if os.path.exists('/etc/raspiwifi/host_mode'):
 		# Stop NetworkManager if it's running
-		os.system('systemctl stop NetworkManager 2>/dev/null')
+		service_control.apply({'NetworkManager': service_control.want(active=False)})
 		
 		# Set static IP immediately
-		os.system('ip link set wlan0 down 2>/dev/null')
-		os.system('sleep 1')
-		os.system('ip link set wlan0 up')
-		os.system('sleep 1')
-		os.system('ifconfig wlan0 10.0.0.1 netmask 255.255.255.0 up')
+		command_runner.run(['ip', 'link', 'set', 'wlan0', 'down'])
+		time.sleep(1)
+		command_runner.run(['ip', 'link', 'set', 'wlan0', 'up'])
+		time.sleep(1)
+		command_runner.run(['ifconfig', 'wlan0', '10.0.0.1', 'netmask', '255.255.255.0', 'up'])
 		
 		# Verify it worked
-		result = os.system('ifconfig wlan0 | grep "inet 10.0.0.1" > /dev/null')
-		if result != 0:
+		if reset_lib.interface_ipv4_address('wlan0') != '10.0.0.1':
 			print("Warning: Failed to set wlan0 static IP")
 		else:
 			print("wlan0 static IP set successfully")
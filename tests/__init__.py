@@ -0,0 +1,8 @@
+import os
+import sys
+
+# The tests import the modules the way the installed apps do, from
+# /usr/lib/raspiwifi/reset_device and /usr/lib/raspiwifi/configuration_app
+LIBS = os.path.join(os.path.dirname(os.path.realpath(__file__)), '..', 'libs')
+for directory in ('reset_device', 'configuration_app'):
+    sys.path.insert(0, os.path.join(LIBS, directory))
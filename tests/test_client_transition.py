@@ -0,0 +1,130 @@
+import inspect
+import json
+import os
+import re
+import tempfile
+import time
+import unittest
+from unittest import mock
+
+import client_transition
+from client_transition import STATE_DEADLINES, TERMINAL_STATES, ClientTransition
+
+PROFILE = {'interface': 'wlan1', 'backend': 'networkmanager', 'wpa_driver': 'nl80211'}
+
+
+def state_methods():
+    return {name[len('state_'):]: method for name, method in inspect.getmembers(ClientTransition, inspect.isfunction)
+            if name.startswith('state_')}
+
+
+class StateTableTest(unittest.TestCase):
+
+    def test_every_state_has_a_deadline(self):
+        self.assertEqual(set(state_methods()), set(STATE_DEADLINES))
+
+    def test_states_only_move_to_known_states(self):
+        for state, method in state_methods().items():
+            targets = set(re.findall(r"return '(\w+)'", inspect.getsource(method)))
+            with self.subTest(state=state):
+                self.assertTrue(targets)
+                self.assertLessEqual(targets, set(STATE_DEADLINES) | set(TERMINAL_STATES))
+
+    def test_terminal_states_have_no_handler(self):
+        self.assertFalse(set(TERMINAL_STATES) & set(state_methods()))
+
+
+class WaitForTest(unittest.TestCase):
+
+    def test_condition_already_true(self):
+        self.assertTrue(client_transition.wait_for(lambda: True, time.monotonic() - 1))
+
+    def test_deadline_passes(self):
+        started = time.monotonic()
+        self.assertFalse(client_transition.wait_for(lambda: False, started + 0.05, interval=0.01))
+        self.assertGreaterEqual(time.monotonic() - started, 0.05)
+
+    def test_cancelled(self):
+        self.assertFalse(client_transition.wait_for(lambda: False, time.monotonic() + 60, cancelled=lambda: True))
+
+
+class ScriptedTransition(ClientTransition):
+    """Runs the real state loop over scripted states instead of the network"""
+
+    def __init__(self, script, cancel_after=None, **options):
+        self.messages = []
+        super().__init__('Home', 'password', log=lambda message, is_error=False, phase=None: self.messages.append(message),
+                         update_status=lambda status: None, profile=PROFILE, **options)
+        self.script = script
+        self.deadlines = {}
+        for state, next_state in script.items():
+            setattr(self, 'state_' + state, self._scripted(state, next_state))
+
+    def _scripted(self, state, next_state):
+        def run_state(deadline):
+            self.deadlines[state] = deadline - time.monotonic()
+            if isinstance(next_state, Exception):
+                raise next_state
+            return next_state
+        return run_state
+
+
+class RunTest(unittest.TestCase):
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.timeline_file = os.path.join(directory.name, 'transition.json')
+        patcher = mock.patch.object(client_transition, 'TIMELINE_FILE', self.timeline_file)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_interface_comes_from_the_profile(self):
+        self.assertEqual(ScriptedTransition({}).interface, 'wlan1')
+
+    def test_runs_states_to_connected_within_their_deadlines(self):
+        transition = ScriptedTransition({
+            'stop_ap': 'configure_dhcpcd',
+            'configure_dhcpcd': 'start_networkmanager',
+            'start_networkmanager': 'nm_connect',
+            'nm_connect': 'nm_wait_address',
+            'nm_wait_address': 'connected',
+        })
+        self.assertTrue(transition.run())
+        self.assertEqual([entry['state'] for entry in transition.timeline],
+                         ['stop_ap', 'configure_dhcpcd', 'start_networkmanager', 'nm_connect', 'nm_wait_address', 'connected'])
+        for state, remaining in transition.deadlines.items():
+            self.assertAlmostEqual(remaining, STATE_DEADLINES[state], delta=1)
+        with open(self.timeline_file, encoding='utf-8') as timeline_file:
+            saved = json.load(timeline_file)
+        self.assertEqual((saved['result'], len(saved['states'])), ('connected', 6))
+
+    def test_exception_fails_the_transition(self):
+        transition = ScriptedTransition({'stop_ap': RuntimeError('ip: not found')})
+        self.assertFalse(transition.run())
+        self.assertEqual(transition.state, 'failed')
+        self.assertIn('Transition state stop_ap failed: ip: not found', transition.messages)
+
+    def test_cancel_between_states(self):
+        cancelled = []
+        transition = ScriptedTransition({'configure_dhcpcd': 'start_networkmanager'}, cancelled=lambda: bool(cancelled))
+        # A newer request cancels while stop_ap runs
+        transition.state_stop_ap = lambda deadline: cancelled.append(True) or 'configure_dhcpcd'
+        self.assertFalse(transition.run())
+        self.assertEqual([entry['state'] for entry in transition.timeline], ['stop_ap', 'cancelled'])
+        self.assertEqual(transition.timeline[0]['next'], 'cancelled')
+
+    def test_failure_is_not_reported_as_cancelled_unless_cancelled(self):
+        transition = ScriptedTransition({'stop_ap': 'failed'})
+        self.assertFalse(transition.run())
+        self.assertEqual(transition.state, 'failed')
+
+    def test_phase_events(self):
+        events = []
+        transition = ScriptedTransition({'stop_ap': 'failed'}, publish=lambda event, data: events.append((event, data)))
+        transition.run()
+        self.assertEqual([(data['state'], data['next']) for _, data in events], [('stop_ap', 'failed'), ('failed', None)])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,95 @@
+import threading
+import unittest
+
+from job_queue import JobQueue
+
+TIMEOUT = 5
+
+
+class JobQueueTest(unittest.TestCase):
+
+    def setUp(self):
+        self.events = []
+        self.messages = []
+        self.queue = JobQueue(publish=lambda event, data: self.events.append((data['id'], data['state'])),
+                              log=self.messages.append)
+        self.started = threading.Event()
+        self.release = threading.Event()
+
+    def tearDown(self):
+        self.release.set()
+
+    def blocking(self, job):
+        self.started.set()
+        while not job.cancelled() and not self.release.is_set():
+            job.sleep(0.01)
+
+    def wait_finished(self, job):
+        done = threading.Event()
+        self.queue.submit('wait', lambda _: done.set())
+        self.assertTrue(done.wait(TIMEOUT))
+        self.assertIn(job.state, ('done', 'failed', 'superseded'))
+
+    def test_jobs_run_one_at_a_time_in_order(self):
+        order = []
+        running = self.queue.submit('connect', self.blocking)
+        self.assertTrue(self.started.wait(TIMEOUT))
+        second = self.queue.submit('ap_settings', lambda job: order.append('ap_settings'))
+        self.assertEqual(second.state, 'queued')
+        self.release.set()
+        self.wait_finished(second)
+        self.assertEqual((running.state, second.state, order), ('done', 'done', ['ap_settings']))
+
+    def test_supersede_drops_queued_and_cancels_running_of_the_same_kind(self):
+        running = self.queue.submit('connect', self.blocking)
+        self.assertTrue(self.started.wait(TIMEOUT))
+        queued = self.queue.submit('connect', lambda job: None)
+        newest = self.queue.submit('connect', lambda job: None, supersede=True)
+        self.assertEqual(queued.state, 'superseded')
+        self.assertTrue(running.cancelled())
+        self.wait_finished(newest)
+        self.assertEqual((running.state, newest.state), ('superseded', 'done'))
+        self.assertIn((queued.id, 'superseded'), self.events)
+        self.assertEqual(self.messages, [
+            f"Dropped queued connect job {queued.id}: superseded by job {newest.id}",
+            f"Cancelling running connect job {running.id}: superseded by job {newest.id}",
+        ])
+
+    def test_supersede_leaves_other_kinds_alone(self):
+        running = self.queue.submit('ap_settings', self.blocking)
+        self.assertTrue(self.started.wait(TIMEOUT))
+        queued = self.queue.submit('ap_settings', lambda job: None)
+        newest = self.queue.submit('connect', lambda job: None, supersede=True)
+        self.assertFalse(running.cancelled())
+        self.assertEqual(queued.state, 'queued')
+        self.assertEqual(self.messages, [])
+        self.release.set()
+        self.wait_finished(newest)
+        self.assertEqual((running.state, queued.state, newest.state), ('done', 'done', 'done'))
+
+    def test_failed_job_keeps_its_error(self):
+        def fail(job):
+            raise RuntimeError('no interface')
+        job = self.queue.submit('connect', fail)
+        self.wait_finished(job)
+        self.assertEqual((job.state, job.error), ('failed', 'no interface'))
+
+    def test_history_drops_only_finished_jobs(self):
+        queue = JobQueue(history=2)
+        running = queue.submit('connect', self.blocking)
+        self.assertTrue(self.started.wait(TIMEOUT))
+        for _ in range(3):
+            queue.submit('connect', lambda job: None)
+        # Nothing has finished yet, so nothing is dropped
+        self.assertEqual(len(queue.jobs()), 4)
+        self.release.set()
+        done = threading.Event()
+        queue.submit('wait', lambda _: done.set())
+        self.assertTrue(done.wait(TIMEOUT))
+        last = queue.submit('connect', lambda job: None)
+        self.assertIsNone(queue.get(running.id))
+        self.assertIs(queue.get(last.id), last)
+        self.assertLessEqual(len(queue.jobs()), 3)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,90 @@
+import unittest
+
+import metrics
+
+
+class RenderTest(unittest.TestCase):
+
+    def setUp(self):
+        self.registry = metrics.Registry()
+
+    def test_counter_and_gauge(self):
+        connects = self.registry.counter('raspiwifi_connects_total', 'Connection attempts')
+        connects.inc(result='ok')
+        connects.inc(2, result='failed')
+        self.registry.gauge('raspiwifi_up', 'Up').set(1.5)
+        self.assertEqual(self.registry.render().splitlines(), [
+            '# HELP raspiwifi_connects_total Connection attempts',
+            '# TYPE raspiwifi_connects_total counter',
+            'raspiwifi_connects_total{result="failed"} 2',
+            'raspiwifi_connects_total{result="ok"} 1',
+            '# HELP raspiwifi_up Up',
+            '# TYPE raspiwifi_up gauge',
+            'raspiwifi_up 1.5',
+        ])
+
+    def test_histogram_buckets_are_cumulative(self):
+        histogram = self.registry.histogram('raspiwifi_scan_seconds', 'Scan time', buckets=(1, 5))
+        for value in (0.5, 2, 7):
+            histogram.observe(value)
+        self.assertEqual(self.registry.render().splitlines()[2:], [
+            'raspiwifi_scan_seconds_bucket{le="1"} 1',
+            'raspiwifi_scan_seconds_bucket{le="5"} 2',
+            'raspiwifi_scan_seconds_bucket{le="+Inf"} 3',
+            'raspiwifi_scan_seconds_sum 9.5',
+            'raspiwifi_scan_seconds_count 3',
+        ])
+
+    def test_label_values_are_escaped(self):
+        self.registry.counter('raspiwifi_failures_total', 'Failures').inc(reason='say "hi"\\\n')
+        self.assertIn('raspiwifi_failures_total{reason="say \\"hi\\"\\\\\\n"} 1', self.registry.render())
+
+    def test_process_label_on_metrics_and_collectors(self):
+        self.registry.counter('raspiwifi_scans_total', 'Scans').inc(interface='wlan0')
+        self.registry.collector(lambda: ['# TYPE raspiwifi_extra gauge', 'raspiwifi_extra 1',
+                                         'raspiwifi_labelled{a="b"} 2', 'raspiwifi_empty{} 3'])
+        lines = self.registry.render(process='portal').splitlines()
+        self.assertIn('raspiwifi_scans_total{process="portal",interface="wlan0"} 1', lines)
+        self.assertIn('# TYPE raspiwifi_extra gauge', lines)
+        self.assertIn('raspiwifi_extra{process="portal"} 1', lines)
+        self.assertIn('raspiwifi_labelled{process="portal",a="b"} 2', lines)
+        self.assertIn('raspiwifi_empty{process="portal"} 3', lines)
+
+    def test_same_name_returns_the_same_metric(self):
+        counter = self.registry.counter('raspiwifi_x_total', 'X')
+        self.assertIs(self.registry.counter('raspiwifi_x_total', 'X'), counter)
+        with self.assertRaises(ValueError):
+            self.registry.gauge('raspiwifi_x_total', 'X')
+
+    def test_empty_registry(self):
+        self.assertEqual(self.registry.render(), '')
+
+
+class MergeTest(unittest.TestCase):
+
+    def test_one_help_and_type_per_family(self):
+        portal, reset = metrics.Registry(), metrics.Registry()
+        portal.counter('raspiwifi_commands_total', 'Commands run').inc(command='iwlist')
+        reset.counter('raspiwifi_commands_total', 'Commands run').inc(command='iw')
+        reset.gauge('raspiwifi_armed', 'Armed').set(1)
+        merged = metrics.merge(portal.render(process='portal'), reset.render(process='reset'))
+        self.assertEqual(merged.splitlines(), [
+            '# HELP raspiwifi_commands_total Commands run',
+            '# TYPE raspiwifi_commands_total counter',
+            'raspiwifi_commands_total{process="portal",command="iwlist"} 1',
+            'raspiwifi_commands_total{process="reset",command="iw"} 1',
+            '# HELP raspiwifi_armed Armed',
+            '# TYPE raspiwifi_armed gauge',
+            'raspiwifi_armed{process="reset"} 1',
+        ])
+
+    def test_duplicate_samples_are_dropped(self):
+        text = '# TYPE raspiwifi_up gauge\nraspiwifi_up 1\n'
+        self.assertEqual(metrics.merge(text, text, ''), text)
+
+    def test_nothing_to_merge(self):
+        self.assertEqual(metrics.merge('', '\n'), '')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,97 @@
+import unittest
+
+import scan_parser
+from scan_parser import WifiNetwork, parse_iwlist, rank_networks
+
+DUMP = '''wlan0     Scan completed :
+          Cell 01 - Address: aa:bb:cc:00:00:01
+                    Channel:6
+                    Frequency:2.437 GHz (Channel 6)
+                    Quality=40/70  Signal level=-70 dBm
+                    Encryption key:on
+                    ESSID:"Home"
+                    IE: IEEE 802.11i/WPA2 Version 1
+                    IE: WPA Version 1
+          Cell 02 - Address: AA:BB:CC:00:00:02
+                    Frequency:5.18 GHz
+                    Quality=60/70  Signal level=-45 dBm
+                    Encryption key:on
+                    ESSID:"Home"
+                    IE: IEEE 802.11i/WPA2 Version 1
+          Cell 03 - Address: AA:BB:CC:00:00:03
+                    Frequency:2.412 GHz (Channel 1)
+                    Quality=35/100  Signal level=35/100
+                    Encryption key:off
+                    ESSID:"Caf\\xC3\\xA9"
+          Cell 04 - Address: AA:BB:CC:00:00:04
+                    Frequency:2.462 GHz (Channel 11)
+                    Signal level=-60 dBm
+                    Encryption key:on
+                    ESSID:""
+'''.splitlines(keepends=True)
+
+
+class ParseIwlistTest(unittest.TestCase):
+
+    def setUp(self):
+        self.cells = list(parse_iwlist(DUMP))
+
+    def test_one_network_per_cell(self):
+        self.assertEqual([cell.bssid for cell in self.cells],
+                         ['AA:BB:CC:00:00:01', 'AA:BB:CC:00:00:02', 'AA:BB:CC:00:00:03', 'AA:BB:CC:00:00:04'])
+
+    def test_fields(self):
+        first = self.cells[0]
+        self.assertEqual((first.ssid, first.signal, first.channel, first.frequency), ('Home', -70, 6, 2437))
+
+    def test_channel_from_frequency(self):
+        self.assertEqual((self.cells[1].frequency, self.cells[1].channel), (5180, 36))
+
+    def test_relative_signal_level(self):
+        self.assertEqual(self.cells[2].signal, -83)
+
+    def test_encryption(self):
+        self.assertEqual([cell.encryption for cell in self.cells], ['WPA/WPA2', 'WPA2', 'open', 'WEP'])
+
+    def test_escaped_utf8_essid(self):
+        self.assertEqual(self.cells[2].ssid, 'Café')
+
+    def test_hidden_network(self):
+        self.assertTrue(self.cells[3].is_hidden)
+        self.assertFalse(self.cells[0].is_hidden)
+
+    def test_lines_before_the_first_cell_are_ignored(self):
+        self.assertEqual(list(parse_iwlist(['wlan0     Scan completed :\n', 'ESSID:"stray"\n'])), [])
+
+
+class RankNetworksTest(unittest.TestCase):
+
+    def setUp(self):
+        self.cells = list(parse_iwlist(DUMP))
+
+    def test_strongest_cell_per_ssid_first(self):
+        ranked = rank_networks(self.cells)
+        self.assertEqual([(network.ssid, network.bssid) for network in ranked],
+                         [('Home', 'AA:BB:CC:00:00:02'), ('Café', 'AA:BB:CC:00:00:03')])
+
+    def test_hidden_networks_are_kept_apart_by_bssid(self):
+        hidden = [WifiNetwork('AA:00:00:00:00:01', signal=-50), WifiNetwork('AA:00:00:00:00:02', signal=-60)]
+        self.assertEqual(len(rank_networks(hidden, include_hidden=True)), 2)
+
+    def test_filters_and_limit(self):
+        self.assertEqual([n.ssid for n in rank_networks(self.cells, secured=False)], ['Café'])
+        self.assertEqual([n.ssid for n in rank_networks(self.cells, min_signal=-50)], ['Home'])
+        self.assertEqual(len(rank_networks(self.cells, limit=1)), 1)
+
+    def test_unknown_signal_ranks_last(self):
+        ranked = rank_networks([WifiNetwork('AA:00:00:00:00:01', 'a'), WifiNetwork('AA:00:00:00:00:02', 'b', signal=-90)])
+        self.assertEqual([network.ssid for network in ranked], ['b', 'a'])
+
+    def test_synthetic_dump(self):
+        cells = list(parse_iwlist(scan_parser._synthetic_dump(30)))
+        self.assertEqual(len(cells), 30)
+        self.assertEqual(len(rank_networks(cells)), 10)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,78 @@
+import contextlib
+import io
+import os
+import tempfile
+import unittest
+
+from status_log import StatusLog
+
+
+class StatusLogTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+        self.path = os.path.join(self.directory.name, 'status.log')
+
+    def status_log(self, **options):
+        # A long interval so only explicit (or urgent) flushes write
+        options.setdefault('flush_interval', 3600)
+        options.setdefault('echo_level', 'error')
+        log = StatusLog(self.path, **options)
+        # Write what is left while the directory still exists, not at exit
+        self.addCleanup(log.flush)
+        return log
+
+    def test_ring_buffer_keeps_the_newest_records(self):
+        log = self.status_log(capacity=3)
+        for index in range(5):
+            log.record(f'message {index}')
+        self.assertEqual([record['seq'] for record in log.query()], [3, 4, 5])
+        self.assertEqual(log.last_seq, 5)
+
+    def test_query_filters(self):
+        log = self.status_log()
+        log.record('scan', phase='stop_ap')
+        log.record('slow', level='warning', phase='nm_connect')
+        log.record('debug', level='debug', phase='nm_connect')
+        with contextlib.redirect_stdout(io.StringIO()):
+            log.record('failed', level='error', phase='nm_connect')
+        self.assertEqual([r['message'] for r in log.query(since=1)], ['slow', 'debug', 'failed'])
+        self.assertEqual([r['message'] for r in log.query(level='warning')], ['slow', 'failed'])
+        self.assertEqual([r['message'] for r in log.query(phase='nm_connect', level='info')], ['slow', 'failed'])
+        self.assertEqual([r['message'] for r in log.query(limit=2)], ['debug', 'failed'])
+
+    def test_records_at_echo_level_are_printed(self):
+        log = self.status_log(echo_level='warning')
+        with contextlib.redirect_stdout(io.StringIO()) as output:
+            log.record('quiet')
+            log.record('loud', level='warning', phase='wpa_associate')
+        self.assertNotIn('quiet', output.getvalue())
+        self.assertIn('WARNING [wpa_associate] loud', output.getvalue())
+
+    def test_flush_writes_pending_records_once(self):
+        log = self.status_log()
+        log.record('first')
+        log.record('second')
+        log.flush()
+        log.flush()
+        with open(self.path, encoding='utf-8') as log_file:
+            lines = log_file.read().splitlines()
+        self.assertEqual(len(lines), 2)
+        self.assertTrue(lines[0].endswith('INFO first'))
+
+    def test_rotation(self):
+        log = self.status_log(max_bytes=200, backups=2)
+        for index in range(12):
+            log.record(f'record number {index}')
+            log.flush()
+        self.assertTrue(os.path.exists(self.path + '.1'))
+        self.assertTrue(os.path.exists(self.path + '.2'))
+        self.assertFalse(os.path.exists(self.path + '.3'))
+        self.assertLessEqual(os.path.getsize(self.path), 200)
+        with open(self.path, encoding='utf-8') as log_file:
+            self.assertIn('record number 11', log_file.read())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,60 @@
+import json
+import os
+import tempfile
+import unittest
+
+import wpa_psk
+
+
+class DerivePskTest(unittest.TestCase):
+
+    def test_ieee_802_11i_vectors(self):
+        # IEEE 802.11i-2004, Annex H.4.2
+        self.assertEqual(wpa_psk.derive_psk('IEEE', 'password'),
+                         'f42c6fc52df0ebef9ebb4b90b38a5f902e83fe1b135a70e23aed762e9710a12e')
+        self.assertEqual(wpa_psk.derive_psk('ThisIsASSID', 'ThisIsAPassword'),
+                         '0dc0d6eb90555ed6419756b9a15ec3e3209b63df707dd508d14581f8982721af')
+
+    def test_passphrase_length(self):
+        self.assertFalse(wpa_psk.valid_passphrase('short'))
+        self.assertTrue(wpa_psk.valid_passphrase('x' * 8))
+        self.assertTrue(wpa_psk.valid_passphrase('x' * 63))
+        self.assertFalse(wpa_psk.valid_passphrase('x' * 64))
+
+
+class PskCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, 'psk_cache.json')
+        self.cache = wpa_psk.PskCache(self.path)
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_derives_once_and_stores_no_passphrase(self):
+        psk = self.cache.psk('IEEE', 'password')
+        self.assertEqual(psk, wpa_psk.derive_psk('IEEE', 'password'))
+        with open(self.path, encoding='utf-8') as cache_file:
+            stored = cache_file.read()
+        self.assertIn(psk, stored)
+        self.assertNotIn('password', stored)
+        self.assertEqual(os.stat(self.path).st_mode & 0o777, 0o600)
+        self.assertEqual(wpa_psk.PskCache(self.path).psk('IEEE', 'password'), psk)
+
+    def test_hex_psk_is_kept_and_invalid_passphrase_rejected(self):
+        self.assertEqual(self.cache.psk('IEEE', 'AB' * 32), 'ab' * 32)
+        self.assertIsNone(self.cache.psk('IEEE', 'short'))
+        self.assertFalse(os.path.exists(self.path))
+
+    def test_oldest_entries_are_dropped(self):
+        self.cache._entries = {f'{index}': 'psk' for index in range(wpa_psk.MAX_ENTRIES)}
+        self.cache.psk('IEEE', 'password')
+        with open(self.path, encoding='utf-8') as cache_file:
+            entries = json.load(cache_file)
+        self.assertEqual(len(entries), wpa_psk.MAX_ENTRIES)
+        self.assertNotIn('0', entries)
+
+
+if __name__ == '__main__':
+    unittest.main()